@@ -1,51 +1,139 @@
-from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db
-from models import Doctor
-
-SECRET_KEY = "your-secret-key-change-in-production-09876543210"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_doctor(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    doctor = db.query(Doctor).filter(Doctor.email == email).first()
-    if doctor is None:
-        raise credentials_exception
-    return doctor
\ No newline at end of file
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from jose import JWTError, jwt
+from passlib.context import CryptContext
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import LRUCache
+from config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL, AUTH_TOKEN_CLAIMS, BCRYPT_ROUNDS
+from database import get_db
+from executors import auth_pool
+from models import Doctor
+
+SECRET_KEY = "your-secret-key-change-in-production-09876543210"
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+
+# min/max pinned to the configured cost so hashes made with any other cost
+# are reported as needing an update (rehashed on login)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+
+@dataclass(frozen=True)
+class DoctorPrincipal:
+    """The authenticated doctor as seen by endpoints; safe to share across requests"""
+    id: int
+    email: str
+    full_name: str
+    license_number: str
+
+    @classmethod
+    def from_doctor(cls, doctor: Doctor):
+        return cls(doctor.id, doctor.email, doctor.full_name, doctor.license_number)
+
+# Token subject (email) -> DoctorPrincipal. The token itself is still
+# verified on every request, so expiry is enforced as before. Invalidation
+# below only reaches this process; see AUTH_CACHE_TTL.
+principal_cache = LRUCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL, name="auth_principal")
+
+@event.listens_for(Doctor, "after_update")
+@event.listens_for(Doctor, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    """Profile or password changes must not be served from the cache"""
+    principal_cache.pop(target.email)
+    for old_email in inspect(target).attrs.email.history.deleted:
+        principal_cache.pop(old_email)
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+async def hash_password(password):
+    """get_password_hash on the auth pool, off the event loop"""
+    return await auth_pool.run(get_password_hash, password)
+
+async def verify_and_rehash(plain_password, hashed_password):
+    """
+    Verifies on the auth pool. Returns (valid, new_hash); new_hash is set
+    when the stored hash uses another bcrypt cost and should be replaced.
+    """
+    return await auth_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def token_claims(doctor: Doctor):
+    """Claims for a new access token; see AUTH_TOKEN_CLAIMS"""
+    claims = {"sub": doctor.email}
+    if AUTH_TOKEN_CLAIMS:
+        claims.update({"id": doctor.id, "name": doctor.full_name, "license": doctor.license_number})
+    return claims
+
+async def get_current_doctor(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        email: str = payload.get("sub")
+        if email is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    
+    # Tokens issued with AUTH_TOKEN_CLAIMS carry the whole principal
+    if "id" in payload:
+        return DoctorPrincipal(payload["id"], email, payload.get("name"), payload.get("license"))
+    
+    principal = principal_cache.get(email)
+    if principal is not None:
+        return principal
+    
+    doctor = await db.scalar(select(Doctor).where(Doctor.email == email))
+    if doctor is None:
+        raise credentials_exception
+    principal = DoctorPrincipal.from_doctor(doctor)
+    principal_cache.put(email, principal)
+    return principal
+
+def benchmark(rounds_range=range(10, 15), repeats=3):
+    """Prints the time one hash takes at each bcrypt cost"""
+    import time
+    print(f"bcrypt cost benchmark (BCRYPT_ROUNDS = {BCRYPT_ROUNDS})")
+    for rounds in rounds_range:
+        context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            context.hash("benchmark-password")
+        ms = (time.perf_counter() - start) * 1000 / repeats
+        print(f"  rounds={rounds}: {ms:7.1f} ms per hash, ~{1000 / ms:.1f} logins/s per worker")
+    print("Pick the highest cost that keeps a login around 250 ms on the production CPU")
+
+if __name__ == "__main__":
+    import sys
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        print("Usage: python auth.py --benchmark")
\ No newline at end of file
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+
+
+class BatchScheduler:
+    """
+    Groups concurrent inference requests into a single forward pass.
+
+    Callers await submit() with one preprocessed image. The first waiting
+    request opens a batch which is closed once max_batch_size items are
+    queued or max_wait_ms has elapsed, whichever comes first. The stacked
+    batch is handed to infer_fn on a dedicated model thread and every caller
+    receives the result at its own position.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=10):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self._queue = None
+        self._worker = None
+        # One forward pass at a time; TensorFlow parallelises inside the op
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, item):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def run_in_model_thread(self, fn, *args):
+        """Run other model work (e.g. Grad-CAM) on the same thread as the batches"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _infer(self, inputs):
+        with metrics.batch_seconds.time():
+            return self.infer_fn(inputs)
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Anything already waiting joins for free
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for _, _, queued in batch:
+                metrics.batch_wait_seconds.observe(started - queued)
+
+            # Callers that gave up (client disconnect) don't need a slot
+            batch = [(item, future) for item, future, _ in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            metrics.batch_size.observe(len(batch))
+            try:
+                # Inside the try: a mismatched input must fail its batch, not this task
+                inputs = np.stack([item for item, _ in batch])
+                results = await loop.run_in_executor(self._executor, self._infer, inputs)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
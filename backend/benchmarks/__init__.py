@@ -0,0 +1,31 @@
+"""
+Reproducible benchmarks for the inference, reporting and API hot paths
+
+Run from backend/; everything happens inside one work directory (default
+bench_run/) that plays the part of backend/ for the app: the stub model in
+model/best_model.h5, database.db, uploads/ and reports/.
+
+    python -m benchmarks stub-model                  # ResNet50-shaped model, random weights
+    python -m benchmarks micro --output micro.json   # decode ... Grad-CAM ... PDF report
+    python -m benchmarks data --scans 1000000 --doctors 2000
+    python -m benchmarks load --serve --users 16 --output load.json
+    python -m benchmarks compare before.json after.json
+
+No GPU or network is used: TensorFlow is pinned to the CPU, the stub
+model has the input and output shapes of best_model.h5 but is built
+locally, and the load generator talks to a server on 127.0.0.1. Every
+command writes JSON with the same layout, so any two runs of a suite can
+be compared.
+"""
+
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# App modules are imported after changing into the work directory
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import sys
+
+import benchmarks
+from benchmarks.common import DEFAULT_WORKDIR, MODEL_FILE, enter_workdir
+
+def _int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+def stub_model(args):
+    from benchmarks.stub_model import write_stub_model
+
+    write_stub_model(MODEL_FILE, args.architecture, args.seed, overwrite=True)
+    return 0
+
+def compare(args):
+    """
+    Side-by-side p50/p95 and throughput of two result files of the same
+    suite. Exits with 1 when any p50 got slower by more than --threshold %.
+    """
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["suite"] != candidate["suite"]:
+        print(f"❌ Different suites: {baseline['suite']} vs {candidate['suite']}")
+        return 2
+
+    print(f"{'benchmark':<28} {'p50 ms':>19} {'change':>8} {'p95 ms':>19} {'per s':>17}")
+    regressions = []
+    for name, new in candidate["results"].items():
+        old = baseline["results"].get(name)
+        if not old or not old.get("count") or not new.get("count"):
+            continue
+        change = (new["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        flag = " ⚠️" if change > args.threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<28} {old['p50_ms']:>9.2f}→{new['p50_ms']:<9.2f} {change:>+7.1f}% "
+              f"{old['p95_ms']:>9.2f}→{new['p95_ms']:<9.2f} "
+              f"{old.get('per_second') or 0:>8.1f}→{new.get('per_second') or 0:<8.1f}{flag}")
+
+    for key in ("git_commit", "cpu_count", "settings"):
+        if baseline["environment"].get(key) != candidate["environment"].get(key):
+            print(f"ℹ️  {key} differs: {baseline['environment'].get(key)} vs {candidate['environment'].get(key)}")
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} benchmark(s) slower by more than {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=benchmarks.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, func, help):
+        sub = commands.add_parser(name, help=help)
+        sub.set_defaults(func=func)
+        if name != "compare":
+            sub.add_argument('--workdir', default=DEFAULT_WORKDIR, help='Stands in for backend/ (default: %(default)s)')
+            sub.add_argument('--seed', type=int, default=0)
+        return sub
+
+    from benchmarks import load, micro, synthetic_data
+    from benchmarks.stub_model import ARCHITECTURES
+
+    sub = command("stub-model", stub_model, "Write a stub best_model.h5 (random weights) into the work directory")
+    sub.add_argument('--architecture', choices=ARCHITECTURES, default="resnet50")
+
+    sub = command("micro", micro.run, "Time the pipeline stages and the PDF report in-process")
+    sub.add_argument('--architecture', choices=ARCHITECTURES, default="resnet50", help='Stub built if no model exists')
+    sub.add_argument('--repeat', type=int, default=20)
+    sub.add_argument('--warmup', type=int, default=3)
+    sub.add_argument('--batch-sizes', type=_int_list, default=[1, 8])
+    sub.add_argument('--image-size', type=int, default=512, help='Side of the synthetic upload in pixels')
+    sub.add_argument('--only', help='Comma-separated name prefixes, e.g. decode,infer')
+    sub.add_argument('--output', help='Write the results as JSON')
+
+    sub = command("data", synthetic_data.run, "Fill the work directory's database.db with synthetic scans")
+    sub.add_argument('--doctors', type=int, default=2000)
+    sub.add_argument('--scans', type=int, default=1_000_000)
+    sub.add_argument('--days', type=int, default=730)
+    sub.add_argument('--patients-per-doctor', type=int, default=500)
+    sub.add_argument('--tumor-rate', type=float, default=0.4)
+
+    sub = command("load", load.run, "Closed-loop load on /predict, /scans and /stats")
+    sub.add_argument('--url', help='Running server (default with --serve: a local one)')
+    sub.add_argument('--serve', action='store_true', help='Start the API from the work directory for the run')
+    sub.add_argument('--port', type=int, default=8765)
+    sub.add_argument('--metrics-token', default=os.getenv("METRICS_TOKEN"),
+                     help='METRICS_TOKEN of the --url server, for the per-stage breakdown (--serve makes its own)')
+    sub.add_argument('--architecture', choices=ARCHITECTURES, default="resnet50", help='Stub built if no model exists')
+    sub.add_argument('--users', type=int, default=16, help='Concurrent virtual users')
+    sub.add_argument('--seconds', type=float, default=30, help='Measured duration')
+    sub.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds before that')
+    sub.add_argument('--mix', default="predict=1,scans=6,stats=3", help='Endpoint weights')
+    sub.add_argument('--images', type=int, default=256, help='Distinct scans posted to /predict')
+    sub.add_argument('--image-size', type=int, default=512)
+    sub.add_argument('--fail-on-errors', action='store_true', help='Exit with 1 if any request failed')
+    sub.add_argument('--output', help='Write the results as JSON')
+
+    sub = command("compare", compare, "Compare two result files of the same suite")
+    sub.add_argument('baseline')
+    sub.add_argument('candidate')
+    sub.add_argument('--threshold', type=float, default=10, help='Allowed p50 slowdown in %% (default: %(default)s)')
+
+    args = parser.parse_args()
+    if getattr(args, "output", None):
+        args.output = os.path.abspath(args.output)
+    if args.command != "compare":
+        enter_workdir(args.workdir)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""Timing, statistics and the result file layout shared by the suites"""
+
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from PIL import Image
+
+from benchmarks import BACKEND_DIR
+
+DEFAULT_WORKDIR = "bench_run"
+MODEL_FILE = os.path.join("model", "best_model.h5")
+
+def enter_workdir(workdir):
+    """Makes workdir the app's working directory (model/, database.db, uploads/ ...)"""
+    os.makedirs(os.path.join(workdir, "static"), exist_ok=True)  # Mounted by main.py
+    os.chdir(workdir)
+
+def summarise(samples, unit_count=1):
+    """
+    Percentiles of a list of durations in seconds, reported in ms.
+    unit_count scales per_second when one sample covers several items
+    (e.g. a batch of scans).
+    """
+    values = np.asarray(samples, dtype=float)
+    if values.size == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {
+        "count": int(values.size),
+        "mean_ms": float(values.mean() * 1000),
+        "min_ms": float(values.min() * 1000),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "stdev_ms": float(values.std() * 1000),
+        "per_second": float(unit_count / np.median(values)) if np.median(values) > 0 else None,
+    }
+
+def measure(fn, repeat=20, warmup=3, unit_count=1):
+    """Calls fn() warmup times untimed, then repeat times; returns summarise() of the timed calls"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarise(samples, unit_count)
+
+def synthetic_scan(seed=0, size=(512, 512), image_format="JPEG"):
+    """Encoded MRI-like test image: a noisy bright ellipse on black"""
+    rng = np.random.default_rng(seed)
+    height, width = size[1], size[0]
+    y, x = np.ogrid[:height, :width]
+    ellipse = ((x - width / 2) / (width * 0.4)) ** 2 + ((y - height / 2) / (height * 0.45)) ** 2 <= 1
+    pixels = np.where(ellipse, 90 + rng.normal(0, 40, (height, width)), rng.normal(8, 4, (height, width)))
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype("uint8")).convert("RGB")
+    buffer = io.BytesIO()
+    img.save(buffer, image_format, quality=92)
+    return buffer.getvalue()
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def environment():
+    """What a result depends on besides the code: machine, libraries, pipeline settings"""
+    import config
+
+    info = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "settings": {
+            name: getattr(config, name) for name in (
+                "INFERENCE_BACKEND", "GRADCAM_MODE", "MODEL_BATCH_SIZE", "MODEL_BATCH_TIMEOUT_MS",
+                "CPU_POOL_KIND", "CPU_POOL_WORKERS", "ENABLE_PREDICTION_CACHE", "USE_CLOUD_STORAGE"
+            )
+        },
+    }
+    tf = sys.modules.get("tensorflow")
+    if tf is not None:
+        info["tensorflow"] = tf.__version__
+    return info
+
+def write_results(path, suite, results, args, **extra):
+    """
+    {"suite", "environment", "args", **extra, "results": {name: summarise() + extras}}
+    Printed as a table too; written as JSON when path is set.
+    """
+    document = {
+        "suite": suite,
+        "environment": environment(),
+        "args": {k: v for k, v in vars(args).items() if k != "func"},
+        **extra,
+        "results": results,
+    }
+    print_table(results)
+    if path:
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"\n📄 Results written to {os.path.abspath(path)}")
+    return document
+
+def print_table(results):
+    print(f"\n{'benchmark':<34} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per s':>9}")
+    for name, stats in results.items():
+        if not stats.get("count"):
+            print(f"{name:<34} {'-':>7}")
+            continue
+        per_second = f"{stats['per_second']:.1f}" if stats.get("per_second") else "-"
+        print(f"{name:<34} {stats['count']:>7} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} "
+              f"{stats['p99_ms']:>10.2f} {per_second:>9}")
@@ -0,0 +1,217 @@
+"""
+Closed-loop load generator for /predict, /scans and /stats
+
+--users virtual users each log in as a different doctor (doctor<N> of the
+synthetic database, signed up if missing) and loop: pick an endpoint by
+its --mix weight, send the request, wait for the answer, repeat. There is
+no think time, so throughput follows what the server can do and latency
+is reported per endpoint. /scans pages through the doctor's history via
+X-Next-Cursor; /predict cycles through --images distinct synthetic scans,
+so the prediction cache only answers once every image has been seen.
+
+With --serve the API is started on 127.0.0.1 from the work directory
+(stub model, synthetic database) for the run and stopped afterwards, with
+a METRICS_TOKEN of its own so the per-stage breakdown can be scraped from
+/metrics. For a server given by --url pass its --metrics-token.
+"""
+
+import os
+import random
+import re
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks import BACKEND_DIR
+from benchmarks.common import MODEL_FILE, summarise, synthetic_scan, write_results
+from benchmarks.synthetic_data import PASSWORD, doctor_email
+from load_test import login, multipart
+
+ENDPOINTS = ("predict", "scans", "stats")
+SCANS_PAGES = 5  # Pages followed before starting again from the newest scan
+
+def parse_mix(text):
+    """Weights from "predict=1,scans=6,stats=3" (a bare name counts 1)"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r} in --mix; use {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def _send(url, data=None, headers=None, content_type=None):
+    """(status, response headers); HTTP errors are returned, not raised"""
+    headers = dict(headers or {})
+    if content_type:
+        headers["Content-Type"] = content_type
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            response.read()
+            return response.status, response.headers
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, e.headers
+
+# ============================================================
+# SERVER
+# ============================================================
+def start_server(port):
+    """
+    uvicorn main:app in the current (work) directory; returns (process, url,
+    metrics token) once /ready answers
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    env["METRICS_TOKEN"] = metrics_token = secrets.token_urlsafe(24)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 600  # Model load, warm-up and schema setup
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            urllib.request.urlopen(f"{url}/ready", timeout=5).read()
+            return process, url, metrics_token
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not start within 10 minutes")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def server_stages(base_url, metrics_token):
+    """
+    Mean time per /predict stage from the server's /metrics (since it
+    started), or {"error": ...} when they could not be scraped
+    """
+    if not metrics_token:
+        return {"error": "No metrics token; pass --metrics-token (or set METRICS_TOKEN)"}
+    request = urllib.request.Request(f"{base_url}/metrics", headers={"Authorization": f"Bearer {metrics_token}"})
+    try:
+        text = urllib.request.urlopen(request, timeout=10).read().decode()
+    except urllib.error.HTTPError as e:
+        return {"error": f"/metrics answered {e.code}"}
+    except OSError as e:
+        return {"error": f"/metrics failed: {e}"}
+    sums, counts = {}, {}
+    for name, stage, value in re.findall(r'^predict_stage_duration_seconds_(sum|count)\{stage="(\w+)"\} (\S+)$', text, re.M):
+        (sums if name == "sum" else counts)[stage] = float(value)
+    return {stage: {"count": int(counts[stage]), "mean_ms": sums[stage] / counts[stage] * 1000}
+            for stage in sums if counts.get(stage)}
+
+# ============================================================
+# LOAD
+# ============================================================
+def run_load(base_url, args):
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    images = [synthetic_scan(args.seed + i, (args.image_size, args.image_size)) for i in range(args.images)]
+
+    print(f"🔑 Logging in {args.users} users")
+    users = [login(base_url, doctor_email(u + 1), PASSWORD) for u in range(args.users)]
+
+    start = time.perf_counter()
+    measure_from = start + args.warmup
+    stop = measure_from + args.seconds
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+
+    def user(index, headers):
+        rng = random.Random(args.seed * 1000 + index)
+        cursor, page = None, 0
+        image_index = index
+        while time.perf_counter() < stop:
+            name = rng.choices(names, weights)[0]
+            if name == "predict":
+                data, content_type = multipart(
+                    {"patient_name": "Load Test", "patient_id": f"LOAD-{index}"}, "scan.jpg",
+                    images[image_index % len(images)]
+                )
+                image_index += args.users
+                request = (f"{base_url}/predict", data, headers, content_type)
+            elif name == "scans":
+                query = f"limit=50&cursor={cursor}" if cursor else "limit=50"
+                request = (f"{base_url}/scans?{query}", None, headers)
+            else:
+                request = (f"{base_url}/stats", None, headers)
+
+            sent = time.perf_counter()
+            try:
+                status, response_headers = _send(*request)
+            except OSError:
+                status, response_headers = None, {}
+            elapsed = time.perf_counter() - sent
+
+            if name == "scans" and status == 200:
+                page += 1
+                cursor = response_headers.get("X-Next-Cursor") if page < SCANS_PAGES else None
+                if cursor is None:
+                    page = 0
+            if sent < measure_from:
+                continue
+            with lock:
+                if status == 200:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+    threads = [threading.Thread(target=user, args=(i, headers)) for i, headers in enumerate(users)]
+    print(f"🚀 {args.users} users, {args.warmup:g}s warm-up + {args.seconds:g}s measured, mix {args.mix}")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {}
+    for name in names:
+        stats = summarise(latencies[name])
+        stats["per_second"] = len(latencies[name]) / args.seconds  # Achieved throughput, not 1 / p50
+        stats["errors"] = errors[name]
+        results[name] = stats
+    everything = [value for values in latencies.values() for value in values]
+    results["all"] = dict(summarise(everything), per_second=len(everything) / args.seconds,
+                          errors=sum(errors.values()))
+    return results
+
+def run(args):
+    server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    metrics_token = args.metrics_token
+    if args.serve:
+        from benchmarks.stub_model import write_stub_model
+
+        write_stub_model(MODEL_FILE, args.architecture)
+        print(f"🖥️  Starting the API on 127.0.0.1:{args.port}")
+        server, base_url, metrics_token = start_server(args.port)
+    elif base_url is None:
+        print("❌ Pass --url of a running server, or --serve")
+        return 2
+
+    try:
+        results = run_load(base_url, args)
+        extra = {"server_stages": server_stages(base_url, metrics_token)}
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    if "error" in extra["server_stages"]:
+        print(f"⚠️  No per-stage breakdown: {extra['server_stages']['error']}")
+
+    write_results(args.output, "load", results, args, **extra)
+    return 1 if results["all"]["errors"] and args.fail_on_errors else 0
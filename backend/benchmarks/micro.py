@@ -0,0 +1,102 @@
+"""
+Microbenchmarks of the /predict stages and the PDF report
+
+Each stage is timed on its own in this process, with the same functions the
+API runs: decode (PIL, reduced-size JPEG decode), preprocess, forward pass
+with and without Grad-CAM per batch size, Grad-CAM from cached features,
+JPEG/WebP encode, overlay rendering and generate_medical_report().
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import MODEL_FILE, measure, synthetic_scan, write_results
+from benchmarks.stub_model import write_stub_model
+
+def _selected(name, only):
+    return not only or any(name.startswith(prefix) for prefix in only)
+
+def run(args):
+    write_stub_model(MODEL_FILE, args.architecture)
+
+    import tensorflow as tf
+    from config import INFERENCE_BACKEND
+    from model_registry import ModelVersion
+    from imaging import IMAGE_SIZE, open_image, load_image, preprocess_input, save_image, render_gradcam
+    from pdf_generator import generate_medical_report, print_images
+
+    model = ModelVersion(MODEL_FILE, INFERENCE_BACKEND)
+    only = [prefix for prefix in (args.only or "").split(",") if prefix]
+    timing = dict(repeat=args.repeat, warmup=args.warmup)
+    results = {}
+
+    def bench(name, fn, unit_count=1):
+        if _selected(name, only):
+            print(f"⏱️  {name}")
+            results[name] = measure(fn, unit_count=unit_count, **timing)
+
+    jpeg = synthetic_scan(1, (args.image_size, args.image_size))
+    png = synthetic_scan(2, (args.image_size, args.image_size), "PNG")
+
+    def decode(image_bytes):
+        return np.array(open_image(image_bytes).resize(IMAGE_SIZE).convert("RGB"))
+
+    bench("decode_jpeg", lambda: decode(jpeg))
+    bench("decode_png", lambda: decode(png))
+    img_rgb = decode(jpeg)
+    bench("preprocess", lambda: preprocess_input(img_rgb))
+    bench("load_image", lambda: load_image(jpeg))  # decode + hash + preprocess, one CPU pool job
+    img_array = preprocess_input(img_rgb)
+
+    def forward(batch, with_gradcam):
+        if model.inference_backend is None:
+            fn = model.forward_fn if with_gradcam else model.features_fn
+            outputs = fn(tf.constant(batch, dtype=tf.float32))
+        else:
+            features = tf.constant(model.inference_backend.features(batch))
+            outputs = model.gradcam_fn(features) if with_gradcam else (model.head_fn(features),)
+        return [output.numpy() for output in outputs]
+
+    for batch_size in args.batch_sizes:
+        batch = np.stack([img_array] * batch_size)
+        bench(f"infer_b{batch_size}", lambda: forward(batch, False), unit_count=batch_size)
+        bench(f"infer_gradcam_b{batch_size}", lambda: forward(batch, True), unit_count=batch_size)
+
+    features = model.features_fn(tf.constant(img_array[np.newaxis]))[1].numpy()[0]
+    bench("gradcam_from_features", lambda: model.infer_gradcam(features))
+    _, heatmap = model.infer_gradcam(features)
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_")
+    scan_path = os.path.join(tmp_dir, "scan_original.jpg")
+    gradcam_path = os.path.join(tmp_dir, "scan_gradcam.jpg")
+    save_image(img_rgb, scan_path)
+    bench("encode_scan", lambda: save_image(img_rgb, scan_path, os.path.join(tmp_dir, "scan_thumb.webp")))
+    bench("render_gradcam", lambda: render_gradcam(img_rgb, heatmap, True, "Tumor Detected", scan_path, gradcam_path))
+
+    scan_data = {
+        'patient_name': 'Benchmark Patient',
+        'patient_id': 'BENCH-001',
+        'scan_date': '2025-01-01 09:30',
+        'doctor_name': 'Benchmark',
+        'prediction': 'Tumor Detected',
+        'confidence': 97.5,
+        'image_path': scan_path,
+        'gradcam_path': gradcam_path,
+        'notes': 'Benchmark run.'
+    }
+
+    def report():
+        # Every new scan's report starts without its print images cached
+        print_images.clear()
+        generate_medical_report(scan_data, os.path.join(tmp_dir, "report.pdf"))
+
+    bench("report_pdf", report)
+
+    # A model already in the work directory (stub or real weights) is used as is
+    # (or the SavedModel compiled from it, see model_registry.ModelVersion)
+    model_info = {"parameters": model.parameter_count(), "bytes": os.path.getsize(MODEL_FILE),
+                  "format": model.format, "version": model.version}
+    write_results(args.output, "micro", results, args, model=model_info)
+    return 0
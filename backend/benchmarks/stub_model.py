@@ -0,0 +1,46 @@
+"""
+Stand-in for best_model.h5 with random weights.
+
+"resnet50" is the layout of the trained model (a Sequential of the
+ResNet50 base, GlobalAveragePooling2D, Dense 128, Dropout and a sigmoid
+Dense 1), so inference and Grad-CAM cost what they cost in production.
+"tiny" keeps the same input, output and base/head split with a few small
+convolutions, for quick runs of everything else.
+"""
+
+import os
+
+ARCHITECTURES = ("resnet50", "tiny")
+
+def build_stub_model(architecture="resnet50", seed=0):
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    if architecture == "resnet50":
+        # weights=None: built locally, nothing is downloaded
+        base = tf.keras.applications.ResNet50(include_top=False, weights=None, input_shape=(224, 224, 3))
+    elif architecture == "tiny":
+        x = base_input = tf.keras.Input(shape=(224, 224, 3))
+        for filters in (16, 32, 64):
+            x = tf.keras.layers.Conv2D(filters, 3, strides=2, padding="same", activation="relu")(x)
+        base = tf.keras.Model(base_input, x, name="tiny_base")
+    else:
+        raise ValueError(f"Unknown architecture {architecture!r}; use one of {ARCHITECTURES}")
+
+    return tf.keras.Sequential([
+        base,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(128, activation="relu"),
+        tf.keras.layers.Dropout(0.4),
+        tf.keras.layers.Dense(1, activation="sigmoid"),
+    ])
+
+def write_stub_model(path, architecture="resnet50", seed=0, overwrite=False):
+    """Saves the stub as HDF5 at path unless a model is already there; returns path"""
+    if os.path.exists(path) and not overwrite:
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    model = build_stub_model(architecture, seed)
+    model.save(path)
+    print(f"✅ Stub model ({architecture}) written to {path}")
+    return path
@@ -0,0 +1,114 @@
+"""
+Synthetic database for query and load benchmarks
+
+Fills the work directory's database.db with doctors and scans spread over
+the last --days days. Scans per doctor are skewed (a few busy radiologists,
+many occasional ones). The statistics rollups are written from the same
+data, so /stats is valid without a rebuild. Every doctor can log in as doctor<N>@bench.local with password "benchmark".
+The same --seed gives the same database.
+"""
+
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+PASSWORD = "benchmark"
+TUMOR_LABEL = "Tumor Detected"
+NO_TUMOR_LABEL = "No Tumor Detected"
+CHUNK = 50_000
+
+def doctor_email(index):
+    return f"doctor{index}@bench.local"
+
+def run(args):
+    from sqlalchemy import func, insert, select
+
+    from auth import get_password_hash
+    from database import Base, engine
+    from models import DailyScanStats, Doctor, DoctorStats, Scan
+
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Doctor)).scalar():
+            print("❌ database.db already has doctors; use a fresh --workdir (or delete database.db)")
+            return 1
+
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+
+    # One bcrypt hash for everyone: hashing thousands would take minutes
+    hashed_password = get_password_hash(PASSWORD)
+    created = datetime.utcnow() - timedelta(days=args.days)
+    with engine.begin() as conn:
+        conn.execute(insert(Doctor), [{
+            "id": i + 1,
+            "email": doctor_email(i + 1),
+            "full_name": f"Dr. Bench {i + 1}",
+            "hashed_password": hashed_password,
+            "license_number": f"BENCH-{i + 1:06d}",
+            "created_at": created,
+        } for i in range(args.doctors)])
+
+    # Zipf-like load per doctor; scan ids follow scan_date like real inserts
+    weights = 1.0 / np.arange(1, args.doctors + 1) ** 0.8
+    doctor_ids = rng.choice(np.arange(1, args.doctors + 1), size=args.scans, p=weights / weights.sum())
+    now = np.datetime64(datetime.utcnow().replace(microsecond=0), "s")
+    offsets = np.sort(rng.integers(0, args.days * 86400, size=args.scans))[::-1]
+    scan_dates = now - offsets.astype("timedelta64[s]")
+    tumor = rng.random(args.scans) < args.tumor_rate
+    confidence = np.round(rng.uniform(50.5, 99.9, size=args.scans), 2)
+    patients = rng.integers(0, args.patients_per_doctor, size=args.scans)
+
+    for chunk_start in range(0, args.scans, CHUNK):
+        rows = []
+        chunk_dates = scan_dates[chunk_start:chunk_start + CHUNK].tolist()
+        for i, scan_date in enumerate(chunk_dates, chunk_start):
+            key = uuid.UUID(bytes=rng.bytes(16))
+            patient = f"{doctor_ids[i]}-{patients[i]}"
+            rows.append({
+                "doctor_id": int(doctor_ids[i]),
+                "patient_name": f"Patient {patient}",
+                "patient_id": f"P{patient}",
+                "image_path": f"{key}_original.jpg",
+                "prediction": TUMOR_LABEL if tumor[i] else NO_TUMOR_LABEL,
+                "confidence": float(confidence[i]),
+                "gradcam_path": f"{key}_gradcam.jpg",
+                "notes": None,
+                "scan_date": scan_date,
+                "image_hash": rng.bytes(32).hex(),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(Scan), rows)
+        done = chunk_start + len(rows)
+        print(f"   {done}/{args.scans} scans ({done / (time.perf_counter() - start):.0f}/s)")
+
+    # Rollups straight from the generated arrays
+    daily = {}
+    days = scan_dates.astype("datetime64[D]").tolist()
+    for doctor_id, day, is_tumor in zip(doctor_ids.tolist(), days, tumor.tolist()):
+        counter = daily.setdefault((doctor_id, day), [0, 0])
+        counter[0] += 1
+        counter[1] += is_tumor
+    totals = {}
+    for (doctor_id, _), (total, tumors) in daily.items():
+        counter = totals.setdefault(doctor_id, [0, 0])
+        counter[0] += total
+        counter[1] += tumors
+
+    with engine.begin() as conn:
+        conn.execute(insert(DoctorStats), [
+            {"doctor_id": doctor_id, "total_scans": total, "tumor_detected": tumors}
+            for doctor_id, (total, tumors) in totals.items()
+        ])
+        daily_rows = [
+            {"doctor_id": doctor_id, "day": day, "total_scans": total, "tumor_detected": tumors}
+            for (doctor_id, day), (total, tumors) in daily.items()
+        ]
+        for i in range(0, len(daily_rows), CHUNK):
+            conn.execute(insert(DailyScanStats), daily_rows[i:i + CHUNK])
+
+    print(f"✅ {args.doctors} doctors, {args.scans} scans, {len(daily)} daily rollup rows "
+          f"in {time.perf_counter() - start:.1f}s (password: {PASSWORD})")
+    return 0
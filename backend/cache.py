@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Caches created with a name, reported on /metrics
+CACHES = {}
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts the least recently used entry.
+    With ttl (seconds) entries also expire that long after they were put.
+    on_evict(key, value) is called for entries pushed out by put().
+    get() counts hits and misses.
+    """
+
+    def __init__(self, maxsize=128, ttl=None, on_evict=None, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if name:
+            CACHES[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            expires, value = self._data[key]
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        evicted = []
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+        if self.on_evict:
+            for old_key, (_, old_value) in evicted:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._data.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._data:
+                return False
+            expires, _ = self._data[key]
+            return expires is None or expires >= time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Export and compare CPU inference backends for the brain tumor model
+
+Run from backend/:
+    python convert_model.py export --calibration-dir path/to/mri_images
+    python convert_model.py compare --data-dir path/to/dataset --output compare.json
+    python convert_model.py compile
+
+export writes the ResNet50 feature extractor of model/best_model.h5 as
+TFLite float16, TFLite INT8 (calibrated on --calibration-dir) and ONNX
+(needs tf2onnx). The dense head keeps running from the Keras model, see
+inference_backends.py.
+
+compare runs the Keras baseline and every exported backend over a dataset
+laid out like the training data (no/ and yes/ sub-folders; unlabelled
+folders only report agreement) and prints accuracy, decision flips against
+Keras and per-image latency.
+
+compile saves the traced Keras inference functions of a model file as the
+SavedModel the API loads instead (best_model.h5 -> best_model.savedmodel).
+The server does this itself the first time it loads a file; running it at
+image build time spares that first start the extra seconds.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from config import MODEL_BATCH_SIZE
+from imaging import load_image
+from inference_backends import EXPORTED_FILES, exported_path
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+LABELS = {'no': 0, 'yes': 1}
+
+def list_images(directory, limit=None):
+    """Returns [(path, label or None)] for every image below directory"""
+    images = []
+    for root, _, files in os.walk(directory):
+        label = LABELS.get(os.path.basename(root).lower())
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.join(root, name), label))
+    images.sort()
+    return images[:limit] if limit else images
+
+def load_batch(paths):
+    batch = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            _, img_array, _ = load_image(f.read())
+        batch.append(img_array)
+    return np.stack(batch)
+
+# ============================================================
+# EXPORT
+# ============================================================
+
+def export_tflite(feature_model, output_path, quantization, calibration_paths=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(feature_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Full integer weights and activations; inputs/outputs stay float32
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_batch([path])]
+        converter.representative_dataset = representative_dataset
+
+    flatbuffer = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(flatbuffer)
+
+def export_onnx(feature_model, output_path):
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError("ONNX export requires: pip install tf2onnx")
+
+    fn = tf.function(lambda x: feature_model(x, training=False))
+    tf2onnx.convert.from_function(
+        fn,
+        input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32, name='image')],
+        opset=13,
+        output_path=output_path
+    )
+
+def run_export(args):
+    import tensorflow as tf
+    from model_registry import MODEL_PATH, split_model
+
+    print(f"Loading {MODEL_PATH}...")
+    feature_model, _ = split_model(tf.keras.models.load_model(MODEL_PATH))
+
+    calibration = []
+    if 'tflite-int8' in args.formats:
+        if not args.calibration_dir:
+            print("❌ tflite-int8 needs --calibration-dir with representative MRI slices")
+            return 1
+        calibration = [p for p, _ in list_images(args.calibration_dir, args.calibration_size)]
+        if not calibration:
+            print(f"❌ No images found in {args.calibration_dir}")
+            return 1
+
+    for name in args.formats:
+        path = exported_path(name)
+        start = time.perf_counter()
+        try:
+            if name == 'tflite-fp16':
+                export_tflite(feature_model, path, 'fp16')
+            elif name == 'tflite-int8':
+                export_tflite(feature_model, path, 'int8', calibration)
+            else:
+                export_onnx(feature_model, path)
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            continue
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"✅ {name}: {path} ({size_mb:.1f} MB, {time.perf_counter() - start:.0f}s)")
+    return 0
+
+def run_compile(args):
+    from model_registry import MODEL_PATH, ModelVersion, compiled_model_current, compiled_path, model_file
+
+    path = model_file(args.model) if args.model else MODEL_PATH
+    if compiled_model_current(path):
+        print(f"✅ {compiled_path(path)} is up to date with {path}")
+        return 0
+    start = time.perf_counter()
+    ModelVersion(path).save_compiled()
+    print(f"✅ {compiled_path(path)} ({time.perf_counter() - start:.0f}s)")
+    return 0
+
+# ============================================================
+# COMPARE
+# ============================================================
+
+def make_predictor(name):
+    """Returns fn(batch) -> tumor probabilities for the given backend"""
+    from model_registry import MODEL_PATH, ModelVersion
+
+    model = ModelVersion(MODEL_PATH, name)
+    return model.classify
+
+def measure_latency(predict, sample, batch_size, repeats):
+    """Median and p95 milliseconds per image at the given batch size"""
+    batch = np.repeat(sample[:1], batch_size, axis=0)
+    predict(batch)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(batch)
+        timings.append((time.perf_counter() - start) * 1000 / batch_size)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+def run_compare(args):
+    images = list_images(args.data_dir, args.limit)
+    if not images:
+        print(f"❌ No images found in {args.data_dir}")
+        return 1
+    labels = np.array([label for _, label in images], dtype=object)
+    labelled = labels != None  # noqa: E711 - element-wise
+
+    backends = ['keras'] + [n for n in EXPORTED_FILES if os.path.exists(exported_path(n))]
+    print(f"Comparing {', '.join(backends)} on {len(images)} images...")
+
+    results = {}
+    baseline = None
+    for name in backends:
+        predict = make_predictor(name)
+        probs = np.concatenate([
+            predict(load_batch([p for p, _ in images[i:i + 32]]))
+            for i in range(0, len(images), 32)
+        ])
+        decisions = probs > 0.5
+        if baseline is None:
+            baseline = probs
+
+        sample = load_batch([images[0][0]])
+        result = {
+            'accuracy': float(np.mean(decisions[labelled] == labels[labelled].astype(bool))) if labelled.any() else None,
+            'decision_flips': int(np.sum(decisions != (baseline > 0.5))),
+            'max_prob_delta': float(np.max(np.abs(probs - baseline))),
+            'mean_prob_delta': float(np.mean(np.abs(probs - baseline))),
+        }
+        for batch_size in sorted({1, MODEL_BATCH_SIZE}):
+            p50, p95 = measure_latency(predict, sample, batch_size, args.repeats)
+            result[f'ms_per_image_b{batch_size}_p50'] = p50
+            result[f'ms_per_image_b{batch_size}_p95'] = p95
+        results[name] = result
+
+    print()
+    print(f"{'backend':<12} {'accuracy':>9} {'flips':>6} {'max Δp':>8} " +
+          " ".join(f"{'b' + str(b) + ' ms/img':>11}" for b in sorted({1, MODEL_BATCH_SIZE})))
+    for name, r in results.items():
+        accuracy = f"{r['accuracy'] * 100:.2f}%" if r['accuracy'] is not None else "n/a"
+        latencies = " ".join(f"{r[f'ms_per_image_b{b}_p50']:>11.1f}" for b in sorted({1, MODEL_BATCH_SIZE}))
+        print(f"{name:<12} {accuracy:>9} {r['decision_flips']:>6} {r['max_prob_delta']:>8.4f} {latencies}")
+
+    flipped = [n for n, r in results.items() if r['decision_flips']]
+    if flipped:
+        print(f"\n⚠️  Decisions differ from Keras for: {', '.join(flipped)}")
+    else:
+        print("\n✅ All backends agree with the Keras baseline")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'images': len(images), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export = sub.add_parser('export', help='Export TFLite / ONNX feature extractors')
+    export.add_argument('--formats', nargs='+', choices=list(EXPORTED_FILES), default=list(EXPORTED_FILES))
+    export.add_argument('--calibration-dir', help='Representative MRI slices for INT8 calibration')
+    export.add_argument('--calibration-size', type=int, default=200)
+
+    compare = sub.add_parser('compare', help='Accuracy and latency of every backend against Keras')
+    compare.add_argument('--data-dir', required=True, help='Dataset with no/ and yes/ sub-folders')
+    compare.add_argument('--limit', type=int, help='Only use the first N images')
+    compare.add_argument('--repeats', type=int, default=20, help='Timed runs per batch size')
+    compare.add_argument('--output', help='Write the results as JSON')
+
+    compile = sub.add_parser('compile', help='Save the traced model as the SavedModel the API loads instead')
+    compile.add_argument('--model', help='Model file in model/ (default: best_model.h5)')
+
+    args = parser.parse_args()
+    commands = {'export': run_export, 'compare': run_compare, 'compile': run_compile}
+    return commands[args.command](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
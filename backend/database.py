@@ -1,20 +1,185 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./database.db"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base = declarative_base()
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    SQLITE_BUSY_TIMEOUT, SQLITE_CACHE_SIZE_MB, SQLITE_MMAP_SIZE_MB
+)
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+# Async driver used by the API for each database; URLs that already name a
+# driver ("postgresql+psycopg://...") are used as they are
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def async_database_url(url):
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def _engine_options(url):
+    is_sqlite = url.startswith("sqlite")
+    return dict(
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT} if is_sqlite else {},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=not is_sqlite
+    )
+
+def _tune_sqlite(engine):
+    """
+    SQLite connections are switched to WAL so dashboard reads no longer wait
+    for /predict commits (and vice versa); writers queue on busy_timeout
+    instead of failing with "database is locked".
+    """
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")  # Persistent, stored in the file
+        cursor.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; fsync at checkpoints only
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_MB * 1024}")  # Negative = KiB
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+def create_db_engine(url=SQLALCHEMY_DATABASE_URL, tune_sqlite=True):
+    """Blocking engine with the configured connection pool"""
+    engine = create_engine(url, **_engine_options(url))
+    if url.startswith("sqlite") and tune_sqlite:
+        _tune_sqlite(engine)
+    return engine
+
+def create_async_db_engine(url=SQLALCHEMY_DATABASE_URL, tune_sqlite=True):
+    """Async engine for the API; queries never block the event loop"""
+    # aiosqlite defaults to NullPool (a new connection per session); pool
+    # like the blocking engine so the pragmas run once per connection
+    engine = create_async_engine(async_database_url(url), poolclass=AsyncAdaptedQueuePool, **_engine_options(url))
+    if url.startswith("sqlite") and tune_sqlite:
+        _tune_sqlite(engine.sync_engine)
+    return engine
+
+# Blocking engine: schema creation/upgrades at import time, scripts, benchmarks
+engine = create_db_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine: every request handler and background task
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
+
+def upgrade_schema():
+    """
+    create_all() only creates missing tables. Add the columns and indexes
+    introduced since an existing database.db was created.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind=engine)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+def benchmark(threads=8, seconds=5.0, write_ratio=0.3):
+    """
+    Mixed traffic against a scratch SQLite file: each thread either inserts
+    a scan and commits (like /predict) or reads a page of history (like
+    /scans). Runs with default journaling, then with the tuned settings.
+    """
+    import os
+    import random
+    import tempfile
+    import threading
+    import time
+    from datetime import datetime
+
+    from sqlalchemy.exc import OperationalError
+    # Through models: under "python database.py" this module is __main__
+    # and its Base is not the one the models are registered on
+    import models
+    Doctor, Scan = models.Doctor, models.Scan
+
+    for tuned in (False, True):
+        tmp_dir = tempfile.mkdtemp()
+        bench_engine = create_db_engine(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}", tune_sqlite=tuned)
+        models.Base.metadata.create_all(bind=bench_engine)
+        Session = sessionmaker(bind=bench_engine)
+
+        with Session() as db:
+            db.add(Doctor(email="bench@example.com", full_name="Bench", hashed_password="-", license_number="B"))
+            db.add_all(Scan(doctor_id=1, patient_name="P", patient_id=f"ID{i % 50}", prediction="No Tumor Detected",
+                            confidence=90.0, image_path="x", gradcam_path="y") for i in range(5000))
+            db.commit()
+
+        stop = time.perf_counter() + seconds
+        latencies = {"insert": [], "read": []}
+        errors = []
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < stop:
+                kind = "insert" if rng.random() < write_ratio else "read"
+                start = time.perf_counter()
+                try:
+                    with Session() as db:
+                        if kind == "insert":
+                            db.add(Scan(doctor_id=1, patient_name="P", patient_id="ID1", prediction="Tumor Detected",
+                                        confidence=99.0, image_path="x", gradcam_path="y", scan_date=datetime.utcnow()))
+                            db.commit()
+                        else:
+                            db.query(Scan.id, Scan.prediction).filter(Scan.doctor_id == 1).order_by(
+                                Scan.scan_date.desc()).limit(50).all()
+                except OperationalError as e:
+                    with lock:
+                        errors.append(str(e.orig))
+                    continue
+                with lock:
+                    latencies[kind].append((time.perf_counter() - start) * 1000)
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        bench_engine.dispose()
+
+        label = "WAL + pragmas" if tuned else "default journal"
+        total = sum(len(v) for v in latencies.values())
+        print(f"{label:<16} {total / seconds:8.0f} ops/s  errors={len(errors)}")
+        for kind, values in latencies.items():
+            if values:
+                values.sort()
+                p95 = values[int(len(values) * 0.95) - 1]
+                print(f"  {kind:<6} {len(values) / seconds:8.0f}/s  p50={values[len(values) // 2]:6.2f} ms  p95={p95:6.2f} ms")
+
+if __name__ == "__main__":
+    import sys
+    if "--benchmark" in sys.argv:
+        benchmark()
+    else:
+        print("Usage: python database.py --benchmark")
@@ -0,0 +1,133 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+import metrics
+from config import (
+    CPU_POOL_KIND, CPU_POOL_WORKERS, CPU_POOL_MAX_PENDING, AUTH_POOL_WORKERS, AUTH_POOL_MAX_PENDING,
+    REPORT_POOL_WORKERS, REPORT_POOL_MAX_PENDING, STORAGE_POOL_WORKERS, STORAGE_POOL_MAX_PENDING,
+    SHADOW_MAX_PENDING
+)
+
+
+class PoolBusyError(Exception):
+    """Raised when a pool's queue is full and the job was not accepted"""
+
+
+def _timed_call(fn, args, kwargs):
+    """Runs in the worker; the start time splits queue wait from work (wall clock, so it crosses processes)"""
+    started = time.time()
+    return started, fn(*args, **kwargs)
+
+
+class BoundedExecutor:
+    """
+    Thread or process pool with a cap on queued work.
+
+    run() hands a blocking function to the pool and awaits it without
+    holding the event loop. Once max_workers + max_pending jobs are in
+    flight new jobs are rejected with PoolBusyError instead of piling up,
+    so a burst of uploads degrades into fast 503s rather than a backlog
+    that starves every other endpoint.
+    """
+
+    def __init__(self, kind="thread", max_workers=4, max_pending=32, name="cpu"):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.limit = max_workers + max_pending
+        self.name = name
+        self.in_flight = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn, not fork: forking a process that already holds
+                # TensorFlow's thread pools is not safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.name
+                )
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        if self.in_flight >= self.limit:
+            metrics.pool_rejected.inc(self.name)
+            raise PoolBusyError(f"{self.name} pool is full ({self.in_flight} jobs queued)")
+
+        # Only touched from the event loop thread, so a plain counter is enough
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            submitted = time.time()
+            started, result = await loop.run_in_executor(self._get_executor(), partial(_timed_call, fn, args, kwargs))
+            metrics.pool_wait_seconds.observe(started - submitted, self.name)
+            metrics.pool_run_seconds.observe(time.time() - started, self.name)
+            return result
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Decoding, resizing and Grad-CAM rendering for /predict
+cpu_pool = BoundedExecutor(
+    kind=CPU_POOL_KIND,
+    max_workers=CPU_POOL_WORKERS,
+    max_pending=CPU_POOL_MAX_PENDING,
+    name="cpu"
+)
+
+# Password hashing for /signup and /login. Kept apart from cpu_pool so a
+# wave of logins cannot starve predictions and vice versa; bcrypt releases
+# the GIL, so threads are enough.
+auth_pool = BoundedExecutor(
+    kind="thread",
+    max_workers=AUTH_POOL_WORKERS,
+    max_pending=AUTH_POOL_MAX_PENDING,
+    name="auth"
+)
+
+# PDF rendering. ReportLab is pure Python and holds the GIL for the whole
+# document, so concurrent downloads only run in parallel as processes.
+report_pool = BoundedExecutor(
+    kind="process",
+    max_workers=REPORT_POOL_WORKERS,
+    max_pending=REPORT_POOL_MAX_PENDING,
+    name="report"
+)
+
+# Blocking object-storage calls (S3 uploads, downloads, HEAD requests);
+# network-bound, so threads
+storage_pool = BoundedExecutor(
+    kind="thread",
+    max_workers=STORAGE_POOL_WORKERS,
+    max_pending=STORAGE_POOL_MAX_PENDING,
+    name="storage"
+)
+
+# Shadow model predictions on sampled scans. One thread, off the model
+# thread, so the served model never waits behind the candidate; samples
+# beyond the queue are skipped rather than delayed
+shadow_pool = BoundedExecutor(
+    kind="thread",
+    max_workers=1,
+    max_pending=SHADOW_MAX_PENDING,
+    name="shadow"
+)
+
+metrics.Callback(
+    "pool_jobs_in_flight", "Jobs running or queued in each pool",
+    lambda: {(pool.name,): pool.in_flight for pool in (cpu_pool, auth_pool, report_pool, storage_pool, shadow_pool)},
+    labels=("pool",)
+)
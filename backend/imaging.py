@@ -0,0 +1,158 @@
+"""
+CPU-bound image stages of the prediction pipeline.
+
+Kept free of TensorFlow so they can run in a process pool without every
+worker importing the ML stack.
+"""
+
+import hashlib
+import io
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from config import MAX_IMAGE_PIXELS, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+
+IMAGE_SIZE = (224, 224)
+
+# Leading bytes of the formats accepted for upload -> PIL format name
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+}
+
+# Modes that can be resized before the RGB conversion (same result, a third
+# of the memory for grayscale); anything else (palette, alpha, 16-bit) is
+# converted to RGB a strip of rows at a time while it is reduced
+RESIZE_NATIVE_MODES = ("L", "RGB")
+REDUCE_STRIP_ROWS = 256  # Source rows converted at once when reducing other modes
+
+# ImageNet channel means used by ResNet50 ("caffe" preprocessing), BGR order
+RESNET_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+def preprocess_input(img):
+    """
+    Same as tf.keras.applications.resnet50.preprocess_input:
+    RGB -> BGR and zero-centre each channel on the ImageNet mean.
+    """
+    return img[..., ::-1].astype(np.float32) - RESNET_MEAN_BGR
+
+class InvalidImageError(ValueError):
+    """Upload is not a JPEG/PNG we are willing to decode"""
+
+def sniff_format(header: bytes):
+    """PIL format name from the first bytes of a file, or None"""
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    return None
+
+def open_image(image_bytes):
+    """
+    Open an upload at reduced resolution: only the header is parsed until
+    the pixels are needed, and JPEGs are decoded straight from the DCT at
+    1/2, 1/4 or 1/8 scale when that still leaves twice the model input.
+    PNG has no scaled decode, so oversized images are box-reduced; L and
+    RGB in their own mode, other modes while converting them to RGB strip by
+    strip, so no full-resolution RGB copy is ever made.
+    """
+    image_format = sniff_format(image_bytes[:8])
+    if image_format is None:
+        raise InvalidImageError("File must be a JPEG or PNG image")
+
+    try:
+        img = Image.open(io.BytesIO(image_bytes), formats=[image_format])
+    except Image.DecompressionBombError:
+        raise InvalidImageError(f"Image is too large; at most {MAX_IMAGE_PIXELS // 1_000_000} megapixels are accepted")
+    except Exception:
+        raise InvalidImageError(f"Could not read {image_format} image")
+
+    width, height = img.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidImageError(f"Image is too large; at most {MAX_IMAGE_PIXELS // 1_000_000} megapixels are accepted")
+
+    img.draft("RGB", (IMAGE_SIZE[0] * 2, IMAGE_SIZE[1] * 2))  # No-op except for JPEG
+    factor = min(img.width // (IMAGE_SIZE[0] * 2), img.height // (IMAGE_SIZE[1] * 2))
+    if img.mode in RESIZE_NATIVE_MODES:
+        return img.reduce(factor) if factor > 1 else img
+    if factor > 1:
+        return _convert_reduce(img, factor)
+    return img.convert("RGB")
+
+def _convert_reduce(img, factor):
+    """
+    img.convert("RGB").reduce(factor), one strip of rows at a time: the
+    same pixels, with only a strip in RGB at full resolution. (reduce()
+    can't take palette or 16-bit images, and reduces alpha premultiplied.)
+    """
+    reduced = Image.new("RGB", (-(-img.width // factor), -(-img.height // factor)))
+    rows = max(1, REDUCE_STRIP_ROWS // factor) * factor  # Whole boxes, so strips reduce like the full image
+    for top in range(0, img.height, rows):
+        strip = img.crop((0, top, img.width, min(top + rows, img.height))).convert("RGB").reduce(factor)
+        reduced.paste(strip, (0, top // factor))
+    return reduced
+
+def load_image(image_bytes):
+    """
+    Decode an upload and resize it to the model input.
+    Returns (rgb uint8 image, preprocessed float32 array, content hash).
+    The hash is taken over the decoded 224x224 pixels, so re-encodes of the
+    same slice map to the same prediction cache entry.
+    """
+    img = open_image(image_bytes).resize(IMAGE_SIZE).convert("RGB")
+
+    img_rgb = np.array(img)
+    image_hash = hashlib.sha256(img_rgb.tobytes()).hexdigest()
+    return img_rgb, preprocess_input(img_rgb), image_hash
+
+def save_image(img_rgb, save_path, thumbnail_path=None):
+    """Save the resized copy shown in the dashboard, and its card thumbnail"""
+    img = Image.fromarray(img_rgb)
+    img.save(save_path)
+    if thumbnail_path:
+        save_thumbnail(img, thumbnail_path)
+
+def save_thumbnail(img, thumbnail_path):
+    thumb = img.copy()
+    thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    thumb.save(thumbnail_path, "WEBP", quality=THUMBNAIL_QUALITY)
+
+def make_thumbnail(image_path, thumbnail_path):
+    """Thumbnail of an already stored scan (scans saved before thumbnails existed)"""
+    with Image.open(image_path) as img:
+        save_thumbnail(img.convert("RGB"), thumbnail_path)
+
+def load_saved_image(image_path):
+    """Re-load an already resized scan from uploads/ (lazy Grad-CAM)"""
+    img_rgb = np.array(Image.open(image_path).convert("RGB").resize(IMAGE_SIZE))
+    return img_rgb, preprocess_input(img_rgb)
+
+def render_gradcam(img_rgb, heatmap, tumor_flag, label, save_path, gradcam_path, note=None):
+    """Overlay the heatmap on the scan, stamp the label (and note) and write the JPEG"""
+    import cv2  # Only overlays need OpenCV, so it isn't imported at start-up
+
+    try:
+        img_orig = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
+
+        if tumor_flag:
+            # Normal Grad-CAM overlay
+            heatmap_resized = cv2.resize(heatmap, (img_orig.shape[1], img_orig.shape[0]))
+            heatmap_resized = np.uint8(255 * heatmap_resized)
+            heatmap_colored = cv2.applyColorMap(heatmap_resized, cv2.COLORMAP_JET)
+            superimposed = cv2.addWeighted(img_orig, 0.6, heatmap_colored, 0.4, 0)
+        else:
+            # Minimal overlay for No Tumor
+            superimposed = img_orig.copy()
+
+        # Add label text
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        cv2.putText(superimposed, label, (10, 25), font, 0.8, (0, 255, 0) if not tumor_flag else (0,0,255), 2)
+        if note:
+            cv2.putText(superimposed, note, (10, 50), font, 0.5, (255, 255, 255), 1)
+
+        cv2.imwrite(gradcam_path, superimposed)
+
+    except Exception as e:
+        print(f"Grad-CAM generation failed: {str(e)}")
+        shutil.copy(save_path, gradcam_path)
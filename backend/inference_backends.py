@@ -0,0 +1,88 @@
+"""
+CPU inference backends for the ResNet50 feature extractor.
+
+Only the convolutional base is swapped: it holds >99% of the FLOPs. The
+small dense head (and its Grad-CAM gradient) always runs from the Keras
+model, so every backend returns identical outputs apart from the feature
+extractor's numeric error. Exported files are produced by convert_model.py.
+"""
+
+import os
+
+import numpy as np
+
+from config import EXPORTED_MODEL_DIR, TENSORFLOW_THREADS
+
+EXPORTED_FILES = {
+    "tflite-fp16": "feature_extractor_fp16.tflite",
+    "tflite-int8": "feature_extractor_int8.tflite",
+    "onnx": "feature_extractor.onnx",
+}
+
+def exported_path(name):
+    return os.path.join(EXPORTED_MODEL_DIR, EXPORTED_FILES[name])
+
+
+class TFLiteBackend:
+    """Runs an exported .tflite feature extractor, resizing for each batch size"""
+
+    def __init__(self, path):
+        import tensorflow as tf
+
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=TENSORFLOW_THREADS)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = None
+
+    def features(self, img_batch):
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        if img_batch.shape[0] != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, img_batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = img_batch.shape[0]
+
+        self.interpreter.set_tensor(self.input_index, img_batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+class OnnxBackend:
+    """Runs an exported .onnx feature extractor with ONNX Runtime"""
+
+    def __init__(self, path):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("INFERENCE_BACKEND = 'onnx' requires: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = TENSORFLOW_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def features(self, img_batch):
+        img_batch = np.ascontiguousarray(img_batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: img_batch})[0]
+
+
+def load_backend(name):
+    """
+    Returns the feature extractor backend for INFERENCE_BACKEND, or None for
+    "keras" (the traced Keras graph is used directly).
+    """
+    if name == "keras":
+        return None
+    if name not in EXPORTED_FILES:
+        raise ValueError(f"Unknown inference backend: {name}")
+
+    path = exported_path(name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run: python convert_model.py export")
+
+    if name == "onnx":
+        return OnnxBackend(path)
+    return TFLiteBackend(path)
@@ -0,0 +1,135 @@
+"""
+API worker side of the shared inference server (see inference_server).
+
+With INFERENCE_SERVER set, prediction hands forward passes, lazy Grad-CAM
+and model status to inference_client instead of loading the model in this
+process. All requests share one pipelined Unix socket connection; losing
+it fails the requests in flight, and the next request reconnects.
+"""
+
+import asyncio
+import itertools
+
+from config import INFERENCE_SERVER, INFERENCE_SERVER_TIMEOUT, MODEL_WATCH_INTERVAL
+from inference_server import read_message, write_message
+
+
+class InferenceClient:
+    def __init__(self, path):
+        self.path = path
+        self.status = None  # Last model status from the server (ModelRegistry.describe()); None while unreachable
+        self._ids = itertools.count()
+        self._pending = {}
+        self._writer = None
+        self._reader = None
+        self._connecting = asyncio.Lock()
+        self._poller = None
+
+    def start(self):
+        """Keeps status current, so the worker follows model switches made on the server"""
+        if self._poller is None:
+            self._poller = asyncio.ensure_future(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _poll(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                self.status = None
+            await asyncio.sleep(MODEL_WATCH_INTERVAL or 5)
+
+    async def _connection(self):
+        async with self._connecting:
+            if self._writer is None:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._reader = asyncio.ensure_future(self._read_replies(reader, self._writer))
+            return self._writer
+
+    async def _read_replies(self, reader, writer):
+        try:
+            while True:
+                header, arrays = await read_message(reader)
+                future = self._pending.pop(header["id"], None)
+                if future is not None and not future.done():
+                    future.set_result((header, arrays))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Lost the connection to the inference server at {self.path}"))
+
+    async def call(self, op, arrays=(), **fields):
+        """
+        (reply header, reply arrays); errors raised on the server, and replies
+        not received within INFERENCE_SERVER_TIMEOUT, are raised as RuntimeError
+        """
+        writer = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await write_message(writer, dict(fields, id=request_id, op=op), arrays)
+            header, reply_arrays = await asyncio.wait_for(future, INFERENCE_SERVER_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No {op} reply from the inference server at {self.path} "
+                               f"within {INFERENCE_SERVER_TIMEOUT}s") from None
+        finally:
+            self._pending.pop(request_id, None)
+        if "error" in header:
+            raise RuntimeError(f"Inference server: {header['error']}")
+        return header, reply_arrays
+
+    async def infer(self, img_array, image_key):
+        header, (maps,) = await self.call("infer", [img_array], image_key=image_key)
+        return header["conf"], maps, header["version"]
+
+    async def gradcam(self, img_array, cached):
+        if cached is None:
+            header, (heatmap,) = await self.call("gradcam", [img_array])
+        else:
+            header, (heatmap,) = await self.call("gradcam", [img_array, cached[1]], version=cached[0])
+        return header["conf"], heatmap, header["version"]
+
+    async def refresh(self):
+        header, _ = await self.call("status")
+        self.status = header["status"]
+        return self.status
+
+    async def sync(self):
+        """Has the server apply MODEL_REGISTRY_FILE now; returns its model status"""
+        header, _ = await self.call("sync")
+        self.status = header["status"]
+        return self.status
+
+    async def wait_ready(self):
+        """Waits for the server to be up with a model loaded, at most INFERENCE_SERVER_TIMEOUT seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + INFERENCE_SERVER_TIMEOUT
+        while True:
+            try:
+                if (await self.refresh())["active"] is not None:
+                    return
+            except OSError:
+                pass  # Not listening yet, or restarting
+            if loop.time() >= deadline:
+                raise RuntimeError(f"The inference server at {self.path} has no model loaded")
+            await asyncio.sleep(0.5)
+
+
+inference_client = InferenceClient(INFERENCE_SERVER) if INFERENCE_SERVER else None
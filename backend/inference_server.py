@@ -0,0 +1,199 @@
+"""
+Shared inference server for multi-worker deployments.
+
+Every uvicorn worker that loads the model pays for its own copy of it and
+can only batch its own requests. Run one inference server instead and
+point the workers at it; model memory is paid once and scans from all
+workers are batched together:
+
+    python inference_server.py --socket /tmp/brain-tumor-inference.sock
+    INFERENCE_SERVER=/tmp/brain-tumor-inference.sock uvicorn main:app --workers 4
+
+Both run from backend/ on the same host. The server owns the model
+registry (hot reload, shadow model) and the batch scheduler; workers send
+it the preprocessed 224x224 input of each scan over the Unix socket (see
+inference_client) and keep decoding, storage and rendering to themselves.
+
+A message is an 8-byte frame (header length, payload length), a JSON
+header and the raw bytes of the arrays the header lists. Requests are
+pipelined: one connection carries many at once and every reply names the
+id of its request.
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import signal
+import struct
+import sys
+
+import numpy as np
+
+from config import INFERENCE_SERVER, INFERENCE_SERVER_SOCKET, METRICS_TOKEN
+
+_FRAME = struct.Struct("!II")
+
+# ============================================================
+# PROTOCOL
+# ============================================================
+async def write_message(writer, header, arrays=()):
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    header = json.dumps(dict(header, arrays=[[array.dtype.str, array.shape] for array in arrays])).encode()
+    # Consecutive writes with no await in between: concurrent senders can't interleave
+    writer.write(_FRAME.pack(len(header), sum(array.nbytes for array in arrays)))
+    writer.write(header)
+    for array in arrays:
+        writer.write(memoryview(array).cast("B"))
+    await writer.drain()
+
+async def read_message(reader):
+    """(header, arrays); the arrays are read-only views of the received bytes"""
+    header_size, payload_size = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    header = json.loads(await reader.readexactly(header_size))
+    payload = await reader.readexactly(payload_size)
+    arrays, offset = [], 0
+    for dtype, shape in header.pop("arrays"):
+        array = np.frombuffer(payload, dtype, int(np.prod(shape)), offset).reshape(shape)
+        offset += array.nbytes
+        arrays.append(array)
+    return header, arrays
+
+# ============================================================
+# SERVER
+# ============================================================
+class InferenceServer:
+    """Answers worker requests with this process's model (see prediction)"""
+
+    def __init__(self, prediction):
+        self.prediction = prediction
+        self.connections = 0
+        self._ops = {"infer": self._infer, "gradcam": self._gradcam, "status": self._status, "sync": self._sync}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        replies = set()
+        try:
+            while True:
+                header, arrays = await read_message(reader)
+                # Each request is answered on its own, so one worker's scans batch together too
+                reply = asyncio.ensure_future(self._answer(writer, header, arrays))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Worker gone
+        finally:
+            self.connections -= 1
+            for reply in replies:
+                reply.cancel()
+            writer.close()
+
+    async def _answer(self, writer, header, arrays):
+        op = self._ops.get(header.get("op"))
+        try:
+            if op is None:
+                raise ValueError(f"Unknown operation {header.get('op')!r}")
+            reply, reply_arrays = await op(header, arrays)
+        except Exception as e:
+            reply, reply_arrays = {"error": f"{type(e).__name__}: {e}"}, ()
+        reply["id"] = header.get("id")
+        try:
+            await write_message(writer, reply, reply_arrays)
+        except ConnectionError:
+            pass
+
+    async def _infer(self, header, arrays):
+        conf, maps, version = await self.prediction.infer(arrays[0], header["image_key"])
+        return {"conf": float(conf), "version": version}, [maps]
+
+    async def _gradcam(self, header, arrays):
+        cached = (header["version"], arrays[1]) if header.get("version") else None
+        conf, heatmap, version = await self.prediction.gradcam(arrays[0], cached)
+        return {"conf": float(conf), "version": version}, [heatmap]
+
+    async def _status(self, header, arrays):
+        return {"status": await self.prediction.model_status()}, ()
+
+    async def _sync(self, header, arrays):
+        return {"status": await self.prediction.sync_models()}, ()
+
+# ============================================================
+# METRICS
+# ============================================================
+async def handle_metrics(reader, writer):
+    """
+    Batching, model and shadow metrics live in this process, not in the API
+    workers, so they are served on a port of their own: GET /metrics, same
+    format and METRICS_TOKEN as the API's (serve() requires the token).
+    """
+    import metrics
+
+    try:
+        request = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        writer.close()
+        return
+    target = request[0].split(" ")[1] if request[0].count(" ") >= 2 else ""
+    headers = {name.lower(): value for name, _, value in (line.partition(": ") for line in request[1:])}
+    if target != "/metrics":
+        status, body = "404 Not Found", b"Not Found"
+    elif not hmac.compare_digest(headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        status, body = "401 Unauthorized", b"Invalid metrics token"
+    else:
+        status, body = "200 OK", metrics.render().encode()
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+# ============================================================
+# MAIN
+# ============================================================
+async def serve(path, metrics_port=0):
+    import metrics
+    import prediction
+
+    prediction.use_local_model()
+    server = InferenceServer(prediction)
+    if os.path.exists(path):
+        os.remove(path)  # Left behind by a server that did not shut down cleanly
+    unix_server = await asyncio.start_unix_server(server.handle, path)
+    metrics.Callback("inference_server_connections", "API workers connected", lambda: server.connections)
+    if metrics_port and not METRICS_TOKEN:
+        print(f"⚠️  Not serving metrics on port {metrics_port}: set METRICS_TOKEN first")
+        metrics_port = 0
+    metrics_server = await asyncio.start_server(handle_metrics, "0.0.0.0", metrics_port) if metrics_port else None
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    prediction.start_model()
+    print(f"🧠 Inference server listening on {path}; loading the model in the background")
+    try:
+        await stopping.wait()
+    finally:
+        print("👋 Inference server stopping")
+        unix_server.close()
+        await unix_server.wait_closed()
+        if metrics_server is not None:
+            metrics_server.close()
+        await prediction.stop_model()
+        if os.path.exists(path):
+            os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=INFERENCE_SERVER or INFERENCE_SERVER_SOCKET,
+                        help='Unix socket to listen on (default: %(default)s)')
+    parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port')
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.metrics_port))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Durable background inference queue.
+
+Uploads submitted to /jobs are stored in the jobs table and answered with a
+job id straight away. Worker tasks claim queued jobs (interactive before
+bulk, oldest first), run them through the same cached pipeline as /predict
+and record the resulting scan.
+
+Several processes (uvicorn workers) share the table. A claim records the
+owning process and a lease that is renewed while the job runs; only jobs
+whose lease lapsed, because their process crashed or was killed, are
+queued again, and a job is only finished by the process that still owns it.
+"""
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select, update
+
+from config import JOB_WORKERS, JOB_POLL_INTERVAL, JOB_LEASE_SECONDS, ENABLE_PREDICTION_CACHE
+from database import AsyncSessionLocal
+from executors import PoolBusyError
+from models import InferenceJob, Scan
+import prediction_cache
+import scan_stats
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+FINISHED_STATES = ("done", "failed")
+
+
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL, lease_seconds=JOB_LEASE_SECONDS):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        self._wakeup = None
+        self._changed = None
+
+    async def start(self):
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+
+        await self._requeue_lapsed()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._reaper()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake an idle worker after a job was committed"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_change(self, timeout):
+        """Used by the SSE stream; returns after any job changes state or timeout"""
+        if self._changed is None:
+            await asyncio.sleep(timeout)
+            return
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _requeue_lapsed(self):
+        """Queues running jobs whose lease lapsed (jobs from before leases existed have none)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(update(InferenceJob).where(
+                InferenceJob.status == "running",
+                or_(InferenceJob.lease_until.is_(None), InferenceJob.lease_until < datetime.utcnow())
+            ).values(status="queued", started_at=None, owner=None, lease_until=None))
+            await db.commit()
+        if result.rowcount:
+            print(f"♻️  Re-queued {result.rowcount} interrupted inference job(s)")
+            self.notify()
+
+    async def _reaper(self):
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 2)
+            try:
+                await self._requeue_lapsed()
+            except Exception as e:
+                print(f"❌ Could not re-queue interrupted jobs: {e}")
+
+    async def _heartbeat(self, job_id):
+        """Renews the lease of a running job until cancelled"""
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(InferenceJob).where(
+                        InferenceJob.id == job_id, InferenceJob.owner == self.owner
+                    ).values(lease_until=datetime.utcnow() + self.lease))
+                    await db.commit()
+            except Exception as e:
+                print(f"⚠️  Could not renew the lease of job {job_id}: {e}")
+
+    async def _finish(self, db, job_id, **values):
+        """
+        Updates the job in the session's transaction and commits, if this
+        process still owns it; otherwise rolls back and returns False.
+        """
+        owned = (await db.execute(update(InferenceJob).where(
+            InferenceJob.id == job_id,
+            InferenceJob.status == "running",
+            InferenceJob.owner == self.owner
+        ).values(**values))).rowcount
+        if not owned:
+            await db.rollback()
+            print(f"⚠️  Job {job_id} was taken over after its lease lapsed; dropping this run's result")
+            return False
+        await db.commit()
+        return True
+
+    async def _announce(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _claim(self, db):
+        """Atomically moves the next queued job to running, or returns None"""
+        while True:
+            job = await db.scalar(select(InferenceJob).where(InferenceJob.status == "queued").order_by(
+                InferenceJob.priority, InferenceJob.created_at
+            ).limit(1))
+            if job is None:
+                return None
+
+            now = datetime.utcnow()
+            claimed = (await db.execute(update(InferenceJob).where(
+                InferenceJob.id == job.id,
+                InferenceJob.status == "queued"
+            ).values(status="running", started_at=now, owner=self.owner, lease_until=now + self.lease))).rowcount
+            await db.commit()
+            if claimed:
+                await db.refresh(job)
+                return job
+
+    async def _worker(self):
+        while True:
+            async with AsyncSessionLocal() as db:
+                job = await self._claim(db)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self._announce()
+                await self._run(db, job)
+                await self._announce()
+
+    async def _run(self, db, job):
+        heartbeat = asyncio.ensure_future(self._heartbeat(job.id))
+        try:
+            await self._analyse(db, job)
+        finally:
+            heartbeat.cancel()
+
+    async def _analyse(self, db, job):
+        job_id = job.id  # The rollbacks below expire job
+        new_entry = None  # Files of a new prediction; removed unless its scan commits
+        try:
+            # Not shared with identical uploads until stored, so a run that
+            # loses its job can remove the files without breaking other scans
+            result, image_hash, new = await prediction_cache.analyse_upload(db, job.upload, defer_store=True)
+            if new:
+                new_entry = result
+            if ENABLE_PREDICTION_CACHE:
+                if new:
+                    await prediction_cache.store(db, image_hash, result)
+                elif not await prediction_cache.claim(db, image_hash, result):
+                    # A hit whose files are being deleted with the last scan using them; the next run predicts afresh
+                    await db.rollback()
+                    await self._finish(db, job_id, status="queued", started_at=None, owner=None, lease_until=None)
+                    return
+
+            scan = Scan(
+                doctor_id=job.doctor_id,
+                patient_name=job.patient_name,
+                patient_id=job.patient_id,
+                image_path=result["image_path"],
+                prediction=result["prediction"],
+                confidence=result["confidence"],
+                gradcam_path=result["gradcam_path"],
+                notes=job.notes,
+                image_hash=image_hash,
+                model_version=result["model_version"]
+            )
+            db.add(scan)
+            await db.flush()
+            await scan_stats.record(db, [scan])
+            # The scan commits only together with the job, and only while this process owns it
+            if await self._finish(db, job_id, status="done", scan_id=scan.id, upload=None,
+                                  finished_at=datetime.utcnow(), lease_until=None):
+                new_entry = None
+        except asyncio.CancelledError:
+            # Shutdown: hand it back now rather than when the lease lapses
+            await db.rollback()
+            await asyncio.shield(self._finish(db, job_id, status="queued", started_at=None, owner=None, lease_until=None))
+            raise
+        except PoolBusyError:
+            # Interactive /predict traffic has the CPU pool; try again shortly
+            await db.rollback()
+            await self._finish(db, job_id, status="queued", started_at=None, owner=None, lease_until=None)
+            await asyncio.sleep(self.poll_interval)
+        except Exception as e:
+            await db.rollback()
+            await self._finish(db, job_id, status="failed", error=str(e), upload=None,
+                               finished_at=datetime.utcnow(), lease_until=None)
+        finally:
+            if new_entry is not None:
+                await asyncio.shield(prediction_cache.discard([new_entry]))
+
+
+async def queue_position(db, job):
+    """Number of queued jobs that will run before this one"""
+    return await db.scalar(select(func.count()).select_from(InferenceJob).where(
+        InferenceJob.status == "queued",
+        (InferenceJob.priority < job.priority) |
+        ((InferenceJob.priority == job.priority) & (InferenceJob.created_at < job.created_at))
+    ))
+
+
+job_queue = JobQueue()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Read latency under write load
+
+Run against a running server (uvicorn main:app) from backend/:
+    python load_test.py --image path/to/scan.jpg
+    python load_test.py --image scan.jpg --url http://localhost:8000 --seconds 20
+
+Signs up (or logs in) a load-test doctor, then measures /me and /scans
+latency twice: once on their own and once while --writers clients keep
+posting /predict uploads. With the async database sessions the read
+percentiles of both phases should stay close; a blocked event loop or a
+locked database shows up as a jump in p95/p99 during the second phase.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import numpy as np
+
+READ_PATHS = ('/me', '/scans?limit=20')
+
+def request(url, data=None, headers=None, content_type=None):
+    headers = dict(headers or {})
+    if content_type:
+        headers['Content-Type'] = content_type
+    req = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(req, timeout=60) as response:
+        return response.status, response.read()
+
+def form(fields):
+    return urllib.parse.urlencode(fields).encode(), 'application/x-www-form-urlencoded'
+
+def multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'.encode() + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def login(base_url, email, password):
+    data, content_type = form({
+        'email': email, 'password': password,
+        'full_name': 'Load Test', 'license_number': f'LOAD-{email}'
+    })
+    try:
+        request(f'{base_url}/signup', data, content_type=content_type)
+    except urllib.error.HTTPError as e:
+        if e.code != 400:  # Already registered
+            raise
+    data, content_type = form({'username': email, 'password': password})
+    _, body = request(f'{base_url}/login', data, content_type=content_type)
+    return {'Authorization': f"Bearer {json.loads(body)['access_token']}"}
+
+def run_phase(base_url, headers, seconds, readers, writers, image):
+    """Returns ({path: [ms]}, inserts, errors) for one phase"""
+    stop = time.perf_counter() + seconds
+    latencies = {path: [] for path in READ_PATHS}
+    counts = {'inserts': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def reader(offset):
+        i = offset
+        while time.perf_counter() < stop:
+            path = READ_PATHS[i % len(READ_PATHS)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                request(f'{base_url}{path}', headers=headers)
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                latencies[path].append((time.perf_counter() - start) * 1000)
+
+    def writer():
+        while time.perf_counter() < stop:
+            data, content_type = multipart(
+                {'patient_name': 'Load Test', 'patient_id': 'LOAD'}, 'scan.jpg', image
+            )
+            try:
+                request(f'{base_url}/predict', data, headers, content_type)
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+                continue
+            with lock:
+                counts['inserts'] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, counts['inserts'], counts['errors']
+
+def summarise(label, latencies, inserts, errors, seconds):
+    print(f"\n{label}: {inserts / seconds:.1f} inserts/s, {errors} errors")
+    for path, values in latencies.items():
+        if not values:
+            print(f"  {path:<16} no successful requests")
+            continue
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"  {path:<16} {len(values) / seconds:7.1f} req/s  p50={p50:7.1f} ms  p95={p95:7.1f} ms  p99={p99:7.1f} ms")
+    return {
+        path: {'requests': len(v), 'p50': float(np.percentile(v, 50)), 'p95': float(np.percentile(v, 95)),
+               'p99': float(np.percentile(v, 99))} if v else None
+        for path, v in latencies.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--image', required=True, help='MRI image posted by the writers')
+    parser.add_argument('--email', default='loadtest@example.com')
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each phase')
+    parser.add_argument('--readers', type=int, default=8, help='Concurrent /me and /scans clients')
+    parser.add_argument('--writers', type=int, default=4, help='Concurrent /predict clients in phase 2')
+    parser.add_argument('--output', help='Write the results as JSON')
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as f:
+        image = f.read()
+    base_url = args.url.rstrip('/')
+    headers = login(base_url, args.email, args.password)
+
+    results = {}
+    for label, writers in (('reads only', 0), (f'reads + {args.writers} writers', args.writers)):
+        latencies, inserts, errors = run_phase(base_url, headers, args.seconds, args.readers, writers, image)
+        results[label] = summarise(label, latencies, inserts, errors, args.seconds)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
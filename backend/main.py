@@ -1,336 +1,961 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-from datetime import timedelta
-import os
-import uuid
-from typing import Optional
-
-from database import engine, get_db, Base
-from models import Doctor, Scan
-from auth import (
-    verify_password, get_password_hash, create_access_token,
-    ACCESS_TOKEN_EXPIRE_MINUTES, get_current_doctor
-)
-from prediction import predict_brain_tumor, load_model
-from pdf_generator import generate_medical_report
-
-# Create tables
-Base.metadata.create_all(bind=engine)
-
-# Initialize FastAPI
-app = FastAPI(title="Brain Tumor Detection API")
-
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Create necessary directories
-os.makedirs("uploads", exist_ok=True)
-os.makedirs("reports", exist_ok=True)
-
-# Mount static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Load ML model at startup
-@app.on_event("startup")
-async def startup_event():
-    load_model()
-    print("✅ Model loaded successfully!")
-
-# ============================================================
-# AUTHENTICATION ENDPOINTS
-# ============================================================
-
-@app.post("/signup")
-async def signup(
-    email: str = Form(...),
-    password: str = Form(...),
-    full_name: str = Form(...),
-    license_number: str = Form(...),
-    db: Session = Depends(get_db)
-):
-    # Check if doctor already exists
-    existing_doctor = db.query(Doctor).filter(Doctor.email == email).first()
-    if existing_doctor:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    existing_license = db.query(Doctor).filter(Doctor.license_number == license_number).first()
-    if existing_license:
-        raise HTTPException(status_code=400, detail="License number already registered")
-    
-    # Create new doctor
-    hashed_password = get_password_hash(password)
-    new_doctor = Doctor(
-        email=email,
-        full_name=full_name,
-        license_number=license_number,
-        hashed_password=hashed_password
-    )
-    
-    db.add(new_doctor)
-    db.commit()
-    db.refresh(new_doctor)
-    
-    return {"message": "Doctor registered successfully", "doctor_id": new_doctor.id}
-
-@app.post("/login")
-async def login(
-    form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
-):
-    doctor = db.query(Doctor).filter(Doctor.email == form_data.username).first()
-    
-    if not doctor or not verify_password(form_data.password, doctor.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect email or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": doctor.email}, expires_delta=access_token_expires
-    )
-    
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "doctor": {
-            "id": doctor.id,
-            "email": doctor.email,
-            "full_name": doctor.full_name,
-            "license_number": doctor.license_number
-        }
-    }
-
-@app.get("/me")
-async def get_current_user(current_doctor: Doctor = Depends(get_current_doctor)):
-    return {
-        "id": current_doctor.id,
-        "email": current_doctor.email,
-        "full_name": current_doctor.full_name,
-        "license_number": current_doctor.license_number
-    }
-
-# ============================================================
-# PREDICTION ENDPOINTS
-# ============================================================
-
-@app.post("/predict")
-async def predict_tumor(
-    file: UploadFile = File(...),
-    patient_name: str = Form(...),
-    patient_id: str = Form(...),
-    notes: Optional[str] = Form(None),
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    # Generate unique filenames
-    unique_id = str(uuid.uuid4())
-    image_filename = f"{unique_id}_original.jpg"
-    gradcam_filename = f"{unique_id}_gradcam.jpg"
-    
-    image_path = os.path.join("uploads", image_filename)
-    gradcam_path = os.path.join("uploads", gradcam_filename)
-    
-    # Read image bytes
-    image_bytes = await file.read()
-    
-    # Perform prediction
-    try:
-        prediction, confidence = await predict_brain_tumor(
-            image_bytes, image_path, gradcam_path
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
-    
-    # Save to database
-    new_scan = Scan(
-        doctor_id=current_doctor.id,
-        patient_name=patient_name,
-        patient_id=patient_id,
-        image_path=image_path,
-        prediction=prediction,
-        confidence=confidence,
-        gradcam_path=gradcam_path,
-        notes=notes
-    )
-    
-    db.add(new_scan)
-    db.commit()
-    db.refresh(new_scan)
-    
-    return {
-        "scan_id": new_scan.id,
-        "prediction": prediction,
-        "confidence": confidence,
-        "image_url": f"/uploads/{image_filename}",
-        "gradcam_url": f"/uploads/{gradcam_filename}",
-        "patient_name": patient_name,
-        "patient_id": patient_id,
-        "scan_date": new_scan.scan_date.isoformat()
-    }
-
-# ============================================================
-# HISTORY & REPORTS ENDPOINTS
-# ============================================================
-
-@app.get("/scans")
-async def get_scans(
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    scans = db.query(Scan).filter(Scan.doctor_id == current_doctor.id).order_by(Scan.scan_date.desc()).all()
-    
-    return [{
-        "id": scan.id,
-        "patient_name": scan.patient_name,
-        "patient_id": scan.patient_id,
-        "prediction": scan.prediction,
-        "confidence": scan.confidence,
-        "scan_date": scan.scan_date.isoformat(),
-        "image_url": f"/{scan.image_path}",
-        "gradcam_url": f"/{scan.gradcam_path}",
-        "notes": scan.notes
-    } for scan in scans]
-
-@app.get("/scan/{scan_id}")
-async def get_scan_details(
-    scan_id: int,
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    scan = db.query(Scan).filter(
-        Scan.id == scan_id,
-        Scan.doctor_id == current_doctor.id
-    ).first()
-    
-    if not scan:
-        raise HTTPException(status_code=404, detail="Scan not found")
-    
-    return {
-        "id": scan.id,
-        "patient_name": scan.patient_name,
-        "patient_id": scan.patient_id,
-        "prediction": scan.prediction,
-        "confidence": scan.confidence,
-        "scan_date": scan.scan_date.isoformat(),
-        "image_url": f"/{scan.image_path}",
-        "gradcam_url": f"/{scan.gradcam_path}",
-        "notes": scan.notes
-    }
-
-@app.get("/download-report/{scan_id}")
-async def download_report(
-    scan_id: int,
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    scan = db.query(Scan).filter(
-        Scan.id == scan_id,
-        Scan.doctor_id == current_doctor.id
-    ).first()
-    
-    if not scan:
-        raise HTTPException(status_code=404, detail="Scan not found")
-    
-    # Prepare data for PDF
-    scan_data = {
-        'patient_name': scan.patient_name,
-        'patient_id': scan.patient_id,
-        'scan_date': scan.scan_date.strftime('%Y-%m-%d %H:%M'),
-        'doctor_name': current_doctor.full_name,
-        'prediction': scan.prediction,
-        'confidence': scan.confidence,
-        'image_path': scan.image_path,
-        'gradcam_path': scan.gradcam_path,
-        'notes': scan.notes or 'No additional notes provided.'
-    }
-    
-    # Generate PDF
-    pdf_filename = f"report_{scan_id}_{uuid.uuid4()}.pdf"
-    pdf_path = os.path.join("reports", pdf_filename)
-    
-    try:
-        generate_medical_report(scan_data, pdf_path)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
-    
-    return FileResponse(
-        pdf_path,
-        media_type='application/pdf',
-        filename=f"Brain_Tumor_Report_{scan.patient_name}_{scan_id}.pdf"
-    )
-
-# ============================================================
-# DELETE SCAN ENDPOINT
-# ============================================================
-
-@app.delete("/scan/{scan_id}")
-async def delete_scan(
-    scan_id: int,
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    scan = db.query(Scan).filter(
-        Scan.id == scan_id,
-        Scan.doctor_id == current_doctor.id
-    ).first()
-    
-    if not scan:
-        raise HTTPException(status_code=404, detail="Scan not found")
-    
-    # Delete image files
-    try:
-        if os.path.exists(scan.image_path):
-            os.remove(scan.image_path)
-        if os.path.exists(scan.gradcam_path):
-            os.remove(scan.gradcam_path)
-    except Exception as e:
-        print(f"Error deleting files: {e}")
-    
-    # Delete database record
-    db.delete(scan)
-    db.commit()
-    
-    return {"message": "Scan deleted successfully"}
-
-# ============================================================
-# STATS ENDPOINT
-# ============================================================
-@app.get("/stats")
-async def get_stats(
-    current_doctor: Doctor = Depends(get_current_doctor),
-    db: Session = Depends(get_db)
-):
-    total_scans = db.query(Scan).filter(Scan.doctor_id == current_doctor.id).count()
-    tumor_detected = db.query(Scan).filter(
-        Scan.doctor_id == current_doctor.id,
-        Scan.prediction == "Tumor Detected"  # match your prediction label
-    ).count()
-    no_tumor = total_scans - tumor_detected
-    
-    return {
-        "total_scans": total_scans,
-        "tumor_detected": tumor_detected,
-        "no_tumor": no_tumor
-    }
-
-
-if __name__ == "__main__":
-    import uvicorn
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, timedelta
+import asyncio
+import base64
+import hmac
+import json
+import os
+import uuid
+import zipfile
+from typing import List, Optional
+
+from database import engine, async_engine, get_db, Base, upgrade_schema, AsyncSessionLocal
+from models import Doctor, Scan, InferenceJob
+from auth import (
+    hash_password, verify_and_rehash, create_access_token, token_claims,
+    ACCESS_TOKEN_EXPIRE_MINUTES, get_current_doctor, DoctorPrincipal
+)
+from prediction import (
+    start_model, stop_model, model_status, sync_models, ensure_gradcam, ensure_thumbnail, feature_cache
+)
+from inference_client import inference_client
+from model_registry import model_file, read_registry_file, write_registry_file
+from executors import cpu_pool, auth_pool, report_pool, shadow_pool, PoolBusyError
+from imaging import InvalidImageError
+from upload_limits import UploadSizeLimitMiddleware, StudyLimitError, read_upload, read_zip_images
+from storage import storage, storage_key, file_url, thumbnail_key, cache_headers, UPLOAD_KEY
+from config import (
+    BATCH_UPLOAD_MAX_FILES, BATCH_UPLOAD_CONCURRENCY, SCANS_PAGE_SIZE, SCANS_PAGE_MAX,
+    MAX_STUDY_UPLOAD_SIZE, PATIENT_REPORT_WINDOW, ENABLE_METRICS, METRICS_TOKEN, MODEL_ADMIN_TOKEN, SHADOW_SAMPLE_RATE,
+    ENABLE_PREDICTION_CACHE, TUMOR_LABEL
+)
+import prediction_cache
+import report_cache
+import scan_stats
+import metrics
+from job_queue import job_queue, queue_position, PRIORITY_INTERACTIVE, PRIORITY_BULK, FINISHED_STATES
+
+# Create tables
+Base.metadata.create_all(bind=engine)
+upgrade_schema()
+
+# Initialize FastAPI
+app = FastAPI(title="Brain Tumor Detection API")
+
+# Oversized uploads are refused while they arrive (inside CORS so the 413 is readable)
+app.add_middleware(UploadSizeLimitMiddleware)
+
+# CORS Configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+# Metrics are only served with a token, so without one they aren't collected either
+METRICS_SERVED = ENABLE_METRICS and bool(METRICS_TOKEN)
+
+# Outermost, so rejected and failed requests are timed too
+if METRICS_SERVED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Create necessary directories
+os.makedirs("reports", exist_ok=True)
+
+# Scans, thumbnails and Grad-CAM overlays come from the configured storage:
+# a file from the sharded uploads/ tree, or a presigned / proxied S3 object
+async def recorded_prediction(db: AsyncSession, gradcam_key: str):
+    """(label, model version) stored for the scans sharing a Grad-CAM overlay, None if there are none"""
+    return (await db.execute(
+        select(Scan.prediction, Scan.model_version).where(Scan.gradcam_path == gradcam_key).limit(1)
+    )).first()
+
+def known_prediction(scan):
+    """stored_prediction for ensure_gradcam() when the scan is already loaded"""
+    recorded = (scan.prediction, scan.model_version)
+    async def stored():
+        return recorded
+    return stored
+
+@app.get("/uploads/{key}")
+async def get_upload(key: str, request: Request, db: AsyncSession = Depends(get_db)):
+    if not UPLOAD_KEY.match(key):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    # Keys name immutable content, so a known ETag needs no storage lookup
+    headers = cache_headers(key)
+    if_none_match = request.headers.get("if-none-match", "")
+    if headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    # Overlays may be rendered on first view (GRADCAM_MODE = "lazy"), and
+    # scans stored before thumbnails existed get theirs on first view
+    original_key = key.rsplit("_", 1)[0] + "_original.jpg"
+    try:
+        if key.endswith("_gradcam.jpg"):
+            found = await ensure_gradcam(original_key, key, lambda: recorded_prediction(db, key))
+        elif key.endswith("_thumb.webp"):
+            found = await ensure_thumbnail(original_key)
+        else:
+            found = True
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly", headers={"Retry-After": "5"})
+    if not found:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    response = await storage.response(key)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    if not METRICS_SERVED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Mount static files
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# Liveness: the process is up and its event loop answers
+@app.get("/health", include_in_schema=False)
+async def health():
+    return {"status": "ok"}
+
+# Readiness: scans can be analysed without waiting for the model
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    try:
+        models = await model_status()
+    except Exception:
+        raise HTTPException(status_code=503, detail="Inference server unavailable", headers={"Retry-After": "5"})
+    if models["active"] is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded yet", headers={"Retry-After": "5"})
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable", headers={"Retry-After": "5"})
+    seconds = models["cold_start"]["seconds"]
+    return {
+        "status": "ready",
+        "model": models["active"]["version"],
+        "format": models["cold_start"]["format"],
+        "cold_start_seconds": round(seconds, 2) if seconds is not None else None
+    }
+
+# The model loads and warms up in the background (see /ready); requests
+# that need it before then wait for it
+@app.on_event("startup")
+async def startup_event():
+    start_model()
+    uptime = metrics.process_uptime()
+    if uptime is not None:
+        model = (f"using the inference server at {inference_client.path}" if inference_client is not None
+                 else "loading the model in the background")
+        print(f"🚀 API up {uptime:.1f}s after process start; {model}")
+    await scan_stats.backfill()
+    await report_cache.sweep()
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_queue.stop()
+    await stop_model()
+    cpu_pool.shutdown()
+    auth_pool.shutdown()
+    report_pool.shutdown()
+    shadow_pool.shutdown()
+    # Pooled aiosqlite connections each own a thread
+    await async_engine.dispose()
+
+# ============================================================
+# AUTHENTICATION ENDPOINTS
+# ============================================================
+
+@app.post("/signup")
+async def signup(
+    email: str = Form(...),
+    password: str = Form(...),
+    full_name: str = Form(...),
+    license_number: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
+    # Check if doctor already exists
+    existing_doctor = await db.scalar(select(Doctor).where(Doctor.email == email))
+    if existing_doctor:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    existing_license = await db.scalar(select(Doctor).where(Doctor.license_number == license_number))
+    if existing_license:
+        raise HTTPException(status_code=400, detail="License number already registered")
+    
+    # Create new doctor
+    try:
+        hashed_password = await hash_password(password)
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly", headers={"Retry-After": "2"})
+    new_doctor = Doctor(
+        email=email,
+        full_name=full_name,
+        license_number=license_number,
+        hashed_password=hashed_password
+    )
+    
+    db.add(new_doctor)
+    await db.commit()
+    await db.refresh(new_doctor)
+    
+    return {"message": "Doctor registered successfully", "doctor_id": new_doctor.id}
+
+@app.post("/login")
+async def login(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_db)
+):
+    doctor = await db.scalar(select(Doctor).where(Doctor.email == form_data.username))
+    
+    valid, new_hash = False, None
+    if doctor:
+        try:
+            valid, new_hash = await verify_and_rehash(form_data.password, doctor.hashed_password)
+        except PoolBusyError:
+            raise HTTPException(status_code=503, detail="Server is busy, please retry shortly", headers={"Retry-After": "2"})
+    
+    if not valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # Stored with a different BCRYPT_ROUNDS; upgrade while we have the password
+    if new_hash:
+        doctor.hashed_password = new_hash
+        await db.commit()
+    
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data=token_claims(doctor), expires_delta=access_token_expires
+    )
+    
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "doctor": {
+            "id": doctor.id,
+            "email": doctor.email,
+            "full_name": doctor.full_name,
+            "license_number": doctor.license_number
+        }
+    }
+
+@app.get("/me")
+async def get_current_user(current_doctor: DoctorPrincipal = Depends(get_current_doctor)):
+    return {
+        "id": current_doctor.id,
+        "email": current_doctor.email,
+        "full_name": current_doctor.full_name,
+        "license_number": current_doctor.license_number
+    }
+
+# ============================================================
+# PREDICTION ENDPOINTS
+# ============================================================
+
+@app.post("/predict")
+async def predict_tumor(
+    file: UploadFile = File(...),
+    patient_name: str = Form(...),
+    patient_id: str = Form(...),
+    notes: Optional[str] = Form(None),
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    # Read in chunks: size cap and JPEG/PNG check on the actual bytes
+    with metrics.stage_seconds.time("upload_read"):
+        image_bytes = await read_upload(file)
+    
+    # Perform prediction (or reuse the result for an identical slice)
+    try:
+        result, image_hash, _ = await prediction_cache.analyse_upload(db, image_bytes)
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy analysing other scans, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    
+    # Save to database
+    new_scan = Scan(
+        doctor_id=current_doctor.id,
+        patient_name=patient_name,
+        patient_id=patient_id,
+        image_path=result["image_path"],
+        prediction=result["prediction"],
+        confidence=result["confidence"],
+        gradcam_path=result["gradcam_path"],
+        notes=notes,
+        image_hash=image_hash,
+        model_version=result["model_version"]
+    )
+    
+    with metrics.stage_seconds.time("db_commit"):
+        db.add(new_scan)
+        await db.flush()
+        await scan_stats.record(db, [new_scan])
+        await db.commit()
+        await db.refresh(new_scan)
+    
+    report_cache.prerender(new_scan.id, report_cache.report_data(new_scan, current_doctor.full_name))
+    
+    return {
+        "scan_id": new_scan.id,
+        "prediction": new_scan.prediction,
+        "confidence": new_scan.confidence,
+        "image_url": file_url(new_scan.image_path),
+        "gradcam_url": file_url(new_scan.gradcam_path),
+        "patient_name": patient_name,
+        "patient_id": patient_id,
+        "scan_date": new_scan.scan_date.isoformat(),
+        "model_version": new_scan.model_version
+    }
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    patient_name: str = Form(...),
+    patient_id: str = Form(...),
+    notes: Optional[str] = Form(None),
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor)
+):
+    """
+    Analyse a whole study for one patient: several images and/or zip
+    archives of images. Returns NDJSON, one line per image as soon as it
+    finishes, then a summary line once every scan has been saved in a
+    single transaction.
+    """
+    uploads = []
+    total_bytes = 0
+    for file in files:
+        if (file.filename or "").lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+            # Decompressed off the event loop, within what is left of the study's file and byte limits
+            archive = await read_upload(file, limit=MAX_STUDY_UPLOAD_SIZE, check_format=False)
+            try:
+                images = await cpu_pool.run(
+                    read_zip_images, archive, BATCH_UPLOAD_MAX_FILES - len(uploads), MAX_STUDY_UPLOAD_SIZE - total_bytes
+                )
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            except StudyLimitError as e:
+                raise HTTPException(status_code=e.status_code, detail=e.detail)
+            except PoolBusyError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server is busy analysing other scans, please retry shortly",
+                    headers={"Retry-After": "5"}
+                )
+        else:
+            images = [(file.filename, await read_upload(file, check_format=False))]
+
+        uploads.extend(images)
+        total_bytes += sum(len(data) for _, data in images)
+        if len(uploads) > BATCH_UPLOAD_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"At most {BATCH_UPLOAD_MAX_FILES} images per study")
+
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    doctor_id = current_doctor.id
+
+    async def stream():
+        # Request-scoped dependencies are closed before streaming starts
+        db = AsyncSessionLocal()
+        # Enough uploads in flight to fill model batches without flooding the CPU pool
+        slots = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+        async def analyse(index, filename, image_bytes):
+            async with slots:
+                try:
+                    # A session can only run one query at a time, so each
+                    # image looks up its cache entry separately; new entries
+                    # are stored with the study's scans
+                    async with AsyncSessionLocal() as cache_db:
+                        result, image_hash, new = await prediction_cache.analyse_upload(cache_db, image_bytes, defer_store=True)
+                        await cache_db.commit()
+                    return index, filename, result, image_hash, new, None
+                except Exception as e:
+                    return index, filename, None, None, False, str(e)
+
+        tasks = []
+        committed = False
+        try:
+            tasks = [asyncio.ensure_future(analyse(i, name, data)) for i, (name, data) in enumerate(uploads)]
+            new_scans = []
+            for finished in asyncio.as_completed(tasks):
+                index, filename, result, image_hash, new, error = await finished
+                if error:
+                    yield json.dumps({"type": "error", "index": index, "filename": filename, "detail": error}) + "\n"
+                    continue
+
+                new_scans.append((index, Scan(
+                    doctor_id=doctor_id,
+                    patient_name=patient_name,
+                    patient_id=patient_id,
+                    image_path=result["image_path"],
+                    prediction=result["prediction"],
+                    confidence=result["confidence"],
+                    gradcam_path=result["gradcam_path"],
+                    notes=notes,
+                    image_hash=image_hash,
+                    model_version=result["model_version"]
+                )))
+                yield json.dumps({
+                    "type": "result",
+                    "index": index,
+                    "filename": filename,
+                    "prediction": result["prediction"],
+                    "confidence": result["confidence"],
+                    "image_url": file_url(result['image_path']),
+                    "gradcam_url": file_url(result['gradcam_path']),
+                    "model_version": result["model_version"]
+                }) + "\n"
+
+            # One transaction for the whole study, cache entries included
+            if ENABLE_PREDICTION_CACHE:
+                released = set()
+                for task in tasks:
+                    index, filename, entry, entry_hash, new, error = task.result()
+                    if error:
+                        continue
+                    if new:
+                        await prediction_cache.store(db, entry_hash, entry)
+                    elif not await prediction_cache.claim(db, entry_hash, entry):
+                        # A cache hit whose files are being deleted along with the last scan using them
+                        released.add(index)
+                        yield json.dumps({"type": "error", "index": index, "filename": filename,
+                                          "detail": "The cached result was deleted meanwhile, please upload it again"}) + "\n"
+                new_scans = [item for item in new_scans if item[0] not in released]
+            new_scans.sort(key=lambda item: item[0])
+            db.add_all([scan for _, scan in new_scans])
+            await db.flush()
+            await scan_stats.record(db, [scan for _, scan in new_scans])
+            await db.commit()
+            committed = True
+
+            yield json.dumps({
+                "type": "summary",
+                "patient_name": patient_name,
+                "patient_id": patient_id,
+                "total": len(uploads),
+                "saved": len(new_scans),
+                "failed": len(uploads) - len(new_scans),
+                "tumor_detected": sum(1 for _, scan in new_scans if scan.prediction == TUMOR_LABEL),
+                "scan_ids": {index: scan.id for index, scan in new_scans}
+            }) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            if not committed:
+                # Aborted or failed: the files of new predictions belong to no scan
+                new_entries = [task.result()[2] for task in tasks
+                               if task.done() and not task.cancelled() and task.result()[4]]
+                await asyncio.shield(prediction_cache.discard(new_entries))
+            await db.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# ============================================================
+# BACKGROUND JOB ENDPOINTS
+# ============================================================
+
+async def _job_status(db: AsyncSession, job: InferenceJob):
+    status = {
+        "job_id": job.id,
+        "status": job.status,
+        "patient_name": job.patient_name,
+        "patient_id": job.patient_id,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == "queued":
+        status["queue_position"] = await queue_position(db, job)
+    if job.status == "failed":
+        status["error"] = job.error
+    if job.status == "done":
+        scan = await db.get(Scan, job.scan_id)
+        if scan:
+            status["result"] = {
+                "scan_id": scan.id,
+                "prediction": scan.prediction,
+                "confidence": scan.confidence,
+                "image_url": file_url(scan.image_path),
+                "gradcam_url": file_url(scan.gradcam_path),
+                "scan_date": scan.scan_date.isoformat()
+            }
+    return status
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    patient_name: str = Form(...),
+    patient_id: str = Form(...),
+    notes: Optional[str] = Form(None),
+    priority: str = Form("interactive"),
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """Queue a scan for analysis and return immediately with a job id"""
+    if priority not in ("interactive", "bulk"):
+        raise HTTPException(status_code=400, detail="priority must be 'interactive' or 'bulk'")
+
+    job = InferenceJob(
+        id=str(uuid.uuid4()),
+        doctor_id=current_doctor.id,
+        patient_name=patient_name,
+        patient_id=patient_id,
+        notes=notes,
+        upload=await read_upload(file),
+        priority=PRIORITY_INTERACTIVE if priority == "interactive" else PRIORITY_BULK
+    )
+    db.add(job)
+    await db.commit()
+    job_queue.notify()
+
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+async def _get_job(db: AsyncSession, job_id: str, doctor: DoctorPrincipal):
+    job = await db.scalar(select(InferenceJob).where(
+        InferenceJob.id == job_id,
+        InferenceJob.doctor_id == doctor.id
+    ))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    return await _job_status(db, await _get_job(db, job_id, current_doctor))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(
+    job_id: str,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """Server-sent events: one "status" event per state change until the job finishes"""
+    await _get_job(db, job_id, current_doctor)
+    doctor_id = current_doctor.id
+
+    async def stream():
+        last = None
+        while True:
+            # Fresh session per poll so we see the workers' commits
+            async with AsyncSessionLocal() as events_db:
+                job = await events_db.scalar(select(InferenceJob).where(
+                    InferenceJob.id == job_id,
+                    InferenceJob.doctor_id == doctor_id
+                ))
+                status = await _job_status(events_db, job)
+
+            if status != last:
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+                last = status
+            if status["status"] in FINISHED_STATES:
+                return
+
+            await job_queue.wait_for_change(timeout=15)
+            yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# ============================================================
+# HISTORY & REPORTS ENDPOINTS
+# ============================================================
+
+def _encode_cursor(scan_date, scan_id):
+    return base64.urlsafe_b64encode(f"{scan_date.isoformat()}|{scan_id}".encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        scan_date, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(scan_date), int(scan_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/scans")
+async def get_scans(
+    response: Response,
+    limit: int = Query(SCANS_PAGE_SIZE, ge=1, le=SCANS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Scan history, newest first, one page at a time. While more scans exist
+    the X-Next-Cursor response header holds the cursor for the next page.
+    Open a scan with /scan/{id} for its notes.
+    """
+    # Only the columns the list view needs, read straight off ix_scans_doctor_date
+    query = select(
+        Scan.id, Scan.patient_name, Scan.patient_id, Scan.prediction,
+        Scan.confidence, Scan.scan_date, Scan.image_path, Scan.gradcam_path
+    ).where(Scan.doctor_id == current_doctor.id)
+
+    if cursor:
+        scan_date, scan_id = _decode_cursor(cursor)
+        query = query.where(tuple_(Scan.scan_date, Scan.id) < tuple_(scan_date, scan_id))
+
+    scans = (await db.execute(query.order_by(Scan.scan_date.desc(), Scan.id.desc()).limit(limit + 1))).all()
+    if len(scans) > limit:
+        scans = scans[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(scans[-1].scan_date, scans[-1].id)
+    
+    return [{
+        "id": scan.id,
+        "patient_name": scan.patient_name,
+        "patient_id": scan.patient_id,
+        "prediction": scan.prediction,
+        "confidence": scan.confidence,
+        "scan_date": scan.scan_date.isoformat(),
+        "image_url": file_url(scan.image_path),
+        "thumbnail_url": file_url(thumbnail_key(scan.image_path)),
+        "gradcam_url": file_url(scan.gradcam_path)
+    } for scan in scans]
+
+@app.get("/scan/{scan_id}")
+async def get_scan_details(
+    scan_id: int,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    scan = await db.scalar(select(Scan).where(
+        Scan.id == scan_id,
+        Scan.doctor_id == current_doctor.id
+    ))
+    
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    return {
+        "id": scan.id,
+        "patient_name": scan.patient_name,
+        "patient_id": scan.patient_id,
+        "prediction": scan.prediction,
+        "confidence": scan.confidence,
+        "scan_date": scan.scan_date.isoformat(),
+        "image_url": file_url(scan.image_path),
+        "gradcam_url": file_url(scan.gradcam_path),
+        "notes": scan.notes,
+        "model_version": scan.model_version
+    }
+
+@app.get("/download-report/{scan_id}")
+async def download_report(
+    scan_id: int,
+    request: Request,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    scan = await db.scalar(select(Scan).where(
+        Scan.id == scan_id,
+        Scan.doctor_id == current_doctor.id
+    ))
+    
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    # Lazily deferred Grad-CAM overlays must exist before they are embedded
+    try:
+        await ensure_gradcam(scan.image_path, scan.gradcam_path, known_prediction(scan))
+    except Exception as e:
+        print(f"Grad-CAM generation failed: {str(e)}")
+
+    # Prepare data for PDF
+    scan_data = report_cache.report_data(scan, current_doctor.full_name)
+    headers = {"ETag": await report_cache.etag(scan_data), "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    # Served from reports/ unless this version was never rendered
+    try:
+        pdf_path = await report_cache.get_report(scan_id, scan_data)
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly", headers={"Retry-After": "5"})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"PDF generation failed: {str(e)}")
+    
+    return FileResponse(
+        pdf_path,
+        media_type='application/pdf',
+        filename=f"Brain_Tumor_Report_{scan.patient_name}_{scan_id}.pdf",
+        headers=headers
+    )
+
+@app.get("/patients/{patient_id}/report")
+async def download_patient_report(
+    patient_id: str,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    One PDF for tumor boards: a summary of every scan of the patient followed
+    by each scan's report. Scan reports are rendered a few at a time on the
+    report pool and streamed into the document in scan order.
+    """
+    from pdf_generator import render_patient_summary
+    from pdf_stream import PDFStreamWriter
+
+    scans = (await db.scalars(select(Scan).where(
+        Scan.doctor_id == current_doctor.id,
+        Scan.patient_id == patient_id
+    ).order_by(Scan.scan_date, Scan.id))).all()
+    
+    if not scans:
+        raise HTTPException(status_code=404, detail="No scans found for this patient")
+    
+    # Plain data only: the request's session is closed before streaming starts
+    reports = [(scan.id, scan.image_path, scan.gradcam_path, known_prediction(scan), report_cache.report_data(scan, current_doctor.full_name))
+               for scan in scans]
+    summary = {
+        'patient_name': scans[-1].patient_name,
+        'patient_id': patient_id,
+        'doctor_name': current_doctor.full_name,
+        'scans': [{
+            'scan_date': scan.scan_date.strftime('%Y-%m-%d %H:%M'),
+            'prediction': scan.prediction,
+            'confidence': scan.confidence
+        } for scan in scans]
+    }
+    
+    try:
+        cover = await report_pool.run(render_patient_summary, summary)
+    except PoolBusyError:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly", headers={"Retry-After": "5"})
+    
+    async def scan_report(scan_id, image_path, gradcam_path, stored_prediction, data):
+        try:
+            await ensure_gradcam(image_path, gradcam_path, stored_prediction)
+        except Exception as e:
+            print(f"Grad-CAM generation failed: {str(e)}")
+        return await report_cache.read_report(scan_id, data)
+    
+    async def stream():
+        writer = PDFStreamWriter()
+        yield writer.start()
+        yield writer.add(cover)
+        
+        # At most PATIENT_REPORT_WINDOW rendered reports are held at a time
+        tasks = []
+        
+        async def next_report():
+            task = tasks.pop(0)
+            try:
+                return await task
+            except Exception as e:
+                # Headers are already sent; leave the scan out rather than break the PDF
+                print(f"Patient report: scan report failed: {str(e)}")
+                return None
+        
+        try:
+            for item in reports:
+                tasks.append(asyncio.ensure_future(scan_report(*item)))
+                if len(tasks) >= PATIENT_REPORT_WINDOW:
+                    pdf = await next_report()
+                    if pdf:
+                        yield writer.add(pdf)
+            while tasks:
+                pdf = await next_report()
+                if pdf:
+                    yield writer.add(pdf)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        yield writer.close()
+    
+    filename = f"Brain_Tumor_Patient_Report_{patient_id}.pdf"
+    return StreamingResponse(
+        stream(),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ============================================================
+# DELETE SCAN ENDPOINT
+# ============================================================
+
+@app.delete("/scan/{scan_id}")
+async def delete_scan(
+    scan_id: int,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    scan = await db.scalar(select(Scan).where(
+        Scan.id == scan_id,
+        Scan.doctor_id == current_doctor.id
+    ))
+    
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    # Image files go too, unless another scan of the same slice still uses them
+    remove_files = await prediction_cache.release(db, scan)
+    
+    # Delete database record
+    await scan_stats.record(db, [scan], sign=-1)
+    await db.delete(scan)
+    await db.commit()
+    
+    # Only once the delete is committed, and if no scan committed since uses them either
+    if remove_files and await db.scalar(select(Scan.id).where(Scan.image_path == scan.image_path).limit(1)) is None:
+        try:
+            await storage.delete(scan.image_path)
+            await storage.delete(thumbnail_key(scan.image_path))
+            await storage.delete(scan.gradcam_path)
+        except Exception as e:
+            print(f"Error deleting files: {e}")
+        feature_cache.pop(storage_key(scan.gradcam_path))
+    
+    return {"message": "Scan deleted successfully"}
+
+# ============================================================
+# STATS ENDPOINT
+# ============================================================
+@app.get("/stats")
+async def get_stats(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """All-time counts, or between two UTC days (inclusive) when given"""
+    if start or end:
+        total_scans, tumor_detected = await scan_stats.range_totals(db, current_doctor.id, start, end)
+    else:
+        total_scans, tumor_detected = await scan_stats.totals(db, current_doctor.id)
+    no_tumor = total_scans - tumor_detected
+    
+    return {
+        "total_scans": total_scans,
+        "tumor_detected": tumor_detected,
+        "no_tumor": no_tumor
+    }
+
+
+@app.get("/stats/trend")
+async def get_stats_trend(
+    period: str = Query("day", pattern="^(day|week)$"),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_doctor: DoctorPrincipal = Depends(get_current_doctor),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Scans and positive rate per day or per week (weeks start on Monday).
+    Defaults to the last 30 days, or the last 12 weeks.
+    """
+    end = end or datetime.utcnow().date()
+    if start is None:
+        start = end - (timedelta(weeks=11) if period == "week" else timedelta(days=29))
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    limit = scan_stats.TREND_MAX_PERIODS[period]
+    if scan_stats.trend_periods(start, end, period) > limit:
+        raise HTTPException(status_code=400, detail=f"A trend covers at most {limit} {period}s")
+
+    return {
+        "period": period,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "points": await scan_stats.trend(db, current_doctor.id, start, end, period)
+    }
+
+
+# ============================================================
+# MODEL ADMIN ENDPOINTS
+# ============================================================
+# Switch the active model file, or sample traffic through a candidate, with
+# no restart. Changes are written to MODEL_REGISTRY_FILE, so every worker
+# follows within MODEL_WATCH_INTERVAL; this one (or the inference server it
+# uses) applies them before answering.
+
+def require_model_admin(request: Request):
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {MODEL_ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid model admin token")
+
+def _model_path(name: str):
+    try:
+        path = model_file(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"{path} not found")
+    return path
+
+@app.get("/admin/models", dependencies=[Depends(require_model_admin)])
+async def get_models():
+    return await model_status()
+
+@app.post("/admin/models/active", dependencies=[Depends(require_model_admin)])
+async def activate_model(file: str = Form(...)):
+    """Loads and warms up model/<file> while the current version serves, then swaps"""
+    path = _model_path(file)
+    _, shadow, shadow_sample_rate = read_registry_file()
+    write_registry_file(path, shadow, shadow_sample_rate)
+    models = await sync_models()
+    if models["active"] is None or models["active"]["file"] != os.path.basename(path):
+        raise HTTPException(status_code=500, detail=f"Could not load {path}, see the server log")
+    return models
+
+@app.post("/admin/models/shadow", dependencies=[Depends(require_model_admin)])
+async def set_shadow_model(
+    file: str = Form(...),
+    sample_rate: float = Form(SHADOW_SAMPLE_RATE, ge=0, le=1)
+):
+    """Classifies sample_rate of the scans with model/<file> too and logs disagreements"""
+    path = _model_path(file)
+    active, _, _ = read_registry_file()
+    write_registry_file(active, path, sample_rate)
+    models = await sync_models()
+    if models["shadow"] is None or models["shadow"]["file"] != os.path.basename(path):
+        raise HTTPException(status_code=500, detail=f"Could not load {path}, see the server log")
+    return models
+
+@app.delete("/admin/models/shadow", dependencies=[Depends(require_model_admin)])
+async def stop_shadow_model():
+    active, _, shadow_sample_rate = read_registry_file()
+    write_registry_file(active, None, shadow_sample_rate)
+    return await sync_models()
+
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
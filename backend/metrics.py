@@ -0,0 +1,317 @@
+"""
+Prometheus metrics for the API and the prediction pipeline.
+
+Recording a value is a bisect and a few additions under a lock; nothing is
+formatted until /metrics is scraped. Values the app already keeps (pool and
+batch queue depths, cache counters, process memory) are only read at
+scrape time.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import CACHES
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+REGISTRY = []
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        """(suffix, label values, extra label, value) rows for the exposition"""
+        return []
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for suffix, label_values, extra, value in self.samples():
+            yield f"{self.name}{suffix}{_labels(self.labels, label_values, extra)} {_number(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("", key, "", value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observes the duration of the with block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        rows = []
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                rows.append(("_bucket", key, f'le="{bound}"', cumulative))
+            rows.append(("_sum", key, "", values[-1]))
+            rows.append(("_count", key, "", cumulative))
+        return rows
+
+
+class Callback(Metric):
+    """
+    Gauge or counter read at scrape time. fn returns a number, or a dict of
+    label values tuple -> number; None leaves the metric out.
+    """
+
+    def __init__(self, name, help, fn, labels=(), kind="gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self):
+        values = self.fn()
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [("", key, "", value) for key, value in sorted(values.items())]
+
+    def collect(self):
+        rows = list(super().collect())
+        return rows if len(rows) > 2 else []
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# ============================================================
+# HTTP
+# ============================================================
+http_request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time from request start until the response is fully sent",
+    labels=("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request; labelled by route template, not by URL"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router leaves what it matched in the scope
+            route = scope.get("route")
+            if route is not None:
+                path = route.path
+            elif "endpoint" in scope:
+                path = scope["root_path"]  # Mounted app (static files)
+            else:
+                path = "unmatched"
+            http_request_seconds.observe(time.perf_counter() - start, scope["method"], path, status)
+
+
+# ============================================================
+# PREDICTION PIPELINE
+# ============================================================
+# upload_read, decode (incl. preprocessing), save, inference (batch wait +
+# forward pass), gradcam (lazy mode only), gradcam_render, store, db_commit
+stage_seconds = Histogram(
+    "predict_stage_duration_seconds",
+    "Time spent in each stage of the prediction pipeline, including pool queueing",
+    labels=("stage",)
+)
+
+batch_size = Histogram(
+    "inference_batch_size",
+    "Scans per forward pass",
+    buckets=BATCH_SIZE_BUCKETS
+)
+
+batch_seconds = Histogram(
+    "inference_batch_duration_seconds",
+    "Forward pass time per batch on the model thread (includes Grad-CAM in eager mode)"
+)
+
+batch_wait_seconds = Histogram(
+    "inference_queue_wait_seconds",
+    "Time a scan waits for its batch to start"
+)
+
+prediction_cache_requests = Counter(
+    "prediction_cache_requests_total",
+    "Uploads answered from the prediction cache (hit) or by running the model (miss)",
+    labels=("result",)
+)
+
+shadow_predictions = Counter(
+    "shadow_predictions_total",
+    "Sampled scans run through the shadow model: agree / disagree with the active model, dropped, failed",
+    labels=("result",)
+)
+
+shadow_probability_delta = Histogram(
+    "shadow_probability_delta",
+    "Absolute difference between the shadow and active tumor probability",
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0)
+)
+
+# ============================================================
+# POOLS
+# ============================================================
+pool_wait_seconds = Histogram(
+    "pool_queue_wait_seconds",
+    "Time a job waits for a free worker",
+    labels=("pool",)
+)
+
+pool_run_seconds = Histogram(
+    "pool_job_duration_seconds",
+    "Time a worker spends on a job",
+    labels=("pool",)
+)
+
+pool_rejected = Counter(
+    "pool_rejected_total",
+    "Jobs refused because the pool's queue was full (answered with 503)",
+    labels=("pool",)
+)
+
+# ============================================================
+# CACHES AND PROCESS
+# ============================================================
+def _cache_requests():
+    values = {}
+    for name, cache in CACHES.items():
+        values[(name, "hit")] = cache.hits
+        values[(name, "miss")] = cache.misses
+    return values
+
+def _cache_hit_ratio():
+    return {(name,): cache.hits / (cache.hits + cache.misses)
+            for name, cache in CACHES.items() if cache.hits + cache.misses}
+
+Callback("cache_requests_total", "Lookups in the in-memory caches", _cache_requests,
+         labels=("cache", "result"), kind="counter")
+Callback("cache_hit_ratio", "Share of lookups answered from the cache since startup", _cache_hit_ratio,
+         labels=("cache",))
+Callback("cache_entries", "Entries held by each in-memory cache",
+         lambda: {(name,): len(cache) for name, cache in CACHES.items()}, labels=("cache",))
+
+def resident_memory_bytes():
+    """Current RSS: /proc on Linux, psutil (if installed) elsewhere"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+def process_uptime():
+    """Seconds since this process started: /proc on Linux, psutil (if installed) elsewhere"""
+    try:
+        with open("/proc/self/stat") as stat, open("/proc/uptime") as uptime:
+            # Field 22, counted after the parenthesised command name
+            started_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+            return float(uptime.read().split()[0]) - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return time.time() - psutil.Process().create_time()
+
+def _start_time():
+    uptime = process_uptime()
+    return time.time() - uptime if uptime is not None else None
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+Callback("process_resident_memory_bytes", "Resident memory of the API process", resident_memory_bytes)
+Callback("process_start_time_seconds", "Start time of the API process since the Unix epoch", _start_time)
+Callback("process_cpu_seconds_total", "User and system CPU time of the API process", _cpu_seconds,
+         kind="counter")
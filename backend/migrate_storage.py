@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Move stored scans and Grad-CAM overlays into the configured storage
+
+Run from backend/ with the server stopped:
+    python migrate_storage.py --dry-run
+    python migrate_storage.py
+    python migrate_storage.py --delete-source   # S3: remove local files once uploaded
+
+Walks uploads/ (the old flat layout and, when switching to
+USE_CLOUD_STORAGE, the sharded one) and hands every scan file to the
+configured storage: LocalStorage moves it to uploads/ab/cd/<key>,
+S3Storage uploads it. The image_path / gradcam_path columns of scans and
+prediction_cache are then rewritten from "uploads/<key>" to the bare key.
+Files already in place are skipped, so the tool can be re-run after an
+interruption.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import bindparam, select, update
+
+from database import engine
+from models import PredictionCache, Scan
+from storage import storage, storage_key, shard_path, LocalStorage, UPLOAD_KEY, UPLOAD_ROOT
+
+def legacy_files(root=UPLOAD_ROOT):
+    """(key, path) of every scan file below root that is not yet where storage wants it"""
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if not UPLOAD_KEY.match(name):
+                continue
+            path = os.path.join(directory, name)
+            if type(storage) is LocalStorage and os.path.relpath(path, root) == os.path.normpath(shard_path(name)):
+                continue
+            yield name, path
+
+def migrate_files(args):
+    files = list(legacy_files())
+    print(f"{len(files)} file(s) to move to {type(storage).__name__}")
+    if args.dry_run or not files:
+        return 0
+
+    start = time.perf_counter()
+    failed = 0
+
+    def move(item):
+        key, path = item
+        storage.import_file(key, path)
+        if args.delete_source and os.path.exists(path):
+            os.remove(path)
+
+    # Uploads are network-bound; local moves are cheap either way
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for i, (item, error) in enumerate(zip(files, pool.map(_capture(move), files)), 1):
+            if error:
+                failed += 1
+                print(f"❌ {item[1]}: {error}")
+            if i % 1000 == 0:
+                print(f"   {i}/{len(files)} files ({i / (time.perf_counter() - start):.0f}/s)")
+
+    print(f"✅ Moved {len(files) - failed} file(s) in {time.perf_counter() - start:.1f}s, {failed} failed")
+    return failed
+
+def _capture(fn):
+    def run(item):
+        try:
+            fn(item)
+        except Exception as e:
+            return str(e)
+        return None
+    return run
+
+def migrate_rows(args):
+    """Rewrites path columns to bare storage keys"""
+    for table, id_column in ((Scan.__table__, "id"), (PredictionCache.__table__, "image_hash")):
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c[id_column], table.c.image_path, table.c.gradcam_path).where(
+                    table.c.image_path.contains("/") | table.c.gradcam_path.contains("/")
+                )
+            ).all()
+            print(f"{len(rows)} {table.name} row(s) to rewrite")
+            if args.dry_run or not rows:
+                continue
+            conn.execute(
+                update(table).where(table.c[id_column] == bindparam("row_id")).values(
+                    image_path=bindparam("new_image_path"), gradcam_path=bindparam("new_gradcam_path")
+                ),
+                [{"row_id": row[0], "new_image_path": storage_key(row[1]), "new_gradcam_path": storage_key(row[2])}
+                 for row in rows]
+            )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='Only count files and rows')
+    parser.add_argument('--delete-source', action='store_true', help='Remove local files after uploading them')
+    parser.add_argument('--workers', type=int, default=8, help='Parallel uploads')
+    args = parser.parse_args()
+
+    failed = migrate_files(args)
+    if failed:
+        # Rows keep pointing at files that are still where they were
+        print("⚠️  Database left unchanged; fix the errors above and re-run")
+        return 1
+    migrate_rows(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,531 @@
+"""
+Model versions and the registry that chooses which one serves.
+
+A version is one model file loaded with its traced inference functions and
+named after the file and its content (best_model-1a2b3c4d), so the name on
+a Scan identifies the exact weights. New versions are loaded and warmed up
+on a loader thread while the current one keeps serving, then activated by
+swapping a single reference: a batch that has started finishes on the
+version it started with, and nothing in flight is dropped.
+
+Which file is active, and which one (if any) runs as a shadow on a sample
+of the traffic, is kept in MODEL_REGISTRY_FILE. /admin/models writes it and
+every API worker polls it along with the model files themselves, so an
+admin call or a replaced best_model.h5 reaches all workers within
+MODEL_WATCH_INTERVAL seconds.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import (
+    GRADCAM_MODE, INFERENCE_BACKEND, SAVE_COMPILED_MODEL, WARMUP_BATCH_SIZES,
+    MODEL_REGISTRY_FILE, MODEL_WATCH_INTERVAL, MODEL_VERSIONS_KEPT, SHADOW_SAMPLE_RATE
+)
+from inference_backends import load_backend
+from metrics import Callback, process_uptime, shadow_predictions, shadow_probability_delta
+
+tf = None  # Imported with the first model: importing TensorFlow alone takes seconds
+_fingerprint = None
+
+MODEL_PATH = "model/best_model.h5"
+MODEL_DIR = os.path.dirname(MODEL_PATH)
+MODEL_EXTENSIONS = ('.h5', '.keras')
+
+def _import_tensorflow():
+    global tf
+    if tf is None:
+        import tensorflow
+        tf = tensorflow
+
+def model_file(name):
+    """Path of a model file in MODEL_DIR; only bare .h5 / .keras file names are accepted"""
+    if not name or os.path.basename(name) != name or not name.endswith(MODEL_EXTENSIONS):
+        raise ValueError(f"Expected the name of a .h5 or .keras file in {MODEL_DIR}/, got {name!r}")
+    return os.path.join(MODEL_DIR, name)
+
+def split_model(model):
+    """
+    Splits the classifier into its convolutional base and the head on top.
+    Grad-CAM uses the base's final feature map (conv5_block3_out for the
+    ResNet50 model), so gradients only flow back through the small head.
+    """
+    layers = model.layers
+    for i in reversed(range(len(layers))):
+        if len(layers[i].output.shape) == 4:
+            break
+    else:
+        raise ValueError("No convolutional layer found for Grad-CAM!")
+
+    if isinstance(layers[i], tf.keras.Model) and i == 0:
+        base = layers[i]
+    else:
+        base = tf.keras.Model(inputs=model.inputs, outputs=layers[i].output)
+    return base, layers[i + 1:]
+
+# ============================================================
+# COMPILED MODELS
+# ============================================================
+def compiled_path(path):
+    """best_model.h5 -> best_model.savedmodel"""
+    return os.path.splitext(path)[0] + ".savedmodel"
+
+def model_source(path):
+    """Identifies a model file on disk; changes when the file is replaced"""
+    stat = os.stat(path)
+    return {"model": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def compiled_fingerprint():
+    """
+    TensorFlow version and the code the functions were traced from; a
+    compiled model saved by another version of either is traced again.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        _import_tensorflow()
+        with open(__file__, "rb") as f:
+            _fingerprint = f"tf{tf.__version__}-{hashlib.sha256(f.read()).hexdigest()[:12]}"
+    return _fingerprint
+
+def compiled_model_current(path):
+    """True if compiled_path(path) was saved from the file as it is now, by this code"""
+    source = dict(model_source(path), fingerprint=compiled_fingerprint())
+    try:
+        with open(os.path.join(compiled_path(path), "source.json")) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return "sha256" in saved and {key: saved.get(key) for key in source} == source
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# ============================================================
+# MODEL VERSION
+# ============================================================
+class ModelVersion:
+    """
+    One loaded model file: its traced inference functions and the feature
+    extractor backend. Nothing changes after loading, so it can be used
+    from any thread.
+    """
+
+    def __init__(self, path, backend="keras"):
+        started = time.perf_counter()
+        _import_tensorflow()
+        self.path = path
+        self.source = model_source(path)
+        self.feature_model = None  # Convolutional base: image -> last feature map (Keras only)
+        self.head_layers = []      # Classifier layers stacked on the feature map
+
+        if compiled_model_current(path):
+            # Already traced: no Keras deserialisation and no re-tracing
+            compiled = compiled_path(path)
+            with open(os.path.join(compiled, "source.json")) as f:
+                self.sha256 = json.load(f)["sha256"]
+            self.model = tf.saved_model.load(compiled)
+            self.forward_fn = self.model.forward
+            self.features_fn = self.model.features
+            self.gradcam_fn = self.model.gradcam
+            self.tumor_gradcam_fn = self.model.tumor_gradcam
+            self.head_fn = self.model.head
+            self.format = "savedmodel"
+        else:
+            self.sha256 = file_sha256(path)
+            self.model = tf.keras.models.load_model(path)
+            self.feature_model, self.head_layers = split_model(self.model)
+            image_spec = tf.TensorSpec([None, 224, 224, 3], tf.float32)
+            feature_spec = tf.TensorSpec([None] + list(self.feature_model.output.shape[1:]), tf.float32)
+            self.forward_fn = tf.function(self.forward_with_gradcam, input_signature=[image_spec])   # Prediction + Grad-CAM
+            self.features_fn = tf.function(self.forward_features, input_signature=[image_spec])     # Prediction + feature maps
+            self.gradcam_fn = tf.function(self.gradcam_from_features, input_signature=[feature_spec])
+            self.tumor_gradcam_fn = tf.function(self.tumor_gradcam_from_features, input_signature=[feature_spec])
+            self.head_fn = tf.function(self.classify_features, input_signature=[feature_spec])
+            self.format = "h5"
+
+        self.version = f"{os.path.splitext(self.source['model'])[0]}-{self.sha256[:8]}"
+        self.backend = backend
+        self.inference_backend = load_backend(backend)  # TFLite / ONNX feature extractor, None for Keras
+        self.load_seconds = time.perf_counter() - started
+        self.warmup_seconds = None
+
+    # Traced by tf.function for models loaded from .h5
+    def forward_with_gradcam(self, img_batch):
+        """
+        One forward pass returning the tumor probability and a normalised
+        Grad-CAM heatmap for every image in the batch.
+        """
+        return self.gradcam_from_features(self.feature_model(img_batch, training=False))
+
+    def forward_features(self, img_batch):
+        """Classification only; the feature maps are kept for a later Grad-CAM"""
+        features = self.feature_model(img_batch, training=False)
+        return self.classify_features(features), features
+
+    def classify_features(self, features):
+        """Tumor probability from the classifier head alone"""
+        preds = features
+        for layer in self.head_layers:
+            preds = layer(preds, training=False)
+        return preds[:, 0]
+
+    def gradcam_from_features(self, features):
+        """
+        Runs the head on the feature maps and returns (tumor probability, heatmap).
+        The heatmap explains the predicted class: tumor for positives,
+        no tumor otherwise.
+        """
+        return self._gradcam(features, explain_tumor=False)
+
+    def tumor_gradcam_from_features(self, features):
+        """As gradcam_from_features, but the heatmap always explains the tumor class"""
+        return self._gradcam(features, explain_tumor=True)
+
+    def _gradcam(self, features, explain_tumor):
+        with tf.GradientTape() as tape:
+            tape.watch(features)
+            preds = features
+            for layer in self.head_layers:
+                preds = layer(preds, training=False)
+            tumor_prob = preds[:, 0]
+            class_channel = tumor_prob if explain_tumor else tf.where(tumor_prob > 0.5, tumor_prob, 1 - tumor_prob)
+
+        # Images are independent, so each one only receives its own gradient
+        grads = tape.gradient(class_channel, features)
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+
+        heatmaps = tf.nn.relu(tf.reduce_mean(features * pooled_grads, axis=-1))
+        peak = tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True)
+        heatmaps = heatmaps / tf.where(peak > 0, peak, tf.ones_like(peak))
+        return tumor_prob, heatmaps
+
+    def infer_batch(self, img_batch):
+        """
+        Runs a stacked (N, 224, 224, 3) batch through the traced function.
+        Returns (tumor probability, heatmap) for every image in the batch, or
+        (tumor probability, feature map) in lazy Grad-CAM mode.
+        """
+        if self.inference_backend is None:
+            # Keras: the whole pipeline is one traced graph
+            fn = self.features_fn if GRADCAM_MODE == "lazy" else self.forward_fn
+            tumor_prob, maps = fn(tf.constant(img_batch, dtype=tf.float32))
+        else:
+            features = tf.constant(self.inference_backend.features(img_batch))
+            if GRADCAM_MODE == "lazy":
+                tumor_prob, maps = self.head_fn(features), features
+            else:
+                tumor_prob, maps = self.gradcam_fn(features)
+        return list(zip(tumor_prob.numpy().astype(float), maps.numpy()))
+
+    def classify(self, img_batch):
+        """Tumor probabilities only (shadow runs)"""
+        if self.inference_backend is None:
+            tumor_prob, _ = self.features_fn(tf.constant(img_batch, dtype=tf.float32))
+        else:
+            tumor_prob = self.head_fn(tf.constant(self.inference_backend.features(img_batch)))
+        return tumor_prob.numpy().astype(float)
+
+    # Lazy overlays are stamped with the prediction stored for the scan, which
+    # may differ from a re-run's, so their heatmap explains the tumor class
+    def infer_gradcam(self, features):
+        """Tumor heatmap for a single cached feature map"""
+        tumor_prob, heatmaps = self.tumor_gradcam_fn(tf.constant(features[np.newaxis], dtype=tf.float32))
+        return float(tumor_prob[0]), heatmaps[0].numpy()
+
+    def infer_image_gradcam(self, img_array):
+        """Full prediction + tumor heatmap for a single preprocessed image"""
+        img_batch = img_array[np.newaxis]
+        if self.inference_backend is None:
+            _, features = self.features_fn(tf.constant(img_batch, dtype=tf.float32))
+        else:
+            features = tf.constant(self.inference_backend.features(img_batch))
+        tumor_prob, heatmaps = self.tumor_gradcam_fn(features)
+        return float(tumor_prob[0]), heatmaps[0].numpy()
+
+    def warm_up(self):
+        """
+        Runs dummy batches of every WARMUP_BATCH_SIZES through the functions the
+        configured Grad-CAM mode and backend use, so that tracing and kernel
+        setup happen before the first scan instead of during it.
+        """
+        started = time.perf_counter()
+        dummy = np.zeros((max(WARMUP_BATCH_SIZES), 224, 224, 3), dtype=np.float32)
+        results = [self.infer_batch(dummy[:size]) for size in WARMUP_BATCH_SIZES]
+        if GRADCAM_MODE == "lazy":
+            # Overlays render from cached feature maps, or from the original after a restart
+            self.infer_gradcam(results[0][0][1])
+            self.infer_image_gradcam(dummy[0])
+        self.warmup_seconds = time.perf_counter() - started
+
+    def save_compiled(self):
+        """
+        Saves the traced functions as a SavedModel next to the model file,
+        which later loads of the same file use instead. Written under a
+        temporary name and renamed, so a concurrent load never sees half a
+        directory.
+        """
+        if self.format != "h5":
+            return
+        module = tf.Module()
+        module.forward, module.features = self.forward_fn, self.features_fn
+        module.gradcam, module.head = self.gradcam_fn, self.head_fn
+        module.tumor_gradcam = self.tumor_gradcam_fn
+        module.model_weights = list(self.model.weights)
+
+        target = compiled_path(self.path)
+        tmp_path = f"{target}.tmp{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tf.saved_model.save(module, tmp_path)
+        with open(os.path.join(tmp_path, "source.json"), "w") as f:
+            json.dump(dict(self.source, sha256=self.sha256, fingerprint=compiled_fingerprint()), f)
+        shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.replace(tmp_path, target)
+        except OSError:
+            # Another worker got there first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def parameter_count(self):
+        weights = self.model.weights if self.format == "h5" else self.model.model_weights
+        return int(sum(np.prod(w.shape) for w in weights))
+
+    def describe(self):
+        return {
+            "version": self.version,
+            "file": self.source["model"],
+            "sha256": self.sha256,
+            "format": self.format,
+            "backend": self.backend,
+            "load_seconds": round(self.load_seconds, 2),
+            "warmup_seconds": round(self.warmup_seconds, 2) if self.warmup_seconds is not None else None,
+        }
+
+# ============================================================
+# REGISTRY
+# ============================================================
+def read_registry_file():
+    """(active path, shadow path or None, shadow sample rate) as configured in MODEL_REGISTRY_FILE"""
+    try:
+        with open(MODEL_REGISTRY_FILE) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    active = model_file(data.get("active") or os.path.basename(MODEL_PATH))
+    shadow = model_file(data["shadow"]) if data.get("shadow") else None
+    return active, shadow, float(data.get("shadow_sample_rate", SHADOW_SAMPLE_RATE))
+
+def write_registry_file(active, shadow, shadow_sample_rate):
+    """Paths as returned by read_registry_file(); replaced atomically for the other workers"""
+    data = {
+        "active": os.path.basename(active),
+        "shadow": os.path.basename(shadow) if shadow else None,
+        "shadow_sample_rate": shadow_sample_rate,
+    }
+    tmp_path = f"{MODEL_REGISTRY_FILE}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, MODEL_REGISTRY_FILE)
+
+def _timings(version):
+    return (f"{version.format} loaded in {version.load_seconds:.1f}s, warm-up {version.warmup_seconds:.1f}s "
+            f"at batch sizes {', '.join(map(str, WARMUP_BATCH_SIZES))}")
+
+class ModelRegistry:
+    """
+    Loaded versions, the active one and the optional shadow.
+
+    sync() makes the loaded state match MODEL_REGISTRY_FILE and the model
+    files on disk; it runs once at start-up (in the background, see /ready),
+    then every MODEL_WATCH_INTERVAL seconds and after each admin change.
+    """
+
+    def __init__(self):
+        self.versions = OrderedDict()  # version -> ModelVersion, least recently used first
+        self.active = None
+        self.shadow = None
+        self.shadow_sample_rate = 0.0
+        self.shadow_disagreements = deque(maxlen=50)  # Most recent, for /admin/models
+        self.cold_start = {}
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self._lock = asyncio.Lock()
+        self._first_sync = None
+        self._watcher = None
+        self._seen = {}    # path -> source at the last check; a file is only loaded once it stops changing
+        self._failed = {}  # path -> source that failed to load; retried when the file changes
+
+    def start(self):
+        """Starts the first load in the background and the file watcher; returns the first load"""
+        if self._first_sync is None:
+            self._first_sync = asyncio.ensure_future(self.sync(settle=False))
+        if MODEL_WATCH_INTERVAL and self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+        return self._first_sync
+
+    async def stop(self):
+        for task in (self._watcher, self._first_sync):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._watcher = self._first_sync = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(MODEL_WATCH_INTERVAL)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"❌ Model check failed: {e}")
+
+    async def sync(self, settle=True):
+        """
+        Loads and activates what MODEL_REGISTRY_FILE and the files on disk
+        ask for. With settle, a changed file is only loaded once it looks the
+        same on two consecutive checks (still being copied otherwise).
+        """
+        async with self._lock:
+            active_path, shadow_path, shadow_sample_rate = read_registry_file()
+
+            if not self._current(self.active, active_path):
+                version = await self._load(active_path, settle)
+                if version is not None:
+                    self._activate(version)
+
+            if shadow_path is None:
+                self.shadow = None
+            elif not self._current(self.shadow, shadow_path):
+                self.shadow = await self._load(shadow_path, settle) or self.shadow
+            self.shadow_sample_rate = shadow_sample_rate
+
+            # Active and shadow are kept, then the most recently used others
+            for name in list(self.versions):
+                if len(self.versions) <= MODEL_VERSIONS_KEPT:
+                    break
+                if self.versions[name] not in (self.active, self.shadow):
+                    del self.versions[name]
+
+    def _current(self, version, path):
+        if version is None:
+            return False
+        try:
+            return version.path == path and version.source == model_source(path)
+        except OSError:
+            return True  # File gone: keep serving what is loaded
+
+    async def _load(self, path, settle):
+        try:
+            source = model_source(path)
+        except OSError as e:
+            if self._failed.get(path) != "missing":
+                print(f"❌ Model file not found: {e}")
+                self._failed[path] = "missing"
+            return None
+
+        for version in self.versions.values():
+            if version.path == path and version.source == source:
+                self.versions.move_to_end(version.version)
+                return version
+        if self._failed.get(path) == source:
+            return None
+        if settle and self._seen.get(path) != source:
+            self._seen[path] = source
+            return None
+        self._seen[path] = source
+
+        # Exported TFLite / ONNX extractors belong to the model they were
+        # exported from: only the first version loaded from MODEL_PATH uses one
+        backend = INFERENCE_BACKEND if self.active is None and path == MODEL_PATH else "keras"
+        if backend != INFERENCE_BACKEND:
+            print(f"⚠️  {path} runs on Keras; re-export the {INFERENCE_BACKEND} backend and restart to use it")
+
+        print(f"📦 Loading {path}")
+        loop = asyncio.get_running_loop()
+        try:
+            version = await loop.run_in_executor(self._loader, self._prepare, path, backend)
+        except Exception as e:
+            print(f"❌ Could not load {path}: {e}")
+            self._failed[path] = source
+            return None
+        self.versions[version.version] = version
+        if self.active is not None:
+            print(f"📦 Loaded {version.version} ({_timings(version)})")
+        return version
+
+    @staticmethod
+    def _prepare(path, backend):
+        """Load, warm up and (once per file) save the compiled model; runs on the loader thread"""
+        version = ModelVersion(path, backend)
+        version.warm_up()
+        if version.format == "h5" and SAVE_COMPILED_MODEL:
+            started = time.perf_counter()
+            try:
+                version.save_compiled()
+            except Exception as e:
+                # Only a start-up shortcut: the loaded model serves regardless
+                print(f"⚠️  Could not save the compiled model to {compiled_path(path)}: {e}")
+            else:
+                print(f"💾 Compiled model saved to {compiled_path(path)} in {time.perf_counter() - started:.1f}s; "
+                      "later loads of this file use it instead")
+        return version
+
+    def _activate(self, version):
+        # One reference swap: new batches use it, running ones finish on theirs
+        previous, self.active = self.active, version
+        self.versions.move_to_end(version.version)
+        if previous is None:
+            uptime = process_uptime()
+            self.cold_start = {"seconds": uptime, "format": version.format}
+            since_start = f"{uptime:.1f}s after process start" if uptime is not None else "now"
+            print(f"✅ Model {version.version} ready {since_start} ({_timings(version)})")
+        elif previous is not version:
+            print(f"🔄 Active model {previous.version} -> {version.version}")
+
+    def record_shadow(self, image_key, active_version, active_prob, shadow_version, shadow_prob):
+        """Compares a sampled scan's shadow prediction with the one that was returned"""
+        agree = (active_prob > 0.5) == (shadow_prob > 0.5)
+        shadow_predictions.inc("agree" if agree else "disagree")
+        shadow_probability_delta.observe(abs(shadow_prob - active_prob))
+        if not agree:
+            self.shadow_disagreements.append({
+                "image": image_key,
+                "active": active_version, "active_probability": round(active_prob, 4),
+                "shadow": shadow_version, "shadow_probability": round(shadow_prob, 4),
+            })
+            print(f"🔀 Shadow {shadow_version} disagrees on {image_key}: "
+                  f"p={shadow_prob:.3f} vs {active_prob:.3f} from {active_version}")
+
+    def describe(self):
+        return {
+            "active": self.active.describe() if self.active is not None else None,
+            "shadow": self.shadow.describe() if self.shadow is not None else None,
+            "shadow_sample_rate": self.shadow_sample_rate,
+            "loaded": [version.describe() for version in self.versions.values()],
+            "shadow_disagreements": list(self.shadow_disagreements),
+            "cold_start": self.cold_start,
+        }
+
+
+registry = ModelRegistry()
+
+def _model_info():
+    roles = {}
+    for role, version in (("active", registry.active), ("shadow", registry.shadow)):
+        if version is not None:
+            roles[(version.version, role)] = 1
+    return roles
+
+Callback("model_info", "Model versions serving (active) or sampled (shadow)", _model_info, labels=("version", "role"))
@@ -1,32 +1,88 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
-from datetime import datetime
-from database import Base
-
-class Doctor(Base):
-    __tablename__ = "doctors"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
-    full_name = Column(String)
-    hashed_password = Column(String)
-    license_number = Column(String, unique=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    
-    scans = relationship("Scan", back_populates="doctor")
-
-class Scan(Base):
-    __tablename__ = "scans"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    doctor_id = Column(Integer, ForeignKey("doctors.id"))
-    patient_name = Column(String)
-    patient_id = Column(String)
-    image_path = Column(String)
-    prediction = Column(String)  # "Tumor" or "No Tumor"
-    confidence = Column(Float)
-    gradcam_path = Column(String)
-    notes = Column(String, nullable=True)
-    scan_date = Column(DateTime, default=datetime.utcnow)
-    
-    doctor = relationship("Doctor", back_populates="scans")
\ No newline at end of file
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, LargeBinary, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from database import Base
+
+class Doctor(Base):
+    __tablename__ = "doctors"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, unique=True, index=True)
+    full_name = Column(String)
+    hashed_password = Column(String)
+    license_number = Column(String, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    scans = relationship("Scan", back_populates="doctor")
+
+class Scan(Base):
+    __tablename__ = "scans"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctors.id"))
+    patient_name = Column(String)
+    patient_id = Column(String)
+    image_path = Column(String)
+    prediction = Column(String)  # "Tumor Detected" or "No Tumor Detected"
+    confidence = Column(Float)
+    gradcam_path = Column(String, index=True)  # Lazy overlays look up the scan's prediction by it
+    notes = Column(String, nullable=True)
+    scan_date = Column(DateTime, default=datetime.utcnow)
+    image_hash = Column(String, nullable=True, index=True)  # sha256 of the 224x224 pixels
+    model_version = Column(String, nullable=True)  # e.g. best_model-1a2b3c4d; NULL for scans before versioning
+    
+    doctor = relationship("Doctor", back_populates="scans")
+    
+    __table_args__ = (
+        # Serves the per-doctor history, newest first (keyset pagination)
+        Index("ix_scans_doctor_date", "doctor_id", "scan_date", "id"),
+    )
+
+class PredictionCache(Base):
+    __tablename__ = "prediction_cache"
+    
+    image_hash = Column(String, primary_key=True)
+    prediction = Column(String)
+    confidence = Column(Float)
+    image_path = Column(String)
+    gradcam_path = Column(String)
+    model_version = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DoctorStats(Base):
+    __tablename__ = "doctor_stats"
+    
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), primary_key=True)
+    total_scans = Column(Integer, default=0, nullable=False)
+    tumor_detected = Column(Integer, default=0, nullable=False)
+
+class DailyScanStats(Base):
+    __tablename__ = "daily_scan_stats"
+    
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC, like scan_date
+    total_scans = Column(Integer, default=0, nullable=False)
+    tumor_detected = Column(Integer, default=0, nullable=False)
+
+class InferenceJob(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String, primary_key=True)  # uuid4
+    doctor_id = Column(Integer, ForeignKey("doctors.id"), index=True)
+    patient_name = Column(String)
+    patient_id = Column(String)
+    notes = Column(String, nullable=True)
+    upload = Column(LargeBinary, nullable=True)  # Cleared once the job finishes
+    priority = Column(Integer, default=0)  # Lower runs first: 0 interactive, 1 bulk
+    status = Column(String, default="queued")  # queued, running, done, failed
+    error = Column(String, nullable=True)
+    scan_id = Column(Integer, ForeignKey("scans.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    owner = Column(String, nullable=True)  # Process running it (JobQueue.owner)
+    lease_until = Column(DateTime, nullable=True)  # Renewed while it runs; queued again once it lapses
+    
+    __table_args__ = (
+        Index("ix_jobs_status_priority_created", "status", "priority", "created_at"),
+    )
\ No newline at end of file
@@ -1,155 +1,316 @@
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from datetime import datetime
-import os
-
-def generate_medical_report(scan_data, output_path):
-    """
-    Generate a professional medical PDF report
-    """
-    doc = SimpleDocTemplate(output_path, pagesize=A4)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#2563eb'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#1e293b'),
-        spaceAfter=12,
-        fontName='Helvetica-Bold'
-    )
-    
-    normal_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.HexColor('#334155'),
-        spaceAfter=8
-    )
-    
-    # Title
-    title = Paragraph("BRAIN TUMOR DETECTION REPORT", title_style)
-    story.append(title)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Patient Information Table
-    story.append(Paragraph("Patient Information", heading_style))
-    patient_data = [
-        ['Patient Name:', scan_data['patient_name']],
-        ['Patient ID:', scan_data['patient_id']],
-        ['Scan Date:', scan_data['scan_date']],
-        ['Doctor:', scan_data['doctor_name']],
-    ]
-    
-    patient_table = Table(patient_data, colWidths=[2*inch, 4*inch])
-    patient_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#1e293b')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
-    ]))
-    story.append(patient_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Diagnosis Results
-    story.append(Paragraph("Diagnosis Results", heading_style))
-    
-    # Result with color coding
-    result_color = colors.HexColor('#ef4444') if scan_data['prediction'] == 'Tumor' else colors.HexColor('#10b981')
-    result_data = [
-        ['Prediction:', scan_data['prediction']],
-        ['Confidence:', f"{scan_data['confidence']:.2f}%"],
-    ]
-    
-    result_table = Table(result_data, colWidths=[2*inch, 4*inch])
-    result_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1e293b')),
-        ('TEXTCOLOR', (1, 0), (1, 0), result_color),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
-    ]))
-    story.append(result_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # MRI Images
-    story.append(Paragraph("MRI Scan Analysis", heading_style))
-    
-    # Add images if they exist
-    if os.path.exists(scan_data['image_path']):
-        try:
-            img = Image(scan_data['image_path'], width=2.5*inch, height=2.5*inch)
-            story.append(Paragraph("Original MRI Scan:", normal_style))
-            story.append(img)
-            story.append(Spacer(1, 0.2*inch))
-        except:
-            pass
-    
-    if os.path.exists(scan_data['gradcam_path']):
-        try:
-            gradcam_img = Image(scan_data['gradcam_path'], width=2.5*inch, height=2.5*inch)
-            story.append(Paragraph("AI Focus Area (Grad-CAM):", normal_style))
-            story.append(gradcam_img)
-            story.append(Spacer(1, 0.2*inch))
-        except:
-            pass
-    
-    # Notes section
-    if scan_data.get('notes'):
-        story.append(Spacer(1, 0.2*inch))
-        story.append(Paragraph("Clinical Notes", heading_style))
-        story.append(Paragraph(scan_data['notes'], normal_style))
-    
-    # Disclaimer
-    story.append(Spacer(1, 0.5*inch))
-    disclaimer_style = ParagraphStyle(
-        'Disclaimer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.HexColor('#64748b'),
-        alignment=TA_LEFT
-    )
-    disclaimer_text = """
-    <b>Disclaimer:</b> This report is generated by an AI-assisted diagnostic tool and should be used 
-    as a supplementary aid only. Final diagnosis must be confirmed by qualified medical professionals 
-    through comprehensive clinical evaluation and additional diagnostic procedures.
-    """
-    story.append(Paragraph(disclaimer_text, disclaimer_style))
-    
-    # Footer
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#94a3b8'),
-        alignment=TA_CENTER
-    )
-    story.append(Spacer(1, 0.3*inch))
-    story.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", footer_style))
-    
-    # Build PDF
-    doc.build(story)
-    return output_path
\ No newline at end of file
+from reportlab.lib.pagesizes import letter, A4
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from PIL import Image as PILImage
+from datetime import datetime
+import io
+import os
+
+from cache import LRUCache
+from config import REPORT_IMAGE_DPI, TUMOR_LABEL
+
+# ============================================================
+# STYLES (built once per process, shared by every report)
+# ============================================================
+styles = getSampleStyleSheet()
+
+title_style = ParagraphStyle(
+    'CustomTitle',
+    parent=styles['Heading1'],
+    fontSize=24,
+    textColor=colors.HexColor('#2563eb'),
+    spaceAfter=30,
+    alignment=TA_CENTER,
+    fontName='Helvetica-Bold'
+)
+
+heading_style = ParagraphStyle(
+    'CustomHeading',
+    parent=styles['Heading2'],
+    fontSize=14,
+    textColor=colors.HexColor('#1e293b'),
+    spaceAfter=12,
+    fontName='Helvetica-Bold'
+)
+
+normal_style = ParagraphStyle(
+    'CustomNormal',
+    parent=styles['Normal'],
+    fontSize=11,
+    textColor=colors.HexColor('#334155'),
+    spaceAfter=8
+)
+
+disclaimer_style = ParagraphStyle(
+    'Disclaimer',
+    parent=styles['Normal'],
+    fontSize=8,
+    textColor=colors.HexColor('#64748b'),
+    alignment=TA_LEFT
+)
+
+footer_style = ParagraphStyle(
+    'Footer',
+    parent=styles['Normal'],
+    fontSize=9,
+    textColor=colors.HexColor('#94a3b8'),
+    alignment=TA_CENTER
+)
+
+patient_table_style = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#1e293b')),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
+])
+
+def _result_table_style(result_color):
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f1f5f9')),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#1e293b')),
+        ('TEXTCOLOR', (1, 0), (1, 0), result_color),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
+    ])
+
+tumor_result_style = _result_table_style(colors.HexColor('#ef4444'))
+clear_result_style = _result_table_style(colors.HexColor('#10b981'))
+
+scans_table_style = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f1f5f9')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.HexColor('#1e293b')),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0'))
+])
+
+DISCLAIMER_TEXT = """
+<b>Disclaimer:</b> This report is generated by an AI-assisted diagnostic tool and should be used
+as a supplementary aid only. Final diagnosis must be confirmed by qualified medical professionals
+through comprehensive clinical evaluation and additional diagnostic procedures.
+"""
+
+# ============================================================
+# IMAGES
+# ============================================================
+IMAGE_SIZE_INCHES = 2.5
+PRINT_PIXELS = int(IMAGE_SIZE_INCHES * REPORT_IMAGE_DPI)
+
+# (path, mtime) -> path of a JPEG that can be embedded as-is, or the bytes
+# of a copy downsampled to print resolution
+print_images = LRUCache(maxsize=64)
+
+def _print_image(path):
+    """Image source for the report; oversized scans are downsampled once"""
+    key = (path, os.stat(path).st_mtime_ns)
+    source = print_images.get(key)
+    if source is None:
+        with PILImage.open(path) as img:
+            if img.format == 'JPEG' and max(img.size) <= PRINT_PIXELS:
+                # Small JPEGs are copied into the PDF without re-encoding
+                source = path
+            else:
+                img = img.convert('RGB')
+                img.thumbnail((PRINT_PIXELS, PRINT_PIXELS))
+                buffer = io.BytesIO()
+                img.save(buffer, 'JPEG', quality=90)
+                source = buffer.getvalue()
+        print_images.put(key, source)
+    return source if isinstance(source, str) else io.BytesIO(source)
+
+# ============================================================
+# REPORT
+# ============================================================
+def render_medical_report(scan_data):
+    """
+    Render a professional medical PDF report and return its bytes
+    """
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    story = []
+
+    # Title
+    title = Paragraph("BRAIN TUMOR DETECTION REPORT", title_style)
+    story.append(title)
+    story.append(Spacer(1, 0.3*inch))
+
+    # Patient Information Table
+    story.append(Paragraph("Patient Information", heading_style))
+    patient_data = [
+        ['Patient Name:', scan_data['patient_name']],
+        ['Patient ID:', scan_data['patient_id']],
+        ['Scan Date:', scan_data['scan_date']],
+        ['Doctor:', scan_data['doctor_name']],
+    ]
+
+    patient_table = Table(patient_data, colWidths=[2*inch, 4*inch])
+    patient_table.setStyle(patient_table_style)
+    story.append(patient_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    # Diagnosis Results
+    story.append(Paragraph("Diagnosis Results", heading_style))
+
+    # Result with color coding
+    result_data = [
+        ['Prediction:', scan_data['prediction']],
+        ['Confidence:', f"{scan_data['confidence']:.2f}%"],
+    ]
+
+    result_table = Table(result_data, colWidths=[2*inch, 4*inch])
+    result_table.setStyle(tumor_result_style if scan_data['prediction'] == TUMOR_LABEL else clear_result_style)
+    story.append(result_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    # MRI Images
+    story.append(Paragraph("MRI Scan Analysis", heading_style))
+
+    # Add images if they exist
+    if os.path.exists(scan_data['image_path']):
+        try:
+            img = Image(_print_image(scan_data['image_path']), width=IMAGE_SIZE_INCHES*inch, height=IMAGE_SIZE_INCHES*inch)
+            story.append(Paragraph("Original MRI Scan:", normal_style))
+            story.append(img)
+            story.append(Spacer(1, 0.2*inch))
+        except:
+            pass
+
+    if os.path.exists(scan_data['gradcam_path']):
+        try:
+            gradcam_img = Image(_print_image(scan_data['gradcam_path']), width=IMAGE_SIZE_INCHES*inch, height=IMAGE_SIZE_INCHES*inch)
+            story.append(Paragraph("AI Focus Area (Grad-CAM):", normal_style))
+            story.append(gradcam_img)
+            story.append(Spacer(1, 0.2*inch))
+        except:
+            pass
+
+    # Notes section
+    if scan_data.get('notes'):
+        story.append(Spacer(1, 0.2*inch))
+        story.append(Paragraph("Clinical Notes", heading_style))
+        story.append(Paragraph(scan_data['notes'], normal_style))
+
+    # Disclaimer
+    story.append(Spacer(1, 0.5*inch))
+    story.append(Paragraph(DISCLAIMER_TEXT, disclaimer_style))
+
+    # Footer
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", footer_style))
+
+    # Build PDF
+    doc.build(story)
+    return output.getvalue()
+
+def generate_medical_report(scan_data, output_path):
+    """
+    Generate a professional medical PDF report at output_path
+    """
+    pdf = render_medical_report(scan_data)
+    with open(output_path, 'wb') as f:
+        f.write(pdf)
+
+def render_patient_summary(summary):
+    """
+    Render the cover of a consolidated patient report (patient details and
+    one row per scan) and return its bytes. The scans' own reports follow
+    it, see pdf_stream.py.
+    """
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    story = []
+    scans = summary['scans']
+    tumor_count = sum(1 for scan in scans if scan['prediction'] == TUMOR_LABEL)
+
+    story.append(Paragraph("PATIENT SCAN SUMMARY", title_style))
+    story.append(Spacer(1, 0.3*inch))
+
+    story.append(Paragraph("Patient Information", heading_style))
+    patient_data = [
+        ['Patient Name:', summary['patient_name']],
+        ['Patient ID:', summary['patient_id']],
+        ['Doctor:', summary['doctor_name']],
+        ['Scans:', f"{len(scans)} ({tumor_count} with tumor detected)"],
+        ['Period:', f"{scans[0]['scan_date']} to {scans[-1]['scan_date']}"],
+    ]
+    patient_table = Table(patient_data, colWidths=[2*inch, 4*inch])
+    patient_table.setStyle(patient_table_style)
+    story.append(patient_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    story.append(Paragraph("Scans", heading_style))
+    rows = [['#', 'Scan Date', 'Prediction', 'Confidence']] + [
+        [str(index), scan['scan_date'], scan['prediction'], f"{scan['confidence']:.2f}%"]
+        for index, scan in enumerate(scans, start=1)
+    ]
+    scans_table = Table(rows, colWidths=[0.5*inch, 1.8*inch, 2.2*inch, 1.5*inch], repeatRows=1)
+    scans_table.setStyle(scans_table_style)
+    story.append(scans_table)
+
+    story.append(Spacer(1, 0.3*inch))
+    story.append(Paragraph(f"Generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", footer_style))
+
+    doc.build(story)
+    return output.getvalue()
+
+# ============================================================
+# BENCHMARK
+# ============================================================
+def benchmark(image_path=None, count=40, workers=(1, 2, 4)):
+    """Reports per second rendered in-process and through process pools"""
+    import tempfile
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    tmp_dir = tempfile.mkdtemp()
+    if image_path is None:
+        # A full-size upload, as stored before scans were saved at 224x224
+        image_path = os.path.join(tmp_dir, 'scan.jpg')
+        PILImage.effect_noise((1024, 1024), 64).convert('RGB').save(image_path, quality=95)
+
+    scan_data = {
+        'patient_name': 'Benchmark Patient',
+        'patient_id': 'BENCH-001',
+        'scan_date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'doctor_name': 'Benchmark',
+        'prediction': 'Tumor Detected',
+        'confidence': 97.5,
+        'image_path': image_path,
+        'gradcam_path': image_path,
+        'notes': 'Benchmark run.'
+    }
+
+    render_medical_report(scan_data)  # warm-up
+    start = time.perf_counter()
+    for _ in range(count):
+        pdf = render_medical_report(scan_data)
+    elapsed = time.perf_counter() - start
+    print(f"in-process:        {count / elapsed:6.1f} reports/s ({len(pdf) / 1024:.0f} KB each)")
+
+    for n in workers:
+        with ProcessPoolExecutor(n, mp_context=multiprocessing.get_context('spawn')) as pool:
+            list(pool.map(render_medical_report, [scan_data] * n))  # start and warm workers
+            start = time.perf_counter()
+            list(pool.map(render_medical_report, [scan_data] * count))
+            elapsed = time.perf_counter() - start
+        print(f"process pool ({n}): {count / elapsed:6.1f} reports/s")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark PDF report rendering')
+    parser.add_argument('--image', help='Scan to embed (default: synthetic 1024x1024 JPEG)')
+    parser.add_argument('--count', type=int, default=40)
+    args = parser.parse_args()
+    benchmark(args.image, args.count)
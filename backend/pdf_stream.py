@@ -0,0 +1,123 @@
+"""
+Incremental PDF concatenation.
+
+PDFStreamWriter appends whole documents (here: ReportLab reports) to one
+output PDF and hands back the bytes to send as soon as each document is
+added. Objects are renumbered and written immediately; only byte offsets
+and page references are kept, so memory does not grow with the size of
+the output. The page tree, catalog and cross-reference table follow in
+close().
+"""
+
+import copy
+import io
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+# Page attributes a page may inherit from its parent in the source tree
+INHERITABLE = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class PDFStreamWriter:
+    def __init__(self):
+        self._offsets = {}  # object number -> byte offset
+        self._next_number = 1
+        self._position = 0
+        self._page_refs = []
+        self._catalog = self._reserve()
+        self._page_tree = self._reserve()
+
+    def _reserve(self):
+        number = self._next_number
+        self._next_number += 1
+        return number
+
+    def _emit(self, data: bytes, out: list):
+        out.append(data)
+        self._position += len(data)
+
+    def _write_object(self, number, obj, out):
+        buffer = io.BytesIO()
+        buffer.write(f"{number} 0 obj\n".encode())
+        obj.write_to_stream(buffer)
+        buffer.write(b"\nendobj\n")
+        self._offsets[number] = self._position
+        self._emit(buffer.getvalue(), out)
+
+    def start(self) -> bytes:
+        out = []
+        self._emit(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n", out)
+        return b"".join(out)
+
+    def add(self, pdf: bytes) -> bytes:
+        """Appends every page of pdf; returns the bytes to send"""
+        reader = PdfReader(io.BytesIO(pdf))
+        mapping = {}  # source object number -> output object number
+        pending = []
+
+        def remap(obj):
+            if isinstance(obj, IndirectObject):
+                if obj.idnum not in mapping:
+                    mapping[obj.idnum] = self._reserve()
+                    pending.append((mapping[obj.idnum], obj.get_object()))
+                return IndirectObject(mapping[obj.idnum], 0, None)
+            if isinstance(obj, DictionaryObject):
+                clone = copy.copy(obj)
+                for key, value in obj.items():
+                    clone[NameObject(key)] = remap(value)
+                return clone
+            if isinstance(obj, ArrayObject):
+                return ArrayObject(remap(value) for value in obj)
+            return obj
+
+        out = []
+        for page in reader.pages:
+            number = self._reserve()
+            mapping[page.indirect_reference.idnum] = number
+            self._page_refs.append(number)
+
+            page_dict = DictionaryObject(
+                (key, value) for key, value in page.items() if key != "/Parent"
+            )
+            # Pull down attributes inherited from the source page tree
+            parent = page.get("/Parent")
+            while parent is not None:
+                parent = parent.get_object()
+                for key in INHERITABLE:
+                    if key not in page_dict and key in parent:
+                        page_dict[NameObject(key)] = parent[key]
+                parent = parent.get("/Parent")
+
+            page_dict = remap(page_dict)
+            page_dict[NameObject("/Parent")] = IndirectObject(self._page_tree, 0, None)
+            self._write_object(number, page_dict, out)
+
+            while pending:
+                number, obj = pending.pop()
+                self._write_object(number, remap(obj), out)
+
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        """Page tree, catalog, cross-reference table and trailer"""
+        out = []
+        kids = " ".join(f"{number} 0 R" for number in self._page_refs)
+        for number, body in (
+            (self._page_tree, f"<< /Type /Pages /Kids [ {kids} ] /Count {len(self._page_refs)} >>"),
+            (self._catalog, f"<< /Type /Catalog /Pages {self._page_tree} 0 R >>"),
+        ):
+            self._offsets[number] = self._position
+            self._emit(f"{number} 0 obj\n{body}\nendobj\n".encode(), out)
+
+        xref_position = self._position
+        size = self._next_number
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for number in range(1, size):
+            if number in self._offsets:
+                lines.append(f"{self._offsets[number]:010d} 00000 n \n")
+            else:
+                lines.append("0000000000 65535 f \n")
+        lines.append(f"trailer\n<< /Size {size} /Root {self._catalog} 0 R >>\nstartxref\n{xref_position}\n%%EOF\n")
+        self._emit("".join(lines).encode(), out)
+        return b"".join(out)
@@ -1,222 +1,385 @@
-# import tensorflow as tf
-# import numpy as np
-# import cv2
-# from tensorflow.keras.applications.resnet50 import preprocess_input
-# from PIL import Image
-# import io
-# import os
-
-# MODEL_PATH = "model/best_model.h5"
-# model = None
-
-# def load_model():
-#     global model
-#     if model is None:
-#         model = tf.keras.models.load_model(MODEL_PATH)
-#     return model
-
-# def make_gradcam_heatmap(img_array, model, last_conv_layer_name):
-#     # Use the model input as-is to match the expected structure
-#     grad_model = tf.keras.models.Model(
-#         inputs=model.inputs,  # <-- use model.inputs (supports nested inputs)
-#         outputs=[model.get_layer(last_conv_layer_name).output, model.output]
-#     )
-
-#     with tf.GradientTape() as tape:
-#         conv_outputs, predictions = grad_model(img_array, training=False)
-        
-#         # If predictions is a list, take the first output
-#         if isinstance(predictions, list):
-#             predictions = predictions[0]
-
-#         pred_index = tf.argmax(predictions[0])
-#         class_channel = predictions[:, pred_index]
-
-#     grads = tape.gradient(class_channel, conv_outputs)
-#     pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-
-#     conv_outputs = conv_outputs[0]
-#     heatmap = tf.reduce_mean(tf.multiply(pooled_grads, conv_outputs), axis=-1)
-#     heatmap = np.maximum(heatmap, 0)
-
-#     # Convert to NumPy safely
-#     if isinstance(heatmap, tf.Tensor):
-#         heatmap = heatmap.numpy()
-    
-#     heatmap /= np.max(heatmap) if np.max(heatmap) != 0 else 1.0
-#     return heatmap
-
-# def find_last_conv_layer(model):
-#     # Try to find base model if it exists
-#     base_model = None
-#     for layer in model.layers:
-#         if isinstance(layer, tf.keras.Model):
-#             base_model = layer
-#             break
-#     if base_model is None:
-#         base_model = model
-    
-#     for layer in reversed(base_model.layers):
-#         if isinstance(layer, tf.keras.layers.Conv2D):
-#             return layer.name, base_model
-    
-#     raise ValueError("No convolutional layer found for Grad-CAM!")
-
-# async def predict_brain_tumor(image_bytes: bytes, save_path: str, gradcam_path: str):
-#     loaded_model = load_model()
-
-#     # Save uploaded image
-#     img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-#     img = img.resize((224, 224))
-#     img.save(save_path)
-
-#     # Preprocess for prediction
-#     img_array = np.array(img)
-#     img_array = np.expand_dims(img_array, axis=0)
-#     img_array = preprocess_input(img_array.astype(np.float32))
-
-#     # Prediction
-#     preds = loaded_model.predict(img_array, verbose=0)
-#     conf = float(preds[0][0])
-#     label = "Tumor" if conf > 0.5 else "No Tumor"
-#     conf_pct = conf * 100 if conf > 0.5 else (1 - conf) * 100
-
-#     # Grad-CAM
-#     try:
-#         last_conv_layer_name, base_model = find_last_conv_layer(loaded_model)
-#         heatmap = make_gradcam_heatmap(img_array, base_model, last_conv_layer_name)
-
-#         img_orig = cv2.imread(save_path)
-#         img_orig = cv2.resize(img_orig, (224, 224))
-
-#         heatmap_resized = cv2.resize(heatmap, (img_orig.shape[1], img_orig.shape[0]))
-#         heatmap_resized = np.uint8(255 * heatmap_resized)
-#         heatmap_colored = cv2.applyColorMap(heatmap_resized, cv2.COLORMAP_JET)
-#         superimposed = cv2.addWeighted(img_orig, 0.6, heatmap_colored, 0.4, 0)
-
-#         cv2.imwrite(gradcam_path, superimposed)
-#     except Exception as e:
-#         print(f"Grad-CAM generation failed: {str(e)}")
-#         import shutil
-#         shutil.copy(save_path, gradcam_path)
-
-#     return label, conf_pct
-
-
-import tensorflow as tf
-import numpy as np
-import cv2
-from tensorflow.keras.applications.resnet50 import preprocess_input
-from PIL import Image
-import io
-import os
-import shutil
-
-MODEL_PATH = "model/best_model.h5"
-model = None
-
-def load_model():
-    global model
-    if model is None:
-        model = tf.keras.models.load_model(MODEL_PATH)
-    return model
-
-def make_gradcam_heatmap(img_array, model, last_conv_layer_name, tumor=True):
-    """
-    Generates Grad-CAM heatmap.
-    tumor=True  -> Tumor detected
-    tumor=False -> No Tumor
-    """
-    grad_model = tf.keras.models.Model(
-        inputs=model.inputs,
-        outputs=[model.get_layer(last_conv_layer_name).output, model.output]
-    )
-
-    with tf.GradientTape() as tape:
-        conv_outputs, predictions = grad_model(img_array, training=False)
-        if isinstance(predictions, list):
-            predictions = predictions[0]
-
-        # Binary classification
-        if tumor:
-            class_channel = predictions[:, 0]      # Tumor
-        else:
-            class_channel = 1 - predictions[:, 0]  # No Tumor
-
-    grads = tape.gradient(class_channel, conv_outputs)
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
-
-    conv_outputs = conv_outputs[0]
-    heatmap = tf.reduce_mean(tf.multiply(pooled_grads, conv_outputs), axis=-1)
-    heatmap = np.maximum(heatmap, 0)
-
-    if isinstance(heatmap, tf.Tensor):
-        heatmap = heatmap.numpy()
-
-    heatmap /= np.max(heatmap) if np.max(heatmap) != 0 else 1.0
-    return heatmap
-
-def find_last_conv_layer(model):
-    base_model = None
-    for layer in model.layers:
-        if isinstance(layer, tf.keras.Model):
-            base_model = layer
-            break
-    if base_model is None:
-        base_model = model
-    
-    for layer in reversed(base_model.layers):
-        if isinstance(layer, tf.keras.layers.Conv2D):
-            return layer.name, base_model
-    
-    raise ValueError("No convolutional layer found for Grad-CAM!")
-
-async def predict_brain_tumor(image_bytes: bytes, save_path: str, gradcam_path: str):
-    loaded_model = load_model()
-
-    # Save uploaded image
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    img = img.resize((224, 224))
-    img.save(save_path)
-
-    # Preprocess for prediction
-    img_array = np.array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array.astype(np.float32))
-
-    # Prediction
-    preds = loaded_model.predict(img_array, verbose=0)
-    conf = float(preds[0][0])
-    tumor_flag = conf > 0.5
-    label = "Tumor Detected" if tumor_flag else "No Tumor Detected"
-    conf_pct = conf * 100 if tumor_flag else (1 - conf) * 100
-
-    # Grad-CAM
-    try:
-        last_conv_layer_name, base_model = find_last_conv_layer(loaded_model)
-        heatmap = make_gradcam_heatmap(img_array, base_model, last_conv_layer_name, tumor=tumor_flag)
-
-        img_orig = cv2.imread(save_path)
-        img_orig = cv2.resize(img_orig, (224, 224))
-
-        if tumor_flag:
-            # Normal Grad-CAM overlay
-            heatmap_resized = cv2.resize(heatmap, (img_orig.shape[1], img_orig.shape[0]))
-            heatmap_resized = np.uint8(255 * heatmap_resized)
-            heatmap_colored = cv2.applyColorMap(heatmap_resized, cv2.COLORMAP_JET)
-            superimposed = cv2.addWeighted(img_orig, 0.6, heatmap_colored, 0.4, 0)
-        else:
-            # Minimal overlay for No Tumor
-            superimposed = img_orig.copy()
-
-        # Add label text
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        cv2.putText(superimposed, label, (10, 25), font, 0.8, (0, 255, 0) if not tumor_flag else (0,0,255), 2)
-
-        cv2.imwrite(gradcam_path, superimposed)
-
-    except Exception as e:
-        print(f"Grad-CAM generation failed: {str(e)}")
-        shutil.copy(save_path, gradcam_path)
-
-    return label, conf_pct
+# import tensorflow as tf
+# import numpy as np
+# import cv2
+# from tensorflow.keras.applications.resnet50 import preprocess_input
+# from PIL import Image
+# import io
+# import os
+
+# MODEL_PATH = "model/best_model.h5"
+# model = None
+
+# def load_model():
+#     global model
+#     if model is None:
+#         model = tf.keras.models.load_model(MODEL_PATH)
+#     return model
+
+# def make_gradcam_heatmap(img_array, model, last_conv_layer_name):
+#     # Use the model input as-is to match the expected structure
+#     grad_model = tf.keras.models.Model(
+#         inputs=model.inputs,  # <-- use model.inputs (supports nested inputs)
+#         outputs=[model.get_layer(last_conv_layer_name).output, model.output]
+#     )
+
+#     with tf.GradientTape() as tape:
+#         conv_outputs, predictions = grad_model(img_array, training=False)
+        
+#         # If predictions is a list, take the first output
+#         if isinstance(predictions, list):
+#             predictions = predictions[0]
+
+#         pred_index = tf.argmax(predictions[0])
+#         class_channel = predictions[:, pred_index]
+
+#     grads = tape.gradient(class_channel, conv_outputs)
+#     pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
+
+#     conv_outputs = conv_outputs[0]
+#     heatmap = tf.reduce_mean(tf.multiply(pooled_grads, conv_outputs), axis=-1)
+#     heatmap = np.maximum(heatmap, 0)
+
+#     # Convert to NumPy safely
+#     if isinstance(heatmap, tf.Tensor):
+#         heatmap = heatmap.numpy()
+    
+#     heatmap /= np.max(heatmap) if np.max(heatmap) != 0 else 1.0
+#     return heatmap
+
+# def find_last_conv_layer(model):
+#     # Try to find base model if it exists
+#     base_model = None
+#     for layer in model.layers:
+#         if isinstance(layer, tf.keras.Model):
+#             base_model = layer
+#             break
+#     if base_model is None:
+#         base_model = model
+    
+#     for layer in reversed(base_model.layers):
+#         if isinstance(layer, tf.keras.layers.Conv2D):
+#             return layer.name, base_model
+    
+#     raise ValueError("No convolutional layer found for Grad-CAM!")
+
+# async def predict_brain_tumor(image_bytes: bytes, save_path: str, gradcam_path: str):
+#     loaded_model = load_model()
+
+#     # Save uploaded image
+#     img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+#     img = img.resize((224, 224))
+#     img.save(save_path)
+
+#     # Preprocess for prediction
+#     img_array = np.array(img)
+#     img_array = np.expand_dims(img_array, axis=0)
+#     img_array = preprocess_input(img_array.astype(np.float32))
+
+#     # Prediction
+#     preds = loaded_model.predict(img_array, verbose=0)
+#     conf = float(preds[0][0])
+#     label = "Tumor" if conf > 0.5 else "No Tumor"
+#     conf_pct = conf * 100 if conf > 0.5 else (1 - conf) * 100
+
+#     # Grad-CAM
+#     try:
+#         last_conv_layer_name, base_model = find_last_conv_layer(loaded_model)
+#         heatmap = make_gradcam_heatmap(img_array, base_model, last_conv_layer_name)
+
+#         img_orig = cv2.imread(save_path)
+#         img_orig = cv2.resize(img_orig, (224, 224))
+
+#         heatmap_resized = cv2.resize(heatmap, (img_orig.shape[1], img_orig.shape[0]))
+#         heatmap_resized = np.uint8(255 * heatmap_resized)
+#         heatmap_colored = cv2.applyColorMap(heatmap_resized, cv2.COLORMAP_JET)
+#         superimposed = cv2.addWeighted(img_orig, 0.6, heatmap_colored, 0.4, 0)
+
+#         cv2.imwrite(gradcam_path, superimposed)
+#     except Exception as e:
+#         print(f"Grad-CAM generation failed: {str(e)}")
+#         import shutil
+#         shutil.copy(save_path, gradcam_path)
+
+#     return label, conf_pct
+
+
+import asyncio
+import random
+
+from batching import BatchScheduler
+from cache import LRUCache
+from config import MODEL_BATCH_SIZE, MODEL_BATCH_TIMEOUT_MS, GRADCAM_MODE, GRADCAM_CACHE_SIZE, TUMOR_LABEL
+from executors import cpu_pool, shadow_pool, PoolBusyError
+from imaging import load_image, save_image, load_saved_image, render_gradcam, make_thumbnail
+from inference_client import inference_client
+from metrics import Callback, stage_seconds, shadow_predictions
+from model_registry import registry
+from storage import storage, storage_key, thumbnail_key
+
+# Lazy mode: Grad-CAM storage key -> (model version, feature map) of scans whose overlay isn't rendered yet
+feature_cache = LRUCache(maxsize=GRADCAM_CACHE_SIZE, name="gradcam_features")
+_pending_renders = {}
+_shadow_runs = set()  # Keeps fire-and-forget shadow tasks referenced until they finish
+
+def infer_batch(img_batch):
+    """
+    Runs a stacked batch through the active model version, which is read
+    once so the whole batch uses the same one. Every result is
+    (tumor probability, heatmap or feature map, version name).
+    """
+    version = registry.active
+    return [(conf, maps, version.version) for conf, maps in version.infer_batch(img_batch)]
+
+def label_for(conf):
+    tumor_flag = conf > 0.5
+    label = TUMOR_LABEL if tumor_flag else "No Tumor Detected"
+    return tumor_flag, label
+
+# Concurrent /predict calls share forward passes through this scheduler
+batch_scheduler = BatchScheduler(
+    infer_batch,
+    max_batch_size=MODEL_BATCH_SIZE,
+    max_wait_ms=MODEL_BATCH_TIMEOUT_MS
+)
+
+Callback("inference_queue_depth", "Scans waiting for a forward pass", batch_scheduler.queue_depth)
+
+# ============================================================
+# MODEL: IN THIS PROCESS OR ON THE INFERENCE SERVER
+# ============================================================
+# With INFERENCE_SERVER set, the functions below ask the shared inference
+# server (inference_client) instead of loading the model here
+
+def use_local_model():
+    """Called by the inference server itself: it owns the model even if INFERENCE_SERVER is set"""
+    global inference_client
+    inference_client = None
+
+def start_model():
+    """Starts loading the model in the background, or following the inference server's status"""
+    if inference_client is not None:
+        inference_client.start()
+    else:
+        batch_scheduler.start()
+        registry.start()
+
+async def stop_model():
+    if inference_client is not None:
+        await inference_client.stop()
+    else:
+        await batch_scheduler.stop()
+        await registry.stop()
+
+async def ensure_model():
+    """Waits until a model version is loaded and warmed up (see model_registry)"""
+    if inference_client is not None:
+        if inference_client.status is None or inference_client.status["active"] is None:
+            await inference_client.wait_ready()
+    elif registry.active is None:
+        await asyncio.shield(registry.start())
+        if registry.active is None:
+            raise RuntimeError("No model could be loaded")
+
+def active_version():
+    """Name of the model version serving now, None until one is loaded"""
+    if inference_client is not None:
+        status = inference_client.status
+        return status["active"]["version"] if status is not None and status["active"] is not None else None
+    return registry.active.version if registry.active is not None else None
+
+Callback("model_ready", "1 once a model is loaded and warmed up", lambda: int(active_version() is not None))
+
+async def model_status():
+    """Loaded model versions, as ModelRegistry.describe()"""
+    if inference_client is not None:
+        return await inference_client.refresh()
+    return registry.describe()
+
+async def sync_models():
+    """Applies MODEL_REGISTRY_FILE now instead of at the next check; returns model_status()"""
+    if inference_client is not None:
+        return await inference_client.sync()
+    await registry.sync(settle=False)
+    return registry.describe()
+
+async def infer(img_array, image_key: str):
+    """
+    Classifies one scan, batched with the other scans in flight, and samples
+    it for the shadow model. Returns (tumor probability, heatmap or feature
+    map, model version).
+    """
+    if inference_client is not None:
+        return await inference_client.infer(img_array, image_key)
+    await ensure_model()
+    conf, maps, version = await batch_scheduler.submit(img_array)
+
+    shadow = registry.shadow
+    if shadow is not None and shadow.version != version and random.random() < registry.shadow_sample_rate:
+        run = asyncio.ensure_future(_shadow_predict(shadow, img_array, image_key, version, conf))
+        _shadow_runs.add(run)
+        run.add_done_callback(_shadow_runs.discard)
+    return conf, maps, version
+
+async def gradcam(img_array, cached):
+    """
+    (tumor probability, Grad-CAM heatmap of the tumor class, model version).
+    The cached (version, feature map) of a lazy scan skips the ResNet50 base
+    while that version is loaded; otherwise the image is run on the active
+    version.
+    """
+    if inference_client is not None:
+        return await inference_client.gradcam(img_array, cached)
+    await ensure_model()
+    version = registry.versions.get(cached[0]) if cached is not None else None
+    if version is not None:
+        conf, heatmap = await batch_scheduler.run_in_model_thread(version.infer_gradcam, cached[1])
+    else:
+        version = registry.active
+        conf, heatmap = await batch_scheduler.run_in_model_thread(version.infer_image_gradcam, img_array)
+    return conf, heatmap, version.version
+
+# ============================================================
+# PIPELINE
+# ============================================================
+
+async def decode_upload(image_bytes: bytes):
+    """Decode and preprocess an upload -> (rgb image, model input, content hash)"""
+    with stage_seconds.time("decode"):
+        return await cpu_pool.run(load_image, image_bytes)
+
+async def predict_brain_tumor(image_bytes: bytes, image_key: str, gradcam_key: str):
+    """
+    Runs the pipeline without blocking the event loop: decoding and
+    Grad-CAM rendering go to the CPU pool, model work to the model thread.
+    """
+    img_rgb, img_array, _ = await decode_upload(image_bytes)
+    return await predict_decoded(img_rgb, img_array, image_key, gradcam_key)
+
+async def predict_decoded(img_rgb, img_array, image_key: str, gradcam_key: str):
+    """
+    Stores the decoded scan and its thumbnail, classifies it and renders (or
+    defers) Grad-CAM. Returns (label, confidence %, model version).
+    """
+    await ensure_model()
+    save_path = storage.local_path(image_key)
+    thumb_key = thumbnail_key(image_key)
+    with stage_seconds.time("save"):
+        await cpu_pool.run(save_image, img_rgb, save_path, storage.local_path(thumb_key))
+    with stage_seconds.time("store"):
+        await asyncio.gather(storage.put(image_key), storage.put(thumb_key))
+
+    # Prediction and Grad-CAM in one pass (batched with other in-flight requests)
+    with stage_seconds.time("inference"):
+        conf, maps, version = await infer(img_array, image_key)
+    tumor_flag, label = label_for(conf)
+    conf_pct = conf * 100 if tumor_flag else (1 - conf) * 100
+
+    if GRADCAM_MODE == "lazy":
+        # Rendered by ensure_gradcam() when the overlay is first requested
+        feature_cache.put(storage_key(gradcam_key), (version, maps))
+    else:
+        gradcam_path = storage.local_path(gradcam_key)
+        with stage_seconds.time("gradcam_render"):
+            await cpu_pool.run(render_gradcam, img_rgb, maps, tumor_flag, label, save_path, gradcam_path)
+        with stage_seconds.time("store"):
+            await storage.put(gradcam_key)
+
+    return label, conf_pct, version
+
+async def _shadow_predict(shadow, img_array, image_key, version, conf):
+    """
+    Classifies a sampled scan with the shadow model on its own pool, after
+    the response no longer waits on it, and records any disagreement.
+    """
+    try:
+        shadow_conf = (await shadow_pool.run(shadow.classify, img_array[None]))[0]
+    except PoolBusyError:
+        shadow_predictions.inc("dropped")
+        return
+    except Exception as e:
+        shadow_predictions.inc("failed")
+        print(f"❌ Shadow prediction failed: {e}")
+        return
+    registry.record_shadow(image_key, version, conf, shadow.version, float(shadow_conf))
+
+async def ensure_gradcam(image_key: str, gradcam_key: str, stored_prediction=None):
+    """
+    Renders a lazily deferred Grad-CAM overlay once; concurrent requests for
+    the same scan wait on the same render. stored_prediction is an async
+    callable returning the (label, model version) recorded for the scan,
+    looked up only when the overlay needs rendering. Returns False when the
+    original scan is gone, so there is nothing to render from.
+    """
+    gradcam_key = storage_key(gradcam_key)
+    if await storage.exists(gradcam_key):
+        return True
+    render = _pending_renders.get(gradcam_key)
+    if render is None:
+        stored = await stored_prediction() if stored_prediction is not None else None
+        label, scan_version = stored if stored is not None else (None, None)
+        # Another request may have started the render during the lookup
+        render = _pending_renders.get(gradcam_key)
+        if render is None:
+            render = asyncio.ensure_future(_render_gradcam(image_key, gradcam_key, label, scan_version))
+            _pending_renders[gradcam_key] = render
+            render.add_done_callback(lambda _: _pending_renders.pop(gradcam_key, None))
+    return await asyncio.shield(render)
+
+async def _render_gradcam(image_key, gradcam_key, label, scan_version=None):
+    """
+    The overlay is stamped with the scan's stored label, not a re-run's:
+    a re-run on another model version can disagree with the report. A
+    heatmap from a version other than the scan's names that version too.
+    """
+    image_path = await storage.fetch(image_key)
+    if image_path is None:
+        return False
+
+    img_rgb, img_array = await cpu_pool.run(load_saved_image, image_path)
+    tumor_flag, heatmap, note = label == TUMOR_LABEL, None, None
+
+    # No Tumor overlays show no heatmap, so only these (and overlays no scan
+    # records a label for) need the model. Scans that fell out of the feature
+    # cache, predate a restart or whose model version was unloaded since are
+    # re-run from the saved original
+    if tumor_flag or label is None:
+        await ensure_model()
+        with stage_seconds.time("gradcam"):
+            conf, heatmap, version = await gradcam(img_array, feature_cache.get(gradcam_key))
+        if label is None:
+            tumor_flag, label = label_for(conf)
+        if scan_version is not None and version != scan_version:
+            note = f"Heatmap: {version}"
+            print(f"⚠️  {scan_version} is no longer loaded; the Grad-CAM overlay {gradcam_key} was drawn by {version}")
+
+    with stage_seconds.time("gradcam_render"):
+        await cpu_pool.run(render_gradcam, img_rgb, heatmap, tumor_flag, label, image_path, storage.local_path(gradcam_key), note)
+    with stage_seconds.time("store"):
+        await storage.put(gradcam_key)
+
+    # The stored JPEG is the memo from here on
+    feature_cache.pop(gradcam_key)
+    return True
+
+async def ensure_thumbnail(image_key: str):
+    """
+    Thumbnails of scans stored before they were generated at ingestion are
+    made on first view. Returns False when the original scan is gone.
+    """
+    thumb_key = thumbnail_key(image_key)
+    if await storage.exists(thumb_key):
+        return True
+    render = _pending_renders.get(thumb_key)
+    if render is None:
+        render = asyncio.ensure_future(_render_thumbnail(image_key, thumb_key))
+        _pending_renders[thumb_key] = render
+        render.add_done_callback(lambda _: _pending_renders.pop(thumb_key, None))
+    return await asyncio.shield(render)
+
+async def _render_thumbnail(image_key, thumb_key):
+    image_path = await storage.fetch(image_key)
+    if image_path is None:
+        return False
+    await cpu_pool.run(make_thumbnail, image_path, storage.local_path(thumb_key))
+    await storage.put(thumb_key)
+    return True
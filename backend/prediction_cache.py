@@ -0,0 +1,196 @@
+"""
+Content-addressed prediction cache.
+
+Scans are keyed by the sha256 of their decoded 224x224 pixels. A hit reuses
+the stored label, confidence and image files, so re-uploads of the same
+slice skip inference and store no new files. Hot entries live in an
+in-memory LRU; every entry is also persisted in the prediction_cache table.
+Files are shared by all scans with the same hash and are only removed when
+the last of those scans is deleted. Entries belong to the model version that
+made them: once another version is active they count as misses and are
+replaced, while earlier scans keep their files.
+"""
+
+import asyncio
+import uuid
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import LRUCache
+from config import PREDICTION_CACHE_SIZE, ENABLE_PREDICTION_CACHE
+from metrics import prediction_cache_requests
+from models import PredictionCache, Scan
+from prediction import active_version, decode_upload, predict_decoded, feature_cache
+from storage import storage, storage_key, thumbnail_key
+
+memory_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE, name="prediction")
+_in_flight = {}
+
+def _as_entry(row):
+    return {
+        "prediction": row.prediction,
+        "confidence": row.confidence,
+        "image_path": row.image_path,
+        "gradcam_path": row.gradcam_path,
+        "model_version": row.model_version,
+    }
+
+async def lookup(db: AsyncSession, image_hash: str):
+    entry = memory_cache.get(image_hash)
+    if entry is None:
+        row = await db.get(PredictionCache, image_hash)
+        if row is None:
+            return None
+        entry = _as_entry(row)
+
+    # Made by another model than the one serving now
+    version = active_version()
+    if version is None or entry["model_version"] != version:
+        return None
+
+    # Files removed behind our back make the entry useless
+    if not await storage.exists(entry["image_path"]):
+        await forget(db, image_hash)
+        return None
+
+    memory_cache.put(image_hash, entry)
+    return entry
+
+async def claim(db: AsyncSession, image_hash: str, entry: dict):
+    """
+    Locks the entry's row in the session's transaction before a scan reuses
+    its files: a release() in another transaction or worker then waits until
+    that scan is committed, and sees it. False when the entry was released
+    first, so its files may be gone.
+    """
+    result = await db.execute(update(PredictionCache).where(
+        PredictionCache.image_hash == image_hash,
+        PredictionCache.image_path == entry["image_path"]
+    ).values(image_path=PredictionCache.image_path).execution_options(synchronize_session=False))
+    return result.rowcount > 0
+
+async def store(db: AsyncSession, image_hash: str, entry: dict):
+    """
+    Adds the entry to the session; it commits together with the Scan row,
+    and lookup() keeps it in memory once it has been committed.
+    """
+    await db.merge(PredictionCache(image_hash=image_hash, **entry))
+
+async def discard(entries):
+    """Removes the files of new entries that were never stored (see analyse_upload)"""
+    for entry in entries:
+        feature_cache.pop(storage_key(entry["gradcam_path"]))
+        try:
+            await storage.delete(entry["image_path"])
+            await storage.delete(thumbnail_key(entry["image_path"]))
+            await storage.delete(entry["gradcam_path"])
+        except Exception as e:
+            print(f"Error deleting files: {e}")
+
+def _discard_result(task):
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(discard([task.result()]))
+
+async def forget(db: AsyncSession, image_hash: str):
+    memory_cache.pop(image_hash)
+    await db.execute(delete(PredictionCache).where(PredictionCache.image_hash == image_hash))
+
+async def get_or_predict(db: AsyncSession, image_hash: str, predict, defer_store=False):
+    """
+    Returns (entry, hit). On a miss predict() is awaited to produce the entry.
+    Identical uploads arriving while it runs wait for the same result, unless
+    defer_store leaves storing it to the caller.
+    """
+    entry = await lookup(db, image_hash)
+    # Deferred callers claim their hits in the transaction that stores their scans
+    if entry is not None and (defer_store or await claim(db, image_hash, entry)):
+        prediction_cache_requests.inc("hit")
+        return entry, True
+    if entry is not None:
+        memory_cache.pop(image_hash)  # Released by a concurrent delete
+
+    if image_hash in _in_flight:
+        prediction_cache_requests.inc("hit")
+        return await asyncio.shield(_in_flight[image_hash]), True
+
+    prediction_cache_requests.inc("miss")
+    task = asyncio.ensure_future(predict())
+    if not defer_store:
+        _in_flight[image_hash] = task
+        task.add_done_callback(lambda _: _in_flight.pop(image_hash, None))
+    try:
+        entry = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if defer_store:
+            # The prediction still finishes, but nothing will store it
+            task.add_done_callback(_discard_result)
+        raise
+
+    if not defer_store:
+        await store(db, image_hash, entry)
+    return entry, False
+
+async def analyse_upload(db: AsyncSession, image_bytes: bytes, defer_store=False):
+    """
+    Full /predict pipeline for one upload, answered from the cache when the
+    same pixels were analysed before.
+    Returns (entry, image_hash, new) where entry holds prediction, confidence,
+    image_path, gradcam_path and model_version, and new is True when it was
+    predicted now. With defer_store a new entry is neither stored nor shared:
+    the caller adds it with store() in the transaction of its scans, or
+    removes its files with discard() when that transaction fails.
+    """
+    img_rgb, img_array, image_hash = await decode_upload(image_bytes)
+
+    async def predict():
+        # Generate unique storage keys
+        unique_id = str(uuid.uuid4())
+        image_key = f"{unique_id}_original.jpg"
+        gradcam_key = f"{unique_id}_gradcam.jpg"
+
+        prediction, confidence, model_version = await predict_decoded(img_rgb, img_array, image_key, gradcam_key)
+        return {
+            "prediction": prediction,
+            "confidence": confidence,
+            "image_path": image_key,
+            "gradcam_path": gradcam_key,
+            "model_version": model_version,
+        }
+
+    if not ENABLE_PREDICTION_CACHE:
+        return await predict(), image_hash, True
+
+    entry, hit = await get_or_predict(db, image_hash, predict, defer_store)
+    return entry, image_hash, not hit
+
+async def release(db: AsyncSession, scan: Scan):
+    """
+    Called before a scan is deleted. Returns True when no other scan shares
+    its files, i.e. the caller should remove them once the delete is
+    committed; a cache entry pointing at them goes too.
+    """
+    if not scan.image_hash:
+        return True
+
+    # Locking the entry first waits for transactions that claimed it, so
+    # their scans are seen below; claims made later wait for this delete
+    await claim(db, scan.image_hash, _as_entry(scan))
+
+    # Scans of the same slice by different model versions have their own files
+    shared = await db.scalar(select(Scan.id).where(
+        Scan.image_hash == scan.image_hash,
+        Scan.image_path == scan.image_path,
+        Scan.id != scan.id
+    ).limit(1))
+    if shared is not None:
+        return False
+
+    entry = memory_cache.pop(scan.image_hash)
+    if entry is not None and entry["image_path"] != scan.image_path:
+        memory_cache.put(scan.image_hash, entry)  # Another version's files
+    await db.execute(delete(PredictionCache).where(
+        PredictionCache.image_hash == scan.image_hash,
+        PredictionCache.image_path == scan.image_path
+    ))
+    return True
@@ -0,0 +1,180 @@
+"""
+On-disk cache of generated PDF reports, one file per scan.
+
+A report is named after a version hash of everything printed in it
+(patient, doctor, prediction, notes, image files), so repeat downloads
+reuse the file and any change to those inputs produces a new one. The
+version doubles as the HTTP ETag. Older versions of a scan's report are
+removed once a newer one is written, and all of them once an update or
+delete of the scan is committed.
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import re
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from config import REPORT_PRERENDER
+from database import AsyncSessionLocal
+from executors import report_pool, PoolBusyError
+from models import Scan
+from storage import storage
+
+REPORT_DIR = "reports"
+_REPORT_NAME = re.compile(r"^report_(\d+)_([0-9a-f]{16})\.pdf$")
+_SWEEP_MIN_AGE = 300  # Seconds; younger files may be mid-write or belong to a scan added since
+_EVICT_KEY = "report_cache.evict"  # Session.info entry: scan ids changed in the open transaction
+_pending = {}
+
+def report_data(scan: Scan, doctor_name: str):
+    """Everything generate_medical_report prints for a scan"""
+    return {
+        'patient_name': scan.patient_name,
+        'patient_id': scan.patient_id,
+        'scan_date': scan.scan_date.strftime('%Y-%m-%d %H:%M'),
+        'doctor_name': doctor_name,
+        'prediction': scan.prediction,
+        'confidence': scan.confidence,
+        'image_path': scan.image_path,
+        'gradcam_path': scan.gradcam_path,
+        'notes': scan.notes or 'No additional notes provided.'
+    }
+
+async def version(data: dict):
+    # A lazily rendered Grad-CAM overlay changes the document once it exists
+    key = dict(data, gradcam_ready=await storage.exists(data['gradcam_path']))
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+async def etag(data: dict):
+    return f'"{await version(data)}"'
+
+def report_path(scan_id: int, report_version: str):
+    return os.path.join(REPORT_DIR, f"report_{scan_id}_{report_version}.pdf")
+
+async def _render(data, path):
+    from pdf_generator import render_medical_report  # ReportLab loads on the first report, not at start-up
+
+    # The renderer reads local files; storage keys become local copies
+    local_data = dict(
+        data,
+        image_path=await storage.fetch(data['image_path']) or '',
+        gradcam_path=await storage.fetch(data['gradcam_path']) or ''
+    )
+    pdf = await report_pool.run(render_medical_report, local_data)
+    # Written under a temporary name so readers never see a partial file;
+    # per process, as other workers may be rendering the same report
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf)
+    os.replace(tmp_path, path)
+
+async def get_report(scan_id: int, data: dict):
+    """Returns the path of the current report, rendering it on the report pool if needed"""
+    path = report_path(scan_id, await version(data))
+    if os.path.exists(path):
+        return path
+
+    render = _pending.get(path)
+    if render is None:
+        render = asyncio.ensure_future(_render(data, path))
+        _pending[path] = render
+        render.add_done_callback(lambda _: _pending.pop(path, None))
+    await asyncio.shield(render)
+
+    evict(scan_id, keep=path)
+    return path
+
+async def read_report(scan_id: int, data: dict, retries: int = 20):
+    """
+    Bytes of the current report for bulk exports; waits for room in the
+    report pool instead of failing when it is busy.
+    """
+    for attempt in range(retries):
+        try:
+            path = await get_report(scan_id, data)
+            break
+        except PoolBusyError:
+            if attempt == retries - 1:
+                raise
+            await asyncio.sleep(0.5)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def prerender(scan_id: int, data: dict):
+    """
+    Renders the report in the background right after /predict so the first
+    download is served from disk. Skipped while the Grad-CAM overlay is
+    still deferred (lazy mode) or the report pool is busy.
+    """
+    if not REPORT_PRERENDER:
+        return
+
+    async def run():
+        try:
+            if await storage.exists(data['gradcam_path']):
+                await get_report(scan_id, data)
+        except PoolBusyError:
+            pass
+        except Exception as e:
+            print(f"Report pre-render failed for scan {scan_id}: {e}")
+
+    asyncio.ensure_future(run())
+
+def evict(scan_id: int, keep: str = None):
+    """Removes cached reports of a scan, except keep"""
+    for path in glob.glob(os.path.join(REPORT_DIR, f"report_{scan_id}_*.pdf")):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+async def sweep():
+    """
+    Startup cleanup: reports of deleted scans, pre-cache uuid-named copies
+    and temporary files left by crashed renders. Other workers share
+    REPORT_DIR, so recently written files are left alone.
+    """
+    async with AsyncSessionLocal() as db:
+        existing = set(await db.scalars(select(Scan.id)))
+    cutoff = time.time() - _SWEEP_MIN_AGE
+    removed = 0
+    for name in os.listdir(REPORT_DIR):
+        match = _REPORT_NAME.match(name)
+        if match and int(match.group(1)) in existing:
+            continue
+        path = os.path.join(REPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        print(f"🧹 Removed {removed} stale report file(s)")
+
+@event.listens_for(Scan, "after_update")
+@event.listens_for(Scan, "after_delete")
+def _collect_changed(mapper, connection, target):
+    # Runs mid-flush: the change may still roll back, so only note the scan
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_EVICT_KEY, set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _evict_on_commit(session):
+    for scan_id in session.info.pop(_EVICT_KEY, ()):
+        evict(scan_id)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_on_rollback(session, previous_transaction):
+    # A savepoint rollback leaves the outer transaction's changes pending
+    if previous_transaction.parent is None:
+        session.info.pop(_EVICT_KEY, None)
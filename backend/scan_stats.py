@@ -0,0 +1,149 @@
+"""
+Maintained per-doctor scan counters.
+
+Every insert and delete of a Scan adjusts two rollups in the same
+transaction: doctor_stats (running totals, one row per doctor) and
+daily_scan_stats (one row per doctor and UTC day). /stats reads a single
+row, date ranges and trends sum the daily rows; none of them touch scans.
+"""
+
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import TREND_MAX_DAYS, TREND_MAX_WEEKS, TUMOR_LABEL
+from database import AsyncSessionLocal
+from models import DoctorStats, DailyScanStats, Scan
+
+TREND_MAX_PERIODS = {"day": TREND_MAX_DAYS, "week": TREND_MAX_WEEKS}
+
+def _insert(db: AsyncSession):
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+async def _add(db: AsyncSession, model, keys: dict, total: int, tumor: int):
+    """Atomic upsert: creates the counter row or adds to it"""
+    stmt = _insert(db)(model).values(**keys, total_scans=total, tumor_detected=tumor)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            "total_scans": model.total_scans + total,
+            "tumor_detected": model.tumor_detected + tumor,
+        }
+    )
+    await db.execute(stmt)
+
+async def record(db: AsyncSession, scans, sign: int = 1):
+    """
+    Counts flushed scans in (sign=1) or out (sign=-1) of the rollups.
+    Call it in the transaction that inserts or deletes them.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    daily = defaultdict(lambda: [0, 0])
+    for scan in scans:
+        tumor = 1 if scan.prediction == TUMOR_LABEL else 0
+        for counter in (totals[scan.doctor_id], daily[(scan.doctor_id, scan.scan_date.date())]):
+            counter[0] += sign
+            counter[1] += sign * tumor
+
+    for doctor_id, (total, tumor) in totals.items():
+        await _add(db, DoctorStats, {"doctor_id": doctor_id}, total, tumor)
+    for (doctor_id, day), (total, tumor) in daily.items():
+        await _add(db, DailyScanStats, {"doctor_id": doctor_id, "day": day}, total, tumor)
+
+async def rebuild(db: AsyncSession):
+    """Recomputes both rollups from the scans table"""
+    await db.execute(delete(DailyScanStats))
+    await db.execute(delete(DoctorStats))
+
+    tumor = func.sum(case((Scan.prediction == TUMOR_LABEL, 1), else_=0))
+    day = func.date(Scan.scan_date)
+    rows = (await db.execute(
+        select(Scan.doctor_id, day, func.count(Scan.id), tumor).group_by(Scan.doctor_id, day)
+    )).all()
+
+    totals = defaultdict(lambda: [0, 0])
+    for doctor_id, scan_day, total, tumors in rows:
+        if isinstance(scan_day, str):
+            scan_day = date.fromisoformat(scan_day)
+        db.add(DailyScanStats(doctor_id=doctor_id, day=scan_day, total_scans=total, tumor_detected=tumors))
+        totals[doctor_id][0] += total
+        totals[doctor_id][1] += tumors
+    for doctor_id, (total, tumors) in totals.items():
+        db.add(DoctorStats(doctor_id=doctor_id, total_scans=total, tumor_detected=tumors))
+
+async def backfill():
+    """Builds the rollups once for databases created before they existed"""
+    async with AsyncSessionLocal() as db:
+        has_rollups = await db.scalar(select(DoctorStats.doctor_id).limit(1)) is not None
+        has_scans = await db.scalar(select(Scan.id).limit(1)) is not None
+        if not has_rollups and has_scans:
+            await rebuild(db)
+            await db.commit()
+            print("📊 Built scan statistics rollups from existing scans")
+
+async def totals(db: AsyncSession, doctor_id: int):
+    """(total_scans, tumor_detected) over all time"""
+    row = await db.get(DoctorStats, doctor_id)
+    return (row.total_scans, row.tumor_detected) if row else (0, 0)
+
+async def range_totals(db: AsyncSession, doctor_id: int, start: date = None, end: date = None):
+    """(total_scans, tumor_detected) between two UTC days, both inclusive"""
+    query = select(
+        func.coalesce(func.sum(DailyScanStats.total_scans), 0),
+        func.coalesce(func.sum(DailyScanStats.tumor_detected), 0)
+    ).where(DailyScanStats.doctor_id == doctor_id)
+    if start:
+        query = query.where(DailyScanStats.day >= start)
+    if end:
+        query = query.where(DailyScanStats.day <= end)
+    total, tumor = (await db.execute(query)).one()
+    return int(total), int(tumor)
+
+def trend_periods(start: date, end: date, period: str = "day"):
+    """Number of points trend() returns for the range"""
+    if period == "week":
+        start, end = start - timedelta(days=start.weekday()), end - timedelta(days=end.weekday())
+        return (end - start).days // 7 + 1
+    return (end - start).days + 1
+
+async def trend(db: AsyncSession, doctor_id: int, start: date, end: date, period: str = "day"):
+    """
+    Scans and positive rate per day, or per week (starting Monday), from
+    start to end inclusive. Periods without scans are reported as zero, so
+    ranges longer than TREND_MAX_PERIODS raise ValueError.
+    """
+    def bucket(day):
+        return day - timedelta(days=day.weekday()) if period == "week" else day
+
+    if trend_periods(start, end, period) > TREND_MAX_PERIODS[period]:
+        raise ValueError(f"A trend covers at most {TREND_MAX_PERIODS[period]} {period}s")
+
+    counts = defaultdict(lambda: [0, 0])
+    rows = await db.scalars(select(DailyScanStats).where(
+        DailyScanStats.doctor_id == doctor_id,
+        DailyScanStats.day >= start,
+        DailyScanStats.day <= end
+    ))
+    for row in rows:
+        counts[bucket(row.day)][0] += row.total_scans
+        counts[bucket(row.day)][1] += row.tumor_detected
+
+    step = timedelta(days=7 if period == "week" else 1)
+    points = []
+    current = bucket(start)
+    while current <= end:
+        total, tumor = counts.get(current, (0, 0))
+        points.append({
+            "period_start": current.isoformat(),
+            "total_scans": total,
+            "tumor_detected": tumor,
+            "positive_rate": round(tumor / total * 100, 2) if total else None
+        })
+        current += step
+    return points
@@ -0,0 +1,255 @@
+"""
+Blob storage for uploaded scans and Grad-CAM overlays.
+
+Files are addressed by key ("<uuid>_original.jpg", "<uuid>_thumb.webp",
+"<uuid>_gradcam.jpg"); older rows hold "uploads/<key>" paths, which
+storage_key() reduces to the key. LocalStorage shards them into uploads/ab/cd/<key> by a hash of the
+key, so no directory grows past a few hundred entries. With
+USE_CLOUD_STORAGE they live in an S3 bucket (AWS or any S3-compatible
+server) instead.
+
+The image stages (save, Grad-CAM, PDF) work on local files: writers create
+the file at local_path(key) and then put() it, readers fetch() a local
+copy. For LocalStorage both are the stored file itself; S3Storage uploads
+and downloads in chunks and keeps a bounded set of local copies.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+
+from cache import LRUCache
+from config import (
+    USE_CLOUD_STORAGE, CLOUD_PROVIDER, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET_NAME,
+    AWS_REGION, AWS_ENDPOINT_URL, S3_KEY_PREFIX, S3_PRESIGNED_URLS, S3_PRESIGNED_URL_TTL,
+    STORAGE_CACHE_DIR, STORAGE_CACHE_FILES
+)
+from executors import storage_pool
+
+UPLOAD_ROOT = "uploads"
+UPLOAD_KEY = re.compile(r"^[0-9a-f-]{36}_(original\.jpg|gradcam\.jpg|thumb\.webp)$")
+CHUNK_SIZE = 1024 * 1024
+MEDIA_TYPES = {".jpg": "image/jpeg", ".webp": "image/webp"}
+
+# A key never names different content (every scan gets a new uuid), so
+# clients may keep what they downloaded for good
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+def storage_key(value):
+    """Key of a stored file from a key or a legacy uploads/<key> path"""
+    return os.path.basename(value) if value else value
+
+def shard_path(key):
+    """ab/cd/<key>, from the md5 of the key"""
+    digest = hashlib.md5(key.encode()).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{key}"
+
+def file_url(value):
+    """API URL of a stored file (served by the /uploads/{key} route)"""
+    return f"/{UPLOAD_ROOT}/{storage_key(value)}"
+
+def thumbnail_key(image_key):
+    return storage_key(image_key).replace("_original.jpg", "_thumb.webp")
+
+def media_type(key):
+    return MEDIA_TYPES[os.path.splitext(key)[1]]
+
+def etag(key):
+    """Strong ETag; taken from the key alone since its content never changes"""
+    return f'"{hashlib.md5(storage_key(key).encode()).hexdigest()}"'
+
+def cache_headers(key):
+    return {"ETag": etag(key), "Cache-Control": IMMUTABLE}
+
+
+class LocalStorage:
+    def __init__(self, root=UPLOAD_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, shard_path(storage_key(key)))
+
+    def local_path(self, key):
+        """Where a writer creates the file for key; parent directories are made"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _find(self, key):
+        key = storage_key(key)
+        # Files written before sharding stay readable until migrated
+        for path in (self._path(key), os.path.join(self.root, key)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    async def put(self, key):
+        """The file written at local_path(key) already is the stored copy"""
+
+    async def fetch(self, key):
+        """Path of a local copy, or None if nothing is stored under key"""
+        return self._find(key)
+
+    async def exists(self, key):
+        return self._find(key) is not None
+
+    async def delete(self, key):
+        path = self._find(key)
+        while path is not None:
+            os.remove(path)
+            path = self._find(key)
+
+    async def response(self, key):
+        path = self._find(key)
+        return FileResponse(path, media_type=media_type(key), headers=cache_headers(key)) if path else None
+
+    def import_file(self, key, source_path):
+        """Migration: moves a file into the sharded layout"""
+        os.replace(source_path, self.local_path(key))
+
+
+class S3Storage(LocalStorage):
+    """
+    Objects under prefix + ab/cd/<key> in an S3 bucket. Transfers are
+    chunked (multipart for large files) and run on the storage pool.
+    Local copies in STORAGE_CACHE_DIR are evicted least recently used
+    first and can be deleted at any time.
+    """
+
+    def __init__(self, bucket, prefix="", root=STORAGE_CACHE_DIR, cache_files=STORAGE_CACHE_FILES,
+                 presigned_urls=S3_PRESIGNED_URLS, client=None):
+        super().__init__(root)
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("USE_CLOUD_STORAGE requires: pip install boto3")
+            client = boto3.client(
+                "s3",
+                region_name=AWS_REGION,
+                endpoint_url=AWS_ENDPOINT_URL or None,
+                aws_access_key_id=AWS_ACCESS_KEY_ID or None,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY or None
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.presigned_urls = presigned_urls
+        self._copies = LRUCache(maxsize=cache_files, on_evict=self._remove_copy)
+        # Handing out the same presigned URL for a while lets browsers cache the object
+        self._urls = LRUCache(maxsize=cache_files, ttl=S3_PRESIGNED_URL_TTL // 2)
+
+    def object_key(self, key):
+        return self.prefix + shard_path(storage_key(key))
+
+    def _remove_copy(self, key, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _upload_args(self, key):
+        return {"ContentType": media_type(key), "CacheControl": IMMUTABLE}
+
+    def _is_missing(self, error):
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    async def put(self, key):
+        key = storage_key(key)
+        path = self.local_path(key)
+        await storage_pool.run(
+            self.client.upload_file, path, self.bucket, self.object_key(key), ExtraArgs=self._upload_args(key)
+        )
+        self._copies.put(key, path)
+
+    async def fetch(self, key):
+        from botocore.exceptions import ClientError
+
+        key = storage_key(key)
+        path = self.local_path(key)
+        if not os.path.exists(path):
+            # Downloaded under a private name so concurrent fetches never see a partial file
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                await storage_pool.run(self.client.download_file, self.bucket, self.object_key(key), tmp_path)
+            except ClientError as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if self._is_missing(e):
+                    return None
+                raise
+            os.replace(tmp_path, path)
+        self._copies.put(key, path)
+        return path
+
+    async def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        key = storage_key(key)
+        if os.path.exists(self._path(key)):
+            return True
+        try:
+            await storage_pool.run(self.client.head_object, Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return False
+            raise
+        return True
+
+    async def delete(self, key):
+        key = storage_key(key)
+        await storage_pool.run(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+        self._copies.pop(key)
+        self._urls.pop(key)
+        await super().delete(key)
+
+    async def response(self, key):
+        from botocore.exceptions import ClientError
+
+        params = {"Bucket": self.bucket, "Key": self.object_key(key)}
+        if self.presigned_urls:
+            url = self._urls.get(key)
+            if url is None:
+                url = await storage_pool.run(
+                    self.client.generate_presigned_url, "get_object", Params=params, ExpiresIn=S3_PRESIGNED_URL_TTL
+                )
+                self._urls.put(key, url)
+            # The redirect may be reused only while the URL is still valid
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": f"private, max-age={S3_PRESIGNED_URL_TTL // 2}"})
+
+        # Proxied: streamed from the bucket a chunk at a time
+        try:
+            obj = await storage_pool.run(self.client.get_object, **params)
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        body = obj["Body"]
+
+        async def chunks():
+            try:
+                while chunk := await storage_pool.run(body.read, CHUNK_SIZE):
+                    yield chunk
+            finally:
+                body.close()
+
+        headers = dict(cache_headers(key), **{"Content-Length": str(obj["ContentLength"])})
+        return StreamingResponse(chunks(), media_type=media_type(key), headers=headers)
+
+    def import_file(self, key, source_path):
+        """Migration: uploads a local file; the source is left in place"""
+        self.client.upload_file(source_path, self.bucket, self.object_key(key), ExtraArgs=self._upload_args(key))
+
+
+def create_storage():
+    if not USE_CLOUD_STORAGE:
+        return LocalStorage()
+    if CLOUD_PROVIDER != "aws":
+        raise RuntimeError(f'CLOUD_PROVIDER "{CLOUD_PROVIDER}" is not supported; use "aws" (S3-compatible)')
+    return S3Storage(AWS_BUCKET_NAME, S3_KEY_PREFIX)
+
+storage = create_storage()
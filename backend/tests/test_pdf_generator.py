@@ -0,0 +1,48 @@
+import pytest
+
+import pdf_generator
+from config import TUMOR_LABEL
+
+
+@pytest.fixture
+def used_styles(monkeypatch):
+    """Record every style applied to a report table."""
+    applied = []
+
+    class RecordingTable(pdf_generator.Table):
+        def setStyle(self, tblstyle):
+            applied.append(tblstyle)
+            super().setStyle(tblstyle)
+
+    monkeypatch.setattr(pdf_generator, "Table", RecordingTable)
+    return applied
+
+
+def scan(prediction, tmp_path):
+    return {
+        'patient_name': 'Jane Doe',
+        'patient_id': 'P-001',
+        'scan_date': '2026-01-01 10:00:00',
+        'doctor_name': 'Dr. Smith',
+        'prediction': prediction,
+        'confidence': 97.5,
+        'image_path': str(tmp_path / "missing.jpg"),
+        'gradcam_path': str(tmp_path / "missing_gradcam.jpg"),
+        'notes': None,
+    }
+
+
+def test_positive_scan_uses_tumor_style(used_styles, tmp_path):
+    pdf = pdf_generator.render_medical_report(scan(TUMOR_LABEL, tmp_path))
+
+    assert pdf.startswith(b"%PDF")
+    assert pdf_generator.tumor_result_style in used_styles
+    assert pdf_generator.clear_result_style not in used_styles
+
+
+def test_negative_scan_uses_clear_style(used_styles, tmp_path):
+    pdf = pdf_generator.render_medical_report(scan("No Tumor Detected", tmp_path))
+
+    assert pdf.startswith(b"%PDF")
+    assert pdf_generator.clear_result_style in used_styles
+    assert pdf_generator.tumor_result_style not in used_styles
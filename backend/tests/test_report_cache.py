@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import report_cache
+from database import Base
+from models import Scan
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "REPORT_DIR", str(tmp_path))
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def cached_report(scan_id):
+    path = report_cache.report_path(scan_id, "0123456789abcdef")
+    with open(path, "wb") as f:
+        f.write(b"%PDF")
+    return path
+
+
+def add_scan(db):
+    scan = Scan(doctor_id=1, patient_name="P", patient_id="ID1", prediction="No Tumor Detected", confidence=90.0)
+    db.add(scan)
+    db.commit()
+    return scan
+
+
+def test_update_evicts_report_after_commit(db):
+    scan = add_scan(db)
+    path = cached_report(scan.id)
+
+    scan.notes = "Follow-up in 3 months"
+    db.flush()
+    assert os.path.exists(path)  # Flushed, not committed
+
+    db.commit()
+    assert not os.path.exists(path)
+
+
+def test_delete_evicts_report_after_commit(db):
+    scan = add_scan(db)
+    path = cached_report(scan.id)
+
+    db.delete(scan)
+    db.flush()
+    assert os.path.exists(path)
+
+    db.commit()
+    assert not os.path.exists(path)
+
+
+def test_rolled_back_change_keeps_report(db):
+    scan = add_scan(db)
+    path = cached_report(scan.id)
+
+    scan.notes = "Never saved"
+    db.flush()
+    db.rollback()
+    db.commit()
+    assert os.path.exists(path)
+
+
+def test_savepoint_rollback_keeps_outer_change_pending(db):
+    scan = add_scan(db)
+    path = cached_report(scan.id)
+
+    scan.notes = "Saved"
+    db.flush()
+    with db.begin_nested() as savepoint:
+        db.add(Scan(doctor_id=1, patient_name="Q", patient_id="ID2"))
+        db.flush()
+        savepoint.rollback()
+    db.commit()
+    assert not os.path.exists(path)
@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import migrate_storage
+from database import Base
+from models import Scan
+from storage import S3Storage, shard_path
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+BUCKET = "scans"
+PREFIX = "uploads/"
+
+
+@pytest.fixture
+def s3(tmp_path, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def make_storage(s3, tmp_path, **kwargs):
+    return S3Storage(BUCKET, PREFIX, root=str(tmp_path / "cache"), cache_files=8, client=s3, **kwargs)
+
+
+def new_key(kind="original.jpg"):
+    return f"{uuid.uuid4()}_{kind}"
+
+
+def write(storage, key, data):
+    with open(storage.local_path(key), "wb") as f:
+        f.write(data)
+
+
+def stored_objects(s3):
+    return {obj["Key"] for obj in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])}
+
+
+def test_put_uses_sharded_object_key(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    key = new_key()
+
+    write(storage, key, b"scan")
+    asyncio.run(storage.put(key))
+
+    assert stored_objects(s3) == {PREFIX + shard_path(key)}
+    head = s3.head_object(Bucket=BUCKET, Key=storage.object_key(key))
+    assert head["ContentType"] == "image/jpeg"
+
+
+def test_fetch_downloads_missing_local_copy(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    key = new_key("gradcam.jpg")
+    write(storage, key, b"overlay")
+    asyncio.run(storage.put(key))
+    os.remove(storage.local_path(key))
+
+    path = asyncio.run(storage.fetch(f"uploads/{key}"))  # Legacy paths resolve to the key
+
+    assert path == storage.local_path(key)
+    with open(path, "rb") as f:
+        assert f.read() == b"overlay"
+    assert asyncio.run(storage.fetch(new_key())) is None
+
+
+def test_exists_and_delete(s3, tmp_path):
+    storage = make_storage(s3, tmp_path)
+    key = new_key("thumb.webp")
+    write(storage, key, b"thumb")
+    asyncio.run(storage.put(key))
+    os.remove(storage.local_path(key))
+
+    assert asyncio.run(storage.exists(key))
+    asyncio.run(storage.delete(key))
+    assert not asyncio.run(storage.exists(key))
+    assert stored_objects(s3) == set()
+
+
+def test_proxied_response_streams_object(s3, tmp_path):
+    storage = make_storage(s3, tmp_path, presigned_urls=False)
+    key = new_key()
+    write(storage, key, b"x" * 3000)
+    asyncio.run(storage.put(key))
+
+    async def body(response):
+        return b"".join([chunk async for chunk in response.body_iterator])
+
+    response = asyncio.run(storage.response(key))
+    assert response.media_type == "image/jpeg"
+    assert response.headers["content-length"] == "3000"
+    assert asyncio.run(body(response)) == b"x" * 3000
+    assert asyncio.run(storage.response(new_key())) is None
+
+
+def test_presigned_response_redirects(s3, tmp_path):
+    storage = make_storage(s3, tmp_path, presigned_urls=True)
+    key = new_key()
+
+    response = asyncio.run(storage.response(key))
+
+    assert response.status_code == 307
+    assert storage.object_key(key) in response.headers["location"]
+    assert asyncio.run(storage.response(key)).headers["location"] == response.headers["location"]
+
+
+def test_migrate_storage_into_s3(s3, tmp_path, monkeypatch):
+    storage = make_storage(s3, tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(migrate_storage, "storage", storage)
+    engine = create_engine(f"sqlite:///{tmp_path / 'scans.db'}")
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(migrate_storage, "engine", engine)
+
+    # One file in the old flat layout, one already sharded locally
+    flat_key, sharded_key = new_key(), new_key("gradcam.jpg")
+    os.makedirs("uploads")
+    with open(os.path.join("uploads", flat_key), "wb") as f:
+        f.write(b"flat")
+    sharded_path = os.path.join("uploads", shard_path(sharded_key))
+    os.makedirs(os.path.dirname(sharded_path))
+    with open(sharded_path, "wb") as f:
+        f.write(b"sharded")
+    with Session(engine) as db:
+        db.add(Scan(doctor_id=1, image_path=f"uploads/{flat_key}", gradcam_path=f"uploads/{sharded_key}"))
+        db.commit()
+
+    args = argparse.Namespace(dry_run=False, delete_source=True, workers=2)
+    assert migrate_storage.migrate_files(args) == 0
+    migrate_storage.migrate_rows(args)
+
+    assert stored_objects(s3) == {storage.object_key(flat_key), storage.object_key(sharded_key)}
+    assert not os.path.exists(os.path.join("uploads", flat_key))
+    assert not os.path.exists(sharded_path)
+    with Session(engine) as db:
+        assert db.execute(select(Scan.image_path, Scan.gradcam_path)).one() == (flat_key, sharded_key)
+    engine.dispose()
@@ -0,0 +1,149 @@
+"""
+Size and format limits for uploaded scans.
+
+UploadSizeLimitMiddleware counts the request body of the upload routes as
+it arrives and answers 413 as soon as it goes over the cap (straight from
+Content-Length when the client sends one), so an oversized upload is never
+spooled in full. read_upload() then reads each file in chunks and checks
+its real format from the magic bytes instead of trusting the browser's
+content type.
+"""
+
+import io
+import os
+import zipfile
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from config import (
+    ALLOWED_EXTENSIONS, MAX_UPLOAD_SIZE, MAX_STUDY_UPLOAD_SIZE, UPLOAD_CHUNK_SIZE, BATCH_UPLOAD_MAX_FILES
+)
+from imaging import sniff_format
+
+FORM_OVERHEAD = 64 * 1024  # Patient fields and multipart boundaries
+
+# POST routes with a request body cap
+BODY_LIMITS = {
+    "/predict": MAX_UPLOAD_SIZE + FORM_OVERHEAD,
+    "/jobs": MAX_UPLOAD_SIZE + FORM_OVERHEAD,
+    "/predict/batch": MAX_STUDY_UPLOAD_SIZE,
+}
+
+def _too_large_detail(limit):
+    return f"Upload exceeds the {limit // (1024 * 1024)} MB limit"
+
+def _too_large(limit):
+    return HTTPException(status_code=413, detail=_too_large_detail(limit))
+
+
+class StudyLimitError(Exception):
+    """
+    A study archive holds too many images or expands past the study limit.
+    Plain exception (not HTTPException) so it crosses a process pool.
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadSizeLimitMiddleware:
+    def __init__(self, app, limits=BODY_LIMITS):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"])
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": _too_large_detail(limit)}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the form parser; FastAPI passes HTTPException through
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def check_extension(filename):
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension and extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type {extension}; use JPEG or PNG")
+
+async def read_upload(file: UploadFile, limit=MAX_UPLOAD_SIZE, check_format=True) -> bytes:
+    """
+    Reads one image upload in chunks; 413 over limit, 400 unless it is a
+    JPEG or PNG. Study uploads pass check_format=False and report a bad
+    image on its own result line instead.
+    """
+    if check_format:
+        check_extension(file.filename)
+    if file.size is not None and file.size > limit:
+        raise _too_large(limit)
+
+    chunks = []
+    size = 0
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if check_format and not chunks and sniff_format(chunk) is None:
+            raise HTTPException(status_code=400, detail="File must be a JPEG or PNG image")
+        size += len(chunk)
+        if size > limit:
+            raise _too_large(limit)
+        chunks.append(chunk)
+
+    if not chunks:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    return b"".join(chunks)
+
+def read_zip_member(archive, info, limit=MAX_UPLOAD_SIZE) -> bytes:
+    """One archive member, decompressed no further than limit (StudyLimitError beyond)"""
+    if info.file_size > limit:
+        raise StudyLimitError(413, _too_large_detail(limit))
+    with archive.open(info) as member:
+        data = member.read(limit + 1)
+    if len(data) > limit:
+        raise StudyLimitError(413, _too_large_detail(limit))
+    return data
+
+def read_zip_images(data: bytes, max_files=BATCH_UPLOAD_MAX_FILES, max_bytes=MAX_STUDY_UPLOAD_SIZE):
+    """
+    (file name, bytes) of the image members of a study archive, in archive
+    order. Counts members and decompressed bytes as it goes and stops at
+    max_files images or max_bytes in total, so a small archive of highly
+    compressible members can't expand without bound. Blocking: run it on
+    cpu_pool.
+    """
+    images = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                continue
+            if os.path.splitext(name)[1].lower() not in ALLOWED_EXTENSIONS:
+                continue
+            if len(images) >= max_files:
+                raise StudyLimitError(400, f"At most {BATCH_UPLOAD_MAX_FILES} images per study")
+            content = read_zip_member(archive, info, MAX_UPLOAD_SIZE)
+            max_bytes -= len(content)
+            if max_bytes < 0:
+                raise StudyLimitError(413, _too_large_detail(MAX_STUDY_UPLOAD_SIZE))
+            images.append((os.path.basename(name), content))
+    return images